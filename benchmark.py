@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Runs without a display, before Qt gets imported
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import PyQt5.QtCore as QtCore
+import PyQt5.QtGui as QtGui
+import PyQt5.QtTest as QtTest
+import PyQt5.QtWidgets as QtWidgets
+
+
+# Megabytes of the generated documents
+SIZES = [1, 10, 100]
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Appears in the generated logs once, for the rare needle
+RARE_NEEDLE = 'checksum mismatch 0x5f3759df'
+
+LOG_LEVELS = ['DEBUG', 'INFO', 'INFO', 'INFO', 'WARNING', 'ERROR']
+LOG_WORDS = ['request', 'served', 'cache', 'miss', 'user', 'session', 'opened', 'closed',
+             'retry', 'timeout', 'worker', 'queue', 'flushed', 'bytes', 'connection']
+
+
+def python_source(size, seed=0):
+    """ About size bytes of Python, with names varying so blocks don't repeat """
+
+    chance = random.Random(seed)
+    parts = []
+    written = 0
+    nth = 0
+
+    while written < size:
+        name = 'handler_{}'.format(nth)
+        text = ('class {cls}(object):\n'
+                '    """ Handle the requests of kind {nth} """\n'
+                '\n'
+                '    def {name}(self, value={number}, *args):\n'
+                '        # scale the value when it is positive\n'
+                '        if value > {number} and not self.closed:\n'
+                '            return [value * {other}, "{name}", {{"key": None}}]\n'
+                '        for item in range({other}):\n'
+                '            self.total += item ** 2 // (value or 1)\n'
+                '        return self.total == {number}\n'
+                '\n').format(cls='Kind{}'.format(nth), name=name, nth=nth,
+                             number=chance.randrange(1000), other=chance.randrange(1000))
+        parts.append(text)
+        written += len(text)
+        nth += 1
+
+    return ''.join(parts)
+
+
+def log_text(size, seed=0):
+    """ About size bytes of log lines, with RARE_NEEDLE on a single line in the middle """
+
+    chance = random.Random(seed)
+    lines = []
+    written = 0
+    nth = 0
+
+    while written < size:
+        line = '2024-03-{:02d} {:02d}:{:02d}:{:02d}.{:03d} {:<7} [{}] {}\n'.format(
+            nth // 86400 % 28 + 1, nth // 3600 % 24, nth // 60 % 60, nth % 60, chance.randrange(1000),
+            chance.choice(LOG_LEVELS), 'worker-{}'.format(chance.randrange(16)),
+            ' '.join(chance.choice(LOG_WORDS) for _ in range(chance.randrange(4, 12))))
+        lines.append(line)
+        written += len(line)
+        nth += 1
+
+    lines[len(lines) // 2] = '2024-03-14 12:00:00.000 ERROR   [worker-0] {}\n'.format(RARE_NEEDLE)
+    return ''.join(lines)
+
+
+def pump(condition, timeout=600):
+    """ Process events until condition() is true """
+
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise RuntimeError('Timed out waiting for the editor')
+        QtWidgets.QApplication.processEvents(QtCore.QEventLoop.AllEvents, 10)
+
+
+def best_of(repeat, function):
+    """ Fastest of repeat runs of function, in seconds """
+
+    timings = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - begin)
+    return min(timings)
+
+
+# BENCHMARKS
+
+def bench_highlight(text, repeat):
+    """ PythonHighlighter.highlightBlock over every block of a document """
+
+    import highlighter
+
+    document = QtGui.QTextDocument()
+    document.setDocumentLayout(QtWidgets.QPlainTextDocumentLayout(document))
+    document.setPlainText(text)
+
+    syntax = highlighter.PythonHighlighter(None)
+
+    def run():
+        # A cold cache, every block is tokenized
+        syntax.tokenizer.cache.clear()
+        syntax.setDocument(document)
+        syntax.rehighlight()
+        syntax.setDocument(None)
+
+    return {'seconds': best_of(repeat, run), 'blocks': document.blockCount()}
+
+
+def load_text(notepad, text):
+    """ Show text in a new tab of the editor, as a clean document """
+
+    notepad.new_tab()
+    notepad.text_widget.document().setUndoRedoEnabled(False)
+    notepad.text_widget.setPlainText(text)
+    notepad.text_widget.document().setUndoRedoEnabled(True)
+    notepad.need_saving(False)
+
+
+def bench_search(notepad, text, repeat):
+    """ Notepad.search_text for a common and a rare needle, until the search finished """
+
+    load_text(notepad, text)
+    notepad.finder_toolbar.setHidden(False)
+    engine = notepad.search_engine
+    results = {}
+
+    for kind, needle in (('common', 'INFO'), ('rare', RARE_NEEDLE)):
+
+        def run():
+            # The finder searches once its text stopped changing, search now instead
+            notepad.finder.setText('')
+            notepad.search_text()
+            # The engine keeps indexes of recent queries, a search must not come from it
+            engine.cache.clear()
+            notepad.finder.setText(needle)
+            notepad.search_text()
+            pump(lambda: not engine.searching)
+
+        results[kind] = {'seconds': best_of(repeat, run), 'matches': len(engine.index),
+                         'timed_out': engine.timed_out}
+
+    notepad.finder.setText('')
+    notepad.finder_toolbar.setHidden(True)
+    close_tab(notepad)
+    return results
+
+
+def bench_keystroke(notepad, text, repeat, keystrokes=200):
+    """ update_statusbar alone, and whole keystrokes typed in the middle of a document """
+
+    load_text(notepad, text)
+    editor = notepad.text_widget
+
+    cursor = editor.textCursor()
+    cursor.setPosition(len(text) // 2)
+    editor.setTextCursor(cursor)
+
+    def update_statusbar():
+        for _ in range(keystrokes):
+            notepad.update_statusbar()
+
+    def type_keys():
+        for _ in range(keystrokes):
+            QtTest.QTest.keyClick(editor, QtCore.Qt.Key_X)
+        QtWidgets.QApplication.processEvents()
+
+    results = {
+        'update_statusbar_us': best_of(repeat, update_statusbar) / keystrokes * 1e6,
+        'keystroke_us': best_of(repeat, type_keys) / keystrokes * 1e6,
+    }
+
+    close_tab(notepad)
+    return results
+
+
+def bench_file_io(notepad, text, repeat, directory):
+    """ Open a file in a tab and save it back """
+
+    path = os.path.join(directory, 'round_trip.txt')
+    with open(path, 'w', encoding='utf-8', newline='') as file_open:
+        file_open.write(text)
+
+    def open_file():
+        notepad.new_tab()
+        notepad.open_file(path)
+        pump(lambda: notepad.reader is None)
+
+    def save_file():
+        notepad.start_save((path, ''))
+        pump(lambda: notepad.writer is None)
+
+    results = {}
+    for kind, function in (('open', open_file), ('save', save_file)):
+        timings = []
+        for _ in range(repeat):
+            if kind == 'save':
+                open_file()
+            begin = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - begin)
+            close_tab(notepad)
+        results[kind] = {'seconds': min(timings), 'mb_per_second': len(text) / (1 << 20) / min(timings)}
+
+    return results
+
+
+def close_tab(notepad):
+    notepad.need_saving(False)
+    notepad.close_current_tab()
+
+
+def run_benchmarks(sizes, repeat):
+    """ Results of every benchmark, by name """
+
+    directory = tempfile.TemporaryDirectory()
+
+    # Journals and their recovery stay in the temporary directory
+    os.environ['HOME'] = os.environ['USERPROFILE'] = directory.name
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    import notepad
+    editor = notepad.Notepad()
+    pump(lambda: editor.menus_built)
+
+    results = {}
+    for size in sizes:
+        print('Generating {} MB documents...'.format(size), file=sys.stderr)
+        source = python_source(size << 20)
+        log = log_text(size << 20)
+        # Large documents are timed once
+        times = repeat if size < 100 else 1
+
+        steps = [
+            ('highlight/{}MB'.format(size), lambda source=source: bench_highlight(source, times)),
+            ('search/{}MB'.format(size), lambda log=log: bench_search(editor, log, times)),
+            ('keystroke/{}MB'.format(size), lambda log=log: bench_keystroke(editor, log, times)),
+            ('file_io/{}MB'.format(size), lambda log=log: bench_file_io(editor, log, times, directory.name)),
+        ]
+
+        for name, step in steps:
+            print('Running {}...'.format(name), file=sys.stderr)
+            results[name] = step()
+
+        # The documents of the next size are generated without these in memory
+        del steps, source, log
+
+    editor.finish_jobs()
+    for tab in editor.open_tabs:
+        tab.has_changed = False
+    editor.close()
+    app.processEvents()
+    directory.cleanup()
+
+    return results
+
+
+# REPORT
+
+def flatten(results, prefix=''):
+    """ Timings of nested results as {'name/metric': value} """
+
+    values = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            values.update(flatten(value, name + '/'))
+        elif isinstance(value, float) and (key == 'seconds' or key.endswith('_us')):
+            values[name] = value
+    return values
+
+
+def compare(results, baseline, tolerance):
+    """ (name, baseline, current, ratio, regressed) of the timings found in both """
+
+    current = flatten(results)
+    previous = flatten(baseline)
+
+    rows = []
+    for name in sorted(current):
+        if name not in previous or not previous[name]:
+            continue
+        ratio = current[name] / previous[name]
+        rows.append((name, previous[name], current[name], ratio, ratio > 1 + tolerance))
+    return rows
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'qt': QtCore.QT_VERSION_STR,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+    }
+
+
+def main(args=None):
+
+    parser = argparse.ArgumentParser(description='Time the hot paths of Notepad without a display')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, metavar='MB',
+                        help='megabytes of the generated documents (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per timing, the fastest is kept')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', default=BASELINE, help='results to compare with (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown over the baseline counted as a regression (default: %(default)s)')
+    options = parser.parse_args(args)
+
+    report = {'environment': environment(), 'results': run_benchmarks(options.sizes, options.repeat)}
+
+    regressions = 0
+    if os.path.isfile(options.baseline) and not options.save_baseline:
+        with open(options.baseline, encoding='utf-8') as file_open:
+            baseline = json.load(file_open)
+
+        rows = compare(report['results'], baseline['results'], options.tolerance)
+        report['comparison'] = [{'name': name, 'baseline': previous, 'current': current,
+                                 'ratio': ratio, 'regressed': regressed}
+                                for name, previous, current, ratio, regressed in rows]
+        regressions = sum(row[4] for row in rows)
+
+        if baseline.get('environment') != report['environment']:
+            print('The baseline comes from another environment', file=sys.stderr)
+        for name, previous, current, ratio, regressed in rows:
+            print('{:<40} {:>12.6f} {:>12.6f} {:>7.2f}x{}'.format(name, previous, current, ratio,
+                                                               '  REGRESSED' if regressed else ''))
+        if rows:
+            print('Geometric mean ratio {:.2f}x, {} regressions'.format(
+                statistics.geometric_mean([row[3] for row in rows]), regressions))
+    else:
+        for name, value in sorted(flatten(report['results']).items()):
+            print('{:<40} {:>12.6f}'.format(name, value))
+
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as file_open:
+            file_open.write(text + '\n')
+    if options.save_baseline:
+        with open(options.baseline, 'w', encoding='utf-8') as file_open:
+            file_open.write(text + '\n')
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
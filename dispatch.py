@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import PyQt5.QtCore as QtCore
+
+
+# Policies of a subscription
+
+# Run on every mark
+IMMEDIATE = 'immediate'
+# Run once per event loop turn, after the events queued with the marks
+NEXT_FRAME = 'next frame'
+# Run once no mark came for the delay of the subscription
+DEBOUNCED = 'debounced'
+
+
+class Subscription:
+    """ A callback run by a Dispatcher when marked dirty, as its policy says """
+
+    def __init__(self, dispatcher, callback, policy, delay):
+
+        self.dispatcher = dispatcher
+        self.callback = callback
+        self.policy = policy
+        self.pending = False
+
+        self.timer = QtCore.QTimer(dispatcher)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.run)
+
+        # Number of marks and of runs, a burst of marks should cost a run
+        self.marks = 0
+        self.runs = 0
+
+    def mark(self, *args):
+        """ Slot marking the callback dirty, ignoring the signal arguments """
+
+        self.marks += 1
+
+        if self.policy == IMMEDIATE:
+            self.run()
+        elif self.policy == DEBOUNCED:
+            self.pending = True
+            self.timer.start()
+        elif not self.pending:
+            self.pending = True
+            self.dispatcher.schedule(self)
+
+    def run(self):
+
+        self.timer.stop()
+        self.pending = False
+        self.runs += 1
+        self.callback()
+
+    def flush(self):
+        """ Run now if marked, for actions that need the callback to be done """
+
+        if self.pending:
+            self.run()
+
+
+class Dispatcher(QtCore.QObject):
+    """ Coalesce the handlers of frequent signals
+
+    Signals like textChanged and cursorPositionChanged can fire many times
+    for a single paste or replace. Instead of running their handlers each
+    time, they mark subscriptions dirty: next frame subscriptions all run
+    once the event loop got back to the timer of the dispatcher, in the
+    order they were first marked, and debounced ones once the marks stop.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.scheduled = []
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.flush)
+
+    def subscribe(self, callback, policy=NEXT_FRAME, delay=0):
+        """ Subscription running callback, whose mark method is connected to signals """
+
+        return Subscription(self, callback, policy, delay)
+
+    def schedule(self, subscription):
+        self.scheduled.append(subscription)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        """ Run the next frame subscriptions marked since the last flush """
+
+        scheduled, self.scheduled = self.scheduled, []
+        for subscription in scheduled:
+            subscription.flush()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import codecs
+import hashlib
+import io
+import locale
+import os
+import queue
+import stat
+import tempfile
+import threading
+from array import array
+
+import PyQt5.QtCore as QtCore
+
+
+# Byte order marks, UTF-32 first since its little endian mark starts like UTF-16's
+BYTE_ORDER_MARKS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Tried in order when the head of a file isn't UTF-8, latin-1 decodes any byte
+FALLBACK_ENCODINGS = ['cp1252', 'latin-1']
+
+# Bytes the encoding can't decode, as in logs mixing encodings, become lone
+# surrogates that are encoded back to the same bytes when saving
+DECODE_ERRORS = 'surrogateescape'
+
+
+def default_encoding():
+    """ Encoding of new files """
+    return locale.getpreferredencoding(False)
+
+
+def detect_encoding(sample):
+    """ Encoding of a file from a sample of its first bytes """
+
+    for mark, encoding in BYTE_ORDER_MARKS:
+        if sample.startswith(mark):
+            return encoding
+
+    # Not final, the sample may end in the middle of a character
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    for encoding in [default_encoding()] + FALLBACK_ENCODINGS:
+        try:
+            sample.decode(encoding)
+            return codecs.lookup(encoding).name
+        except (UnicodeDecodeError, LookupError):
+            pass
+
+    return 'latin-1'
+
+
+def file_stamp(path):
+    """ Size and modification time identifying the contents of a file """
+
+    if not path or not os.path.isfile(path):
+        return None
+    status = os.stat(path)
+    return [status.st_size, status.st_mtime_ns]
+
+
+def new_digest():
+    """ Hash of the bytes of a file, to tell whether it really changed """
+    return hashlib.blake2b(digest_size=16)
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+
+    digest = new_digest()
+    with open(path, 'rb') as file_open:
+        for data in iter(lambda: file_open.read(chunk_size), b''):
+            digest.update(data)
+    return digest.digest()
+
+
+class LineHashes:
+    """ Hashes of the lines of a text read in chunks, to diff it with another version later """
+
+    def __init__(self, keep_lines=False):
+        self.hashes = array('q')
+        self.lines = [] if keep_lines else None
+        self.tail = ''
+
+    def update(self, text):
+        lines = (self.tail + text).split('\n')
+        self.tail = lines.pop()
+        self.hashes.extend(map(hash, lines))
+        if self.lines is not None:
+            self.lines.extend(lines)
+
+    def finish(self):
+        """ Hashes of every line, one per QTextDocument block """
+
+        self.hashes.append(hash(self.tail))
+        if self.lines is not None:
+            self.lines.append(self.tail)
+        self.tail = ''
+        return self.hashes
+
+
+def detect_file_encoding(path, sample_size=64 * 1024):
+    with open(path, 'rb') as file_open:
+        return detect_encoding(file_open.read(sample_size))
+
+
+class FileReader(QtCore.QThread):
+    """ Read and decode a file in chunks off the GUI thread
+
+    Decoded chunks are handed over through a bounded queue, so at most
+    queue_size chunks wait for the GUI thread besides the document itself.
+    Each item is a (text, bytes read) tuple, then None once the file is
+    read, or the exception that stopped the read.
+
+    Without an encoding, it is detected from the first chunk before the
+    first item is queued. Bytes the encoding can't decode, as in logs
+    mixing encodings, are escaped instead of failing the read. Once the
+    whole file is read, digest holds the hash of its bytes and line_hashes
+    the hashes of its lines.
+    """
+
+    # Bytes read and decoded at a time
+    chunk_size = 256 * 1024
+
+    def __init__(self, path, encoding=None, queue_size=4):
+        super().__init__()
+
+        self.path = path
+        self.encoding = encoding
+        self.size = os.path.getsize(path)
+        self.digest = None
+        self.line_hashes = None
+        self.chunks = queue.Queue(queue_size)
+        self.cancelled = threading.Event()
+
+    def run(self):
+
+        try:
+            with open(self.path, 'rb') as file_open:
+                data = file_open.read(self.chunk_size)
+                if self.encoding is None:
+                    self.encoding = detect_encoding(data)
+
+                # Same newline translation as a file opened in text mode
+                decoder = codecs.getincrementaldecoder(self.encoding)(errors=DECODE_ERRORS)
+                decoder = io.IncrementalNewlineDecoder(decoder, True)
+                digest = new_digest()
+                line_hashes = LineHashes()
+
+                while not self.cancelled.is_set():
+                    digest.update(data)
+                    text = decoder.decode(data, final=not data)
+                    line_hashes.update(text)
+                    if text and not self.put((text, file_open.tell())):
+                        return
+                    if not data:
+                        self.digest = digest.digest()
+                        self.line_hashes = line_hashes.finish()
+                        break
+                    data = file_open.read(self.chunk_size)
+
+        except (OSError, UnicodeDecodeError, LookupError) as why:
+            self.put(why)
+            return
+
+        self.put(None)
+
+    def put(self, item):
+        """ Queue item, giving up if the read gets cancelled while waiting """
+
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+def document_chunks(document, chunk_size=256 * 1024):
+    """ Yield the plain text of a QTextDocument block by block, in chunks of about chunk_size characters """
+
+    parts = []
+    size = 0
+    block = document.begin()
+
+    while block.isValid():
+        # Same text as toPlainText(), which turns line separators into newlines
+        text = block.text().replace('\u2028', '\n')
+        parts.append(text)
+        size += len(text) + 1
+
+        block = block.next()
+        if block.isValid():
+            parts.append('\n')
+
+        if size >= chunk_size:
+            yield ''.join(parts)
+            parts = []
+            size = 0
+
+    text = ''.join(parts)
+    if text:
+        yield text
+
+
+class FileWriter(QtCore.QThread):
+    """ Write a file from text chunks handed over by the GUI thread
+
+    The text goes to a temporary file in the directory of path, which
+    replaces path only once it is completely written and synced to disk,
+    so a failed or cancelled save leaves the original file untouched. The
+    replacement keeps the permissions of the file, and a symbolic link is
+    followed so the file it points to is replaced rather than the link.
+    Chunks come through a bounded queue and None ends the file. Once the
+    thread finished, error holds the exception that stopped the save,
+    digest the hash of the bytes written and line_hashes the hashes of
+    the lines.
+    """
+
+    def __init__(self, path, encoding=None, queue_size=4):
+        super().__init__()
+
+        self.path = path
+        self.encoding = encoding or default_encoding()
+        self.chunks = queue.Queue(queue_size)
+        self.cancelled = threading.Event()
+        self.error = None
+        self.digest = None
+        self.line_hashes = None
+
+    def run(self):
+
+        temp_path = None
+        try:
+            target = os.path.realpath(self.path)
+            directory = os.path.dirname(target)
+            handle, temp_path = tempfile.mkstemp(prefix='.{}.'.format(os.path.basename(target)),
+                                                 suffix='.tmp', dir=directory)
+
+            # Encoded here rather than by a text file, to hash the bytes written
+            encoder = codecs.getincrementalencoder(self.encoding)(errors=DECODE_ERRORS)
+            digest = new_digest()
+            line_hashes = LineHashes()
+
+            with open(handle, 'wb') as file_open:
+                text = self.get()
+                while text is not None:
+                    line_hashes.update(text)
+                    # Same newline translation as a file opened in text mode
+                    data = encoder.encode(text.replace('\n', os.linesep))
+                    digest.update(data)
+                    file_open.write(data)
+                    text = self.get()
+                data = encoder.encode('', final=True)
+                digest.update(data)
+                file_open.write(data)
+                file_open.flush()
+                os.fsync(file_open.fileno())
+
+            if self.cancelled.is_set():
+                return
+
+            # mkstemp creates the file readable by its owner only
+            os.chmod(temp_path, self.file_mode(target))
+            os.replace(temp_path, target)
+            temp_path = None
+            self.digest = digest.digest()
+            self.line_hashes = line_hashes.finish()
+            self.sync_directory(directory)
+
+        except (OSError, UnicodeEncodeError, LookupError) as why:
+            self.error = why
+
+        finally:
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def get(self):
+        """ Next chunk of text, None at the end of the file or once cancelled """
+
+        while not self.cancelled.is_set():
+            try:
+                return self.chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    @staticmethod
+    def file_mode(path):
+        """ Permissions of the file being replaced, or the default ones for a new file """
+
+        try:
+            return stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            return 0o666 & ~umask
+
+    @staticmethod
+    def sync_directory(directory):
+        """ Make the rename itself durable, where directories can be opened """
+
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+
+        handle = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(handle)
+        finally:
+            os.close(handle)
+
+    def cancel(self):
+        self.cancelled.set()
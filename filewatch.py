@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import codecs
+import io
+import os
+
+import PyQt5.QtCore as QtCore
+import PyQt5.QtGui as QtGui
+import fileio
+
+
+def common_prefix_length(old, new, step=64 * 1024):
+    """ Length of the common start of two byte buffers, compared a slice at a time """
+
+    old = memoryview(old)
+    new = memoryview(new)
+    size = min(len(old), len(new))
+
+    begin = 0
+    while begin < size and old[begin:begin + step] == new[begin:begin + step]:
+        begin += step
+    if begin >= size:
+        return size
+
+    low, high = begin, min(begin + step, size)
+    while low < high:
+        middle = (low + high) // 2
+        if old[low:middle + 1] == new[low:middle + 1]:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def common_line_count(old, new, old_first, new_first):
+    """ Number of equal line hashes from old_first in old and new_first in new """
+
+    item = old.itemsize
+    return common_prefix_length(memoryview(old).cast('B')[old_first * item:],
+                                memoryview(new).cast('B')[new_first * item:]) // item
+
+
+def first_positions(hashes, step=64 * 1024):
+    """ Line number of the first line with each hash """
+
+    # Filled a slice at a time from the end, which keeps the GIL for short
+    # stretches and lets earlier lines overwrite later ones
+    positions = {}
+    for end in range(len(hashes), 0, -step):
+        begin = max(0, end - step)
+        positions.update(zip(reversed(hashes[begin:end]), range(end - 1, begin - 1, -1)))
+    return positions
+
+
+def diff_lines(old, new, anchor=3):
+    """ (old first, old last, new first, new last) ranges of the line hashes that differ
+
+    Equal lines are skipped a memory compare at a time. After a
+    difference, both sides are searched, one line further at a time, for
+    the closest line that starts anchor equal lines in the other one,
+    which is where the next equal run starts. This is linear, unlike
+    difflib, at the cost of longer hunks around repeated lines.
+    """
+
+    ranges = []
+    old_positions = new_positions = None
+    old_line = new_line = 0
+
+    while True:
+        equal = common_line_count(old, new, old_line, new_line)
+        old_line += equal
+        new_line += equal
+
+        if old_line == len(old) or new_line == len(new):
+            if old_line < len(old) or new_line < len(new):
+                ranges.append((old_line, len(old), new_line, len(new)))
+            return ranges
+
+        if old_positions is None:
+            old_positions = first_positions(old)
+            new_positions = first_positions(new)
+
+        def anchored(old_first, new_first):
+            # equal lines enough to resume, fewer at the very end
+            needed = min(anchor, len(old) - old_first, len(new) - new_first)
+            return common_line_count(old, new, old_first, new_first) >= needed
+
+        found = None
+        for distance in range(max(len(old) - old_line, len(new) - new_line)):
+            if old_line + distance < len(old):
+                match = new_positions.get(old[old_line + distance], -1)
+                if match >= new_line and anchored(old_line + distance, match):
+                    found = (old_line + distance, match)
+                    break
+            if new_line + distance < len(new):
+                match = old_positions.get(new[new_line + distance], -1)
+                if match >= old_line and anchored(match, new_line + distance):
+                    found = (match, new_line + distance)
+                    break
+
+        if found is None:
+            ranges.append((old_line, len(old), new_line, len(new)))
+            return ranges
+
+        ranges.append((old_line, found[0], new_line, found[1]))
+        old_line, new_line = found
+
+
+def apply_hunks(document, hunks):
+    """ Replace ranges of lines of a document, as a single undo step
+
+    Each hunk is (first, last, lines): the blocks first to last (excluded)
+    are replaced by lines, which have no newline.
+    """
+
+    count = document.blockCount()
+    cursor = QtGui.QTextCursor(document)
+
+    for nth, (first, last, lines) in enumerate(reversed(hunks)):
+        if last < count:
+            begin = document.findBlockByNumber(first).position()
+            end = document.findBlockByNumber(last).position()
+            text = ''.join(line + '\n' for line in lines)
+        elif first > 0:
+            # Up to the end, replace from the newline ending the line before
+            previous = document.findBlockByNumber(first - 1)
+            begin = previous.position() + previous.length() - 1
+            end = document.characterCount() - 1
+            text = ''.join('\n' + line for line in lines)
+        else:
+            begin = 0
+            end = document.characterCount() - 1
+            text = '\n'.join(lines)
+
+        # An edit block joined to the previous one per hunk: a single undo
+        # step, but a contentsChange per hunk instead of one spanning them all
+        if nth:
+            cursor.joinPreviousEditBlock()
+        else:
+            cursor.beginEditBlock()
+        cursor.setPosition(begin)
+        cursor.setPosition(end, QtGui.QTextCursor.KeepAnchor)
+        cursor.insertText(text)
+        cursor.endEditBlock()
+
+
+class DiffWorker(QtCore.QThread):
+    """ Read a file again and diff its lines with those of its document
+
+    The document lines are given by their hashes, as kept since the file
+    was read or saved, or else as text to hash. Once the thread finished,
+    hunks holds the line replacements for apply_hunks, size, digest and
+    line_hashes describe the file read, or error holds the exception that
+    stopped the read.
+    """
+
+    def __init__(self, path, encoding, line_hashes=None, text=None):
+        super().__init__()
+
+        self.path = path
+        self.encoding = encoding
+        self.line_hashes = line_hashes
+        self.text = text
+        self.hunks = []
+        self.size = 0
+        self.digest = None
+        self.error = None
+
+    def run(self):
+
+        try:
+            # Same decoding as fileio.FileReader, a chunk at a time so the
+            # GIL is released in between
+            decoder = codecs.getincrementaldecoder(self.encoding)(errors=fileio.DECODE_ERRORS)
+            decoder = io.IncrementalNewlineDecoder(decoder, True)
+            digest = fileio.new_digest()
+            new_lines = fileio.LineHashes(keep_lines=True)
+
+            with open(self.path, 'rb') as file_open:
+                for data in iter(lambda: file_open.read(fileio.FileReader.chunk_size), b''):
+                    digest.update(data)
+                    new_lines.update(decoder.decode(data))
+                    self.size += len(data)
+                new_lines.update(decoder.decode(b'', final=True))
+
+        except (OSError, LookupError) as why:
+            self.error = why
+            return
+
+        self.digest = digest.digest()
+
+        old_hashes = self.line_hashes
+        if old_hashes is None:
+            old_lines = fileio.LineHashes()
+            for begin in range(0, len(self.text), fileio.FileReader.chunk_size):
+                old_lines.update(self.text[begin:begin + fileio.FileReader.chunk_size])
+            old_hashes = old_lines.finish()
+            self.text = None
+
+        self.line_hashes = new_lines.finish()
+
+        for old_first, old_last, new_first, new_last in diff_lines(old_hashes, self.line_hashes):
+            self.hunks.append((old_first, old_last, new_lines.lines[new_first:new_last]))
+
+
+class HashWorker(QtCore.QThread):
+    """ Hash a file off the GUI thread """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.digest = None
+
+    def run(self):
+        try:
+            self.digest = fileio.file_digest(self.path)
+        except OSError:
+            pass
+
+
+class ChangeWatcher(QtCore.QObject):
+    """ Tell when a watched file changes on disk
+
+    The size, modification time and digest of each file are cached. A
+    notification that changed the size or time is confirmed by hashing
+    the file on a HashWorker, so touching a file or saving it from here
+    doesn't count as a change. Directories are watched as well, to notice
+    files replaced by a rename.
+    """
+
+    # Emitted with the path of a file whose contents changed
+    changed = QtCore.pyqtSignal(str)
+
+    # Milliseconds notifications are batched for
+    check_delay = 200
+
+    def __init__(self):
+        super().__init__()
+
+        self.files = {}
+        self.hash_workers = {}
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.check_delay)
+        self.timer.timeout.connect(self.check)
+
+        self.watcher = QtCore.QFileSystemWatcher()
+        self.watcher.fileChanged.connect(self.schedule)
+        self.watcher.directoryChanged.connect(self.schedule)
+
+    def watch(self, path, digest=None):
+        """ Watch path, whose contents are now known to hash to digest """
+
+        path = os.path.abspath(path)
+        self.files[path] = (fileio.file_stamp(path), digest)
+        self.update_watches()
+
+    def unwatch(self, path):
+        self.files.pop(os.path.abspath(path), None)
+        self.update_watches()
+
+    def update_watches(self):
+
+        paths = set(self.files)
+        paths.update(os.path.dirname(path) for path in self.files)
+
+        watched = set(self.watcher.files() + self.watcher.directories())
+        if watched - paths:
+            self.watcher.removePaths(list(watched - paths))
+        missing = [path for path in paths - watched if os.path.exists(path)]
+        if missing:
+            self.watcher.addPaths(missing)
+
+    def schedule(self, path=''):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def check(self):
+        """ Look for watched files whose size or modification time changed """
+
+        self.update_watches()
+
+        for path, (stamp, digest) in list(self.files.items()):
+            new_stamp = fileio.file_stamp(path)
+            if new_stamp is None or new_stamp == stamp or path in self.hash_workers:
+                continue
+
+            if digest is None:
+                self.files[path] = (new_stamp, None)
+                self.changed.emit(path)
+                continue
+
+            worker = HashWorker(path)
+            worker.known = self.files[path]
+            worker.finished.connect(lambda worker=worker, stamp=new_stamp: self.hashed(worker, stamp))
+            self.hash_workers[path] = worker
+            worker.start()
+
+    def hashed(self, worker, stamp):
+
+        path = worker.path
+        del self.hash_workers[path]
+
+        # Unwatched, or watched again with new contents, while hashing
+        if self.files.get(path) is not worker.known or worker.digest is None:
+            self.schedule()
+            return
+
+        self.files[path] = (stamp, worker.digest)
+        if worker.digest != worker.known[1]:
+            self.changed.emit(path)
+
+        # Changes made while hashing
+        self.schedule()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import fnmatch
+import functools
+import mmap
+import multiprocessing
+import os
+import re
+import time
+
+import PyQt5.QtCore as QtCore
+import PyQt5.QtWidgets as QtWidgets
+import fileio
+import largefile
+import search
+
+
+# Bytes looked at for a NUL to tell binary files apart
+BINARY_SAMPLE = 8 * 1024
+
+
+def is_binary(sample):
+    """ Whether the start of a file looks binary, UTF-16 and UTF-32 files included """
+    return b'\0' in sample
+
+
+def split_filters(filters):
+    """ Glob patterns of a filter like '*.py; *.txt', all files when empty """
+
+    patterns = [pattern.strip() for pattern in filters.replace(',', ';').split(';')]
+    return [pattern for pattern in patterns if pattern] or ['*']
+
+
+def walk_files(root, patterns, interrupted=lambda: False):
+    """ Paths of the files under root whose name matches one of patterns, hidden directories skipped """
+
+    for directory, directories, files in os.walk(root):
+        if interrupted():
+            return
+        directories[:] = sorted(name for name in directories if not name.startswith('.'))
+        for name in sorted(files):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                yield os.path.join(directory, name)
+
+
+def chunked(items, size):
+    """ Lists of up to size items """
+
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def scan_file(path, matcher, max_hits, window_size=1024 * 1024, max_line_chars=1024):
+    """ Pool side of a search: (path, hits) for a file, hits None if it was skipped
+
+    Each hit is (line, column, length, line text), with the line 0 based
+    and the column counted in characters, like the editor does. The file
+    is decoded a window at a time and scanned by the search.Matcher, so
+    characters, case and word boundaries are seen as the editor does.
+    """
+
+    try:
+        with open(path, 'rb') as file_open:
+            size = os.fstat(file_open.fileno()).st_size
+            if not size:
+                return path, []
+
+            with mmap.mmap(file_open.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                sample = data[:BINARY_SAMPLE]
+                if is_binary(sample):
+                    return path, None
+
+                encoding = fileio.detect_encoding(sample)
+                codec = largefile.window_codec(encoding)
+
+                # A literal query whose bytes aren't in the file can't match, skip decoding it
+                if matcher.pattern is None:
+                    try:
+                        if data.find(matcher.query.encode(codec, fileio.DECODE_ERRORS)) < 0:
+                            return path, []
+                    except UnicodeEncodeError:
+                        return path, []
+
+                hits = []
+                line = position = 0
+
+                while position < size:
+                    end = largefile.window_end(data, position, size, window_size)
+                    # The first window drops the byte order mark, as the editor does
+                    text = data[position:end].decode(codec if position else encoding, fileio.DECODE_ERRORS)
+                    starts, lengths, _ = matcher.scan(text)
+
+                    counted = 0
+                    for start, length in zip(starts, lengths):
+                        line += text.count('\n', counted, start)
+                        counted = start
+
+                        line_begin = text.rfind('\n', 0, start) + 1
+                        line_end = text.find('\n', start, line_begin + max_line_chars)
+                        if line_end < 0:
+                            line_end = min(len(text), line_begin + max_line_chars)
+
+                        hits.append((line, start - line_begin, length, text[line_begin:line_end].rstrip('\r')))
+                        if len(hits) >= max_hits:
+                            return path, hits
+
+                    line += text.count('\n', counted)
+                    position = end
+
+                return path, hits
+
+    except (OSError, ValueError, LookupError):
+        return path, None
+
+
+def scan_files(paths, key, max_hits):
+    """ Pool task: scan_file for a chunk of paths """
+
+    matcher = search.Matcher(*key)
+    return [scan_file(path, matcher, max_hits) for path in paths]
+
+
+class FindInFilesWorker(QtCore.QThread):
+    """ Search the files under a directory with a process pool
+
+    The directory is walked lazily while a pool of one process per core
+    maps and scans the files. User written patterns can backtrack for
+    ever, so the pool is terminated rather than waited for when the
+    search is interrupted. Hits come out in batches through found.
+    """
+
+    # List of (path, hits) of the files with hits since the last batch
+    found = QtCore.pyqtSignal(object)
+    # Number of files searched so far
+    progress = QtCore.pyqtSignal(int)
+
+    # Seconds between two batches, and between two checks for interruption
+    batch_interval = 0.1
+    # Files handed to a pool process at a time
+    chunk_size = 16
+    # Hits kept per file and in total
+    max_file_hits = 1000
+    max_hits = 20000
+
+    def __init__(self, root, filters, matcher):
+        super().__init__()
+
+        self.root = root
+        self.patterns = split_filters(filters)
+        self.key = matcher.key
+
+        self.searched = 0
+        self.skipped = 0
+        self.hit_count = 0
+        self.truncated = False
+        self.error = None
+
+    def run(self):
+
+        try:
+            context = multiprocessing.get_context('spawn')
+            pool = context.Pool(os.cpu_count() or 1)
+        except OSError as why:
+            self.error = why
+            return
+
+        try:
+            # Chunked here: with a chunksize, imap_unordered results can't be waited on with a timeout
+            chunks = chunked(walk_files(self.root, self.patterns, self.isInterruptionRequested), self.chunk_size)
+            results = pool.imap_unordered(functools.partial(scan_files, key=self.key, max_hits=self.max_file_hits),
+                                          chunks)
+            self.collect(results)
+        finally:
+            # terminate kills a pattern stuck backtracking, close would wait for it
+            pool.terminate()
+            pool.join()
+
+    def collect(self, results):
+
+        batch = []
+        sent = time.monotonic()
+
+        while not self.isInterruptionRequested():
+            try:
+                scanned = results.next(self.batch_interval)
+            except multiprocessing.TimeoutError:
+                scanned = []
+            except StopIteration:
+                break
+
+            for path, hits in scanned:
+                self.searched += 1
+                if hits is None:
+                    self.skipped += 1
+                elif hits and self.hit_count < self.max_hits:
+                    hits = hits[:self.max_hits - self.hit_count]
+                    self.hit_count += len(hits)
+                    batch.append((path, hits))
+
+            if self.hit_count >= self.max_hits:
+                self.truncated = True
+                break
+
+            if time.monotonic() - sent >= self.batch_interval:
+                self.send(batch)
+                batch = []
+                sent = time.monotonic()
+
+        self.send(batch)
+
+    def send(self, batch):
+
+        if batch:
+            self.found.emit(batch)
+        self.progress.emit(self.searched)
+
+
+class FindInFilesPanel(QtWidgets.QDockWidget):
+    """ Find in Files: a root, file filters and a query, with the hits in a tree
+
+    The query options are the actions of the finder, so both search the
+    same way. Clicking a hit emits open_hit with its path, line and column.
+    """
+
+    # Path, 0 based line and column of the hit clicked
+    open_hit = QtCore.pyqtSignal(str, int, int)
+
+    def __init__(self, options, parent=None):
+        super().__init__('Find in Files', parent)
+
+        self.regex_option, self.case_option, self.word_option = options
+        self.worker = None
+        self.started = 0
+        self.file_items = 0
+
+        self.root = QtWidgets.QLineEdit(os.getcwd())
+        self.root.setPlaceholderText('Directory')
+        browse = QtWidgets.QToolButton()
+        browse.setText('...')
+        browse.setToolTip('Choose the directory')
+        browse.clicked.connect(self.browse)
+
+        self.filters = QtWidgets.QLineEdit()
+        self.filters.setPlaceholderText('Files, e.g. *.py; *.txt')
+
+        self.query = QtWidgets.QLineEdit()
+        self.query.setPlaceholderText('Find...')
+        self.query.returnPressed.connect(self.start)
+
+        self.search_button = QtWidgets.QPushButton('Search')
+        self.search_button.clicked.connect(self.start_or_stop)
+
+        self.results = QtWidgets.QTreeWidget()
+        self.results.setHeaderHidden(True)
+        self.results.setUniformRowHeights(True)
+        self.results.itemClicked.connect(self.item_clicked)
+        self.results.itemActivated.connect(self.item_clicked)
+
+        self.status = QtWidgets.QLabel()
+
+        options_row = QtWidgets.QHBoxLayout()
+        options_row.addWidget(self.root, 3)
+        options_row.addWidget(browse)
+        options_row.addWidget(self.filters, 2)
+        options_row.addWidget(self.query, 3)
+        for action in options:
+            button = QtWidgets.QToolButton()
+            button.setDefaultAction(action)
+            options_row.addWidget(button)
+        options_row.addWidget(self.search_button)
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.setContentsMargins(4, 4, 4, 4)
+        layout.addLayout(options_row)
+        layout.addWidget(self.results)
+        layout.addWidget(self.status)
+
+        contents = QtWidgets.QWidget()
+        contents.setLayout(layout)
+        self.setWidget(contents)
+
+    def browse(self):
+
+        root = QtWidgets.QFileDialog.getExistingDirectory(self, 'Find in Files', self.root.text())
+        if root:
+            self.root.setText(root)
+
+    def focus(self, query=''):
+        """ Show the panel with the query field focused, filled with query if given """
+
+        self.show()
+        self.raise_()
+        if query:
+            self.query.setText(query)
+        self.query.setFocus()
+        self.query.selectAll()
+
+    def start_or_stop(self):
+
+        if self.worker is not None:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+
+        self.stop()
+        self.results.clear()
+        self.file_items = 0
+
+        root = self.root.text().strip()
+        if not self.query.text() or not os.path.isdir(root):
+            self.status.setText('Choose a directory and a query' if self.query.text() else '')
+            return
+
+        try:
+            matcher = search.Matcher(self.query.text(), regex=self.regex_option.isChecked(),
+                                     case_sensitive=self.case_option.isChecked(),
+                                     whole_word=self.word_option.isChecked())
+        except re.error as why:
+            self.status.setText('Invalid regular expression: {}'.format(why))
+            return
+
+        self.worker = FindInFilesWorker(root, self.filters.text(), matcher)
+        self.worker.found.connect(self.add_hits)
+        self.worker.progress.connect(self.show_progress)
+        self.worker.finished.connect(lambda worker=self.worker: self.finished(worker))
+        self.started = time.monotonic()
+        self.search_button.setText('Stop')
+        self.status.setText('Searching...')
+        self.worker.start()
+
+    def stop(self):
+        """ Interrupt the search, waiting for its pool to be terminated """
+
+        if self.worker is None:
+            return
+
+        worker, self.worker = self.worker, None
+        worker.requestInterruption()
+        worker.wait()
+        self.search_button.setText('Search')
+        self.status.setText('Stopped after {} files, {} hits'.format(worker.searched, worker.hit_count))
+
+    def add_hits(self, batch):
+
+        if self.sender() is not self.worker:
+            return
+
+        self.results.setUpdatesEnabled(False)
+        for path, hits in batch:
+            file_item = QtWidgets.QTreeWidgetItem(self.results, ['{} ({})'.format(path, len(hits))])
+            file_item.setToolTip(0, path)
+            for line, column, length, text in hits:
+                item = QtWidgets.QTreeWidgetItem(file_item, ['{}: {}'.format(line + 1, text.strip())])
+                item.setData(0, QtCore.Qt.UserRole, (path, line, column))
+            self.file_items += 1
+        self.results.setUpdatesEnabled(True)
+
+    def show_progress(self, searched):
+
+        if self.sender() is self.worker:
+            self.status.setText('Searching... {} files, {} hits'.format(searched, self.worker.hit_count))
+
+    def finished(self, worker):
+
+        if worker is not self.worker:
+            return
+        self.worker = None
+        self.search_button.setText('Search')
+
+        if worker.error is not None:
+            self.status.setText(str(worker.error))
+            return
+
+        status = '{} hits in {} files, {} files searched in {:.1f} s'.format(
+            worker.hit_count, self.file_items, worker.searched, time.monotonic() - self.started)
+        if worker.skipped:
+            status += ', {} binary or unreadable skipped'.format(worker.skipped)
+        if worker.truncated:
+            status += ', stopped at {} hits'.format(worker.max_hits)
+        self.status.setText(status)
+
+    def item_clicked(self, item, column_=0):
+
+        hit = item.data(0, QtCore.Qt.UserRole)
+        if hit is not None:
+            self.open_hit.emit(*hit)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import codecs
+import io
+import os
+
+import PyQt5.QtCore as QtCore
+import fileio
+
+
+def file_identity(status):
+    return status.st_dev, status.st_ino
+
+
+class Follower(QtCore.QObject):
+    """ Read what gets appended to a file, from the last byte offset read
+
+    Change notifications come from a QFileSystemWatcher on the file and
+    on its directory, which tells when a rotated file is created again.
+    Notifications within batch_interval are read as a single batch. A
+    file that shrank was truncated and a file with another identity was
+    rotated: reading then restarts at the beginning of the new contents,
+    never rereading what was already read.
+    """
+
+    # Text appended to the file since the last read
+    appended = QtCore.pyqtSignal(str)
+    # Emitted with 'truncated' or 'rotated' before reading the file from its start
+    restarted = QtCore.pyqtSignal(str)
+
+    # Milliseconds notifications are batched for
+    batch_interval = 100
+    # Bytes read per batch, the rest is read by the next one
+    max_read = 4 * 1024 * 1024
+
+    def __init__(self, path, offset, encoding):
+        super().__init__()
+
+        self.path = path
+        self.offset = offset
+        self.encoding = encoding
+        self.identity = file_identity(os.stat(path))
+        self.decoder = self.new_decoder()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.batch_interval)
+        self.timer.timeout.connect(self.read)
+
+        self.watcher = QtCore.QFileSystemWatcher([path, os.path.dirname(os.path.abspath(path))])
+        self.watcher.fileChanged.connect(self.schedule)
+        self.watcher.directoryChanged.connect(self.schedule)
+
+    def new_decoder(self):
+        # Same decoding and newline translation as fileio.FileReader
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors=fileio.DECODE_ERRORS)
+        return io.IncrementalNewlineDecoder(decoder, True)
+
+    def schedule(self, path=''):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def read(self):
+        """ Read the bytes appended since the last read """
+
+        try:
+            status = os.stat(self.path)
+        except FileNotFoundError:
+            # Rotated away, the directory watch tells when it is back
+            return
+
+        # The watch of a file goes away with the file it watched
+        if self.path not in self.watcher.files():
+            self.watcher.addPath(self.path)
+
+        if file_identity(status) != self.identity:
+            self.identity = file_identity(status)
+            self.restart('rotated')
+        elif status.st_size < self.offset:
+            self.restart('truncated')
+
+        if status.st_size == self.offset:
+            return
+
+        try:
+            with open(self.path, 'rb') as file_open:
+                file_open.seek(self.offset)
+                data = file_open.read(self.max_read)
+        except OSError:
+            self.timer.start()
+            return
+
+        self.offset += len(data)
+        text = self.decoder.decode(data)
+        if text:
+            self.appended.emit(text)
+
+        if self.offset < status.st_size:
+            self.timer.start()
+
+    def restart(self, reason):
+        self.offset = 0
+        self.decoder = self.new_decoder()
+        self.restarted.emit(reason)
+
+    def stop(self):
+        self.timer.stop()
+        self.watcher.fileChanged.disconnect(self.schedule)
+        self.watcher.directoryChanged.disconnect(self.schedule)
@@ -1,10 +1,13 @@
 #!/usr/bin/python
 #-*- coding: utf-8 -*-
 
+import collections
+import re
 import sys
+import time
 
-from PyQt5.QtCore import Qt, QRegExp
-from PyQt5.QtGui import QColor, QTextCharFormat, QFont, QPalette, QSyntaxHighlighter
+from PyQt5.QtCore import Qt, QObject, QPoint, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QTextCharFormat, QFont, QPalette, QSyntaxHighlighter, QTextLayout
 from PyQt5.QtWidgets import QMainWindow, QApplication, QPlainTextEdit
 
 
@@ -35,7 +38,51 @@ STYLE = {
 }
 
 
-class PythonHighlighter(QSyntaxHighlighter):
+class RunCache:
+    """ LRU of the format runs of blocks, keyed by block text hash and incoming state """
+
+    # Rough size in bytes of an entry and of each of its runs
+    entry_cost = 200
+    run_cost = 80
+
+    def __init__(self, budget=8 * 1024 * 1024):
+        self.budget = budget
+        self.size = 0
+        self.entries = collections.OrderedDict()
+
+    @staticmethod
+    def key(text, state):
+        return hash(text), len(text), state
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        if key in self.entries:
+            return
+
+        self.entries[key] = entry
+        self.size += self.cost(entry)
+
+        # evict the least recently used blocks until back under budget
+        while self.size > self.budget and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= self.cost(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def cost(self, entry):
+        runs, state = entry
+        return self.entry_cost + self.run_cost * len(runs)
+
+
+class PythonTokenizer:
+    """ Splits Python blocks into format runs """
 
     keywords = [
         'and', 'as', 'assert', 'break', 'class', 'continue', 'def',
@@ -61,98 +108,344 @@ class PythonHighlighter(QSyntaxHighlighter):
         '\{', '\}', '\[', '\]', '\(', '\)'
     ]
 
-    def __init__(self, document):
+    # Block states
+    NORMAL = 0
+    IN_TRIPLE_SINGLE = 1
+    IN_TRIPLE_DOUBLE = 2
 
-        QSyntaxHighlighter.__init__(self, document)
+    def __init__(self, cache=None):
+
+        # Runs of already tokenized blocks, so unchanged blocks are replayed
+        self.cache = cache if cache is not None else RunCache()
+
+        # Format of each word with a style of its own
+        self.word_styles = {}
+        self.word_styles.update((keyword, STYLE['keywords']) for keyword in PythonTokenizer.keywords)
+        self.word_styles.update((boolean, STYLE['booleans']) for boolean in PythonTokenizer.booleans)
+        self.word_styles['self'] = STYLE['self']
 
-        self.triple_single = (QRegExp("\'\'\'"), 1, STYLE['doc_string'])
-        self.triple_double = (QRegExp('\"\"\"'), 2, STYLE['doc_string'])
-
-        # RULES
-
-        rules = []
-        # r'' regular expression
-        # [] used to indicate set of characters
-        # \b matches the empty string, but only at the beginning or end of the word
-        # \w matches any alphanumeric chars and the underscore
-        # \s matches any whitespace char
-        # * causes the resulting regexp to match 0 or more repetitions of the preceding regexp. ab* = a, ab, abb, abbb..
-        # + causes the resulting regexp to match 1 or more repetitions of the preceding regexp. ab+ = ab, abb, abbbb..
-        # ? causes the resulting regexp to match 0 or 1 repetitions of the preceding regexp. ab? = a, ab
-        # ^ matches the start of the string, and in multi line mode also matches immediately after each new line
-        # ?: A non-capturing version of regular parentheses
-        # QRegExp, int, STYLE
-
-        rules += [(r'\b%s\b' % keyword, 0, STYLE['keywords']) for keyword in PythonHighlighter.keywords]
-        rules += [(r'\b%s\b' % boolean, 0, STYLE['booleans']) for boolean in PythonHighlighter.booleans]
-        rules += [(r'%s' % operator, 0, STYLE['operators']) for operator in PythonHighlighter.operators]
-        rules += [(r'%s' % brace, 0, STYLE['braces']) for brace in PythonHighlighter.braces]
-        # Other rules:
-        rules += [
-            # self
-            (r'\bself\b', 0, STYLE['self']),
-            # string containing double-quote with escape sequence
-            (r'"[^"\\]*(\\.[^"\\]*)*"', 0, STYLE['string']),
-            # string containing single-quote with escape sequence
-            (r"'[^'\\]*(\\.[^'\\]*)*'", 0, STYLE['string']),
-            # def/class
-            (r'\bdef\b\s*(\w+)', 1, STYLE['def_class']),
-            (r'\bclass\b\s*(\w+)', 1, STYLE['def_class']),
+        # TOKENIZER
+
+        # A single alternation scanned once per block. At each position the
+        # first alternative that matches wins, which resolves precedence:
+        # nothing inside a comment or a string is highlighted on its own.
+        # Longest operators first so '**' isn't read as '*' '*'.
+        operators = sorted(PythonTokenizer.operators, key=len, reverse=True)
+
+        self.tokens = re.compile('|'.join([
             # from # until new-line
-            (r'#[^\n]*', 0, STYLE['comments']),
+            r'(?P<comment>#.*)',
+            # start of a multi-line string
+            r"(?P<triple>\'\'\'|\"\"\")",
+            # string containing double-quote or single-quote with escape sequence
+            r'(?P<string>"[^"\\]*(?:\\.[^"\\]*)*"|' + r"'[^'\\]*(?:\\.[^'\\]*)*')",
+            # keywords, booleans, self, def/class names and plain identifiers
+            r'(?P<word>[^\W\d]\w*)',
             # numbers
-            (r'\b[+-]?[0-9]+[lL]?\b', 0, STYLE['numbers']),
-            (r'\b[+-]?[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?\b', 0, STYLE['numbers']),
-            # decorator
-            (r'@[^\n', 0, STYLE['def_class']),
-        ]
-        # Build QRegExp for each pattern
-        self.rules = [(QRegExp(pattern), index, fmt) for (pattern, index, fmt) in rules]
+            r'(?P<number>\b[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?[lL]?\b)',
+            r'(?P<operator>{})'.format('|'.join(operators)),
+            r'(?P<brace>{})'.format('|'.join(PythonTokenizer.braces)),
+        ]))
+
+        self.delimiters = {
+            self.IN_TRIPLE_SINGLE: "\'\'\'",
+            self.IN_TRIPLE_DOUBLE: '\"\"\"',
+        }
+        self.triple_states = {delimiter: state for state, delimiter in self.delimiters.items()}
+
+        self.token_styles = {
+            'comment': STYLE['comments'],
+            'string': STYLE['string'],
+            'number': STYLE['numbers'],
+            'operator': STYLE['operators'],
+            'brace': STYLE['braces'],
+        }
+
+    def runs(self, text, state):
+        """ Cached format runs and end state of a block """
+
+        key = self.cache.key(text, state)
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = self.tokenize(text, state)
+            self.cache.put(key, entry)
+        return entry
+
+    def tokenize(self, text, state):
+        """ Format runs and end state of a block, found in a single pass """
+
+        runs = []
+        position = 0
+
+        # Inside a multi-line string opened by a previous block
+        if state in self.delimiters:
+            end = text.find(self.delimiters[state])
+            if end < 0:
+                return [(0, len(text), STYLE['doc_string'])], state
+            position = end + 3
+            runs.append((0, position, STYLE['doc_string']))
+
+        state = self.NORMAL
+        name_expected_at = -1
+        search = self.tokens.search
+        word_styles = self.word_styles
+        token_styles = self.token_styles
+
+        match = search(text, position)
+        while match is not None:
+            kind = match.lastgroup
+            start, end = match.span()
+
+            if kind == 'word':
+                word = match.group()
+                if start == name_expected_at:
+                    runs.append((start, end - start, STYLE['def_class']))
+                elif word in word_styles:
+                    runs.append((start, end - start, word_styles[word]))
+                    # def/class name, after optional whitespace
+                    if word == 'def' or word == 'class':
+                        name_expected_at = end
+                        while name_expected_at < len(text) and text[name_expected_at].isspace():
+                            name_expected_at += 1
+
+            elif kind == 'triple':
+                delimiter = match.group()
+                close = text.find(delimiter, end)
+                if close < 0:
+                    runs.append((start, len(text) - start, STYLE['doc_string']))
+                    state = self.triple_states[delimiter]
+                    break
+                end = close + 3
+                runs.append((start, end - start, STYLE['doc_string']))
+
+            else:
+                runs.append((start, end - start, token_styles[kind]))
+
+            match = search(text, end)
+
+        # Adjacent runs of the same format, like '()', are painted as one
+        merged = []
+        for run in runs:
+            if merged and merged[-1][2] is run[2] and merged[-1][0] + merged[-1][1] == run[0]:
+                merged[-1] = (merged[-1][0], merged[-1][1] + run[1], run[2])
+            else:
+                merged.append(run)
+
+        return merged, state
+
+
+class PythonHighlighter(QSyntaxHighlighter):
+
+    def __init__(self, document, tokenizer=None):
+
+        QSyntaxHighlighter.__init__(self, document)
+
+        self.tokenizer = tokenizer if tokenizer is not None else PythonTokenizer()
 
     def highlightBlock(self, text):
-        for expression, nth, format in self.rules:
 
-            index = expression.indexIn(text, 0)
+        runs, state = self.tokenizer.runs(text, self.previousBlockState())
 
-            while index >= 0:
-                index = expression.pos(nth)
+        for start, length, format in runs:
+            self.setFormat(start, length, format)
 
-                length = len(expression.cap(nth))
+        self.setCurrentBlockState(state)
 
-                self.setFormat(index, length, format)
-                index = expression.indexIn(text, index + length)
 
-        self.setCurrentBlockState(0)
+class LazyHighlighter(QObject):
+    """ Python highlighting that never blocks the UI
 
-        in_multiline = self.match_multiline(text, *self.triple_single)
-        if not in_multiline:
-            in_multiline = self.match_multiline(text, *self.triple_double)
+    The blocks in the viewport are highlighted first, assuming the state
+    of the block above them when it isn't known yet. The whole document is
+    then highlighted in order in idle time slices, which fixes up any block
+    whose incoming state turned out to be different. Documents larger than
+    size_limit characters are left as plain text.
+    """
 
-    def match_multiline(self, text, delimiter, in_state, style):
+    # Emitted when the highlighter detached itself from a document too large
+    fell_back = pyqtSignal()
 
-        if self.previousBlockState() == in_state:
-            start = 0
-            add = 0
-        else:
-            start = delimiter.indexIn(text)
-            add = delimiter.matchedLength()
-
-        while start >= 0:
-            end = delimiter.indexIn(text, start + add)
-            if end >= add:
-                length = end - start + add + delimiter.matchedLength()
-                self.setCurrentBlockState(0)
-            else:
-                self.setCurrentBlockState(in_state)
-                length = len(text) - start + add
+    # Seconds of highlighting per timer tick
+    slice_budget = 0.008
+    # Edits touching fewer blocks are highlighted as soon as they happen
+    sync_blocks = 64
+
+    def __init__(self, editor, tokenizer=None, size_limit=20 * 1024 * 1024):
+        super().__init__()
+
+        self.editor = editor
+        self.tokenizer = tokenizer if tokenizer is not None else PythonTokenizer()
+        self.size_limit = size_limit
+        self._document = None
+
+        # Number of the first block the background pass still has to check
+        self.next_block = 0
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.highlight_slice)
+
+        self.editor.verticalScrollBar().valueChanged.connect(self.highlight_viewport)
+
+    def document(self):
+        return self._document
+
+    def setDocument(self, document):
+        """ Attach to document, or detach and clear the formats when None """
+
+        if self._document is not None:
+            self._document.contentsChange.disconnect(self.contents_change)
+            self.timer.stop()
+            self.clear_formats()
+
+        self._document = None
+        if document is None:
+            return
+
+        if document.characterCount() > self.size_limit:
+            self.fell_back.emit()
+            return
+
+        self._document = document
+        self._document.contentsChange.connect(self.contents_change)
+        self.next_block = 0
+        self.highlight_viewport()
+        self.timer.start()
+
+    # BLOCK STATES
 
-            self.setFormat(start, length, style)
-            start = delimiter.indexIn(text, start + length)
+    # The user state of a highlighted block packs its end state with the
+    # state it was highlighted from, -1 means not highlighted yet.
 
-        if self.currentBlockState() == in_state:
-            return True
+    @staticmethod
+    def pack(incoming, state):
+        return (incoming + 1) << 2 | state
+
+    @staticmethod
+    def incoming_state(user_state):
+        return (user_state >> 2) - 1
+
+    @staticmethod
+    def end_state(user_state):
+        if user_state < 0:
+            return -1
+        return user_state & 3
+
+    def state_above(self, block):
+        previous = block.previous()
+        if not previous.isValid():
+            return PythonTokenizer.NORMAL
+        return max(self.end_state(previous.userState()), PythonTokenizer.NORMAL)
+
+    # HIGHLIGHTING
+
+    def highlight(self, block, incoming):
+        """ Apply the format runs of block, returns its end state """
+
+        runs, state = self.tokenizer.runs(block.text(), incoming)
+
+        ranges = []
+        for start, length, format in runs:
+            if not length:
+                continue
+            format_range = QTextLayout.FormatRange()
+            format_range.start = start
+            format_range.length = length
+            format_range.format = format
+            ranges.append(format_range)
+
+        block.layout().setFormats(ranges)
+        block.setUserState(self.pack(incoming, state))
+        return state
+
+    def highlight_range(self, first, last):
+        """ Highlight blocks first to last from the state of the block above first """
+
+        incoming = self.state_above(first)
+        block = first
+        while block.isValid():
+            incoming = self.highlight(block, incoming)
+            if block == last:
+                break
+            block = block.next()
+
+        self._document.markContentsDirty(first.position(), last.position() + last.length() - first.position())
+
+    def highlight_viewport(self):
+        """ Highlight the visible blocks that were never highlighted """
+
+        if self._document is None:
+            return
+
+        viewport = self.editor.viewport()
+        first = self.editor.cursorForPosition(QPoint(0, 0)).block()
+        last = self.editor.cursorForPosition(QPoint(viewport.width(), viewport.height())).block()
+
+        block = first
+        while block.isValid() and block.userState() != -1 and block != last:
+            block = block.next()
+        if block.isValid() and block.userState() == -1:
+            self.highlight_range(block, last)
+
+    def highlight_slice(self):
+        """ Continue the in-order pass for one time slice """
+
+        self.highlight_viewport()
+
+        block = self._document.findBlockByNumber(self.next_block)
+        if not block.isValid():
+            self.timer.stop()
+            return
+
+        first = block
+        last = block
+        incoming = self.state_above(block)
+        deadline = time.perf_counter() + self.slice_budget
+
+        while block.isValid() and time.perf_counter() < deadline:
+            # blocks highlighted from the right state are left alone
+            user_state = block.userState()
+            if user_state != -1 and self.incoming_state(user_state) == incoming:
+                incoming = self.end_state(user_state)
+            else:
+                incoming = self.highlight(block, incoming)
+            last = block
+            block = block.next()
+
+        self.next_block = last.blockNumber() + 1
+        self._document.markContentsDirty(first.position(), last.position() + last.length() - first.position())
+
+    def contents_change(self, position, removed, added):
+        """ Rehighlight the edited blocks and let the pass ripple their state """
+
+        if self._document.characterCount() > self.size_limit:
+            self.setDocument(None)
+            self.fell_back.emit()
+            return
+
+        first = self._document.findBlock(position)
+        last = self._document.findBlock(position + added)
+        if not last.isValid():
+            last = self._document.lastBlock()
+
+        if last.blockNumber() - first.blockNumber() < self.sync_blocks:
+            # typing: the edited blocks are highlighted right away
+            self.highlight_range(first, last)
+            if first.blockNumber() < self.next_block:
+                self.next_block = min(self.next_block, last.blockNumber() + 1)
         else:
-            return False
+            # loads and large pastes are left to the viewport pass and the time slices
+            self.next_block = min(self.next_block, first.blockNumber())
+        self.timer.start()
+
+    def clear_formats(self):
+
+        block = self._document.begin()
+        while block.isValid():
+            block.layout().clearFormats()
+            block.setUserState(-1)
+            block = block.next()
+        self._document.markContentsDirty(0, self._document.characterCount())
 
 
 class Example(QMainWindow):
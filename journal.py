@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import glob
+import itertools
+import json
+import os
+import queue
+
+import PyQt5.QtCore as QtCore
+import PyQt5.QtGui as QtGui
+import fileio
+
+
+# Journals of every document, named after the process writing them
+DIRECTORY = os.path.join(os.path.expanduser('~'), '.notepad', 'journal')
+
+# Numbers the journals of one process
+_journal_ids = itertools.count()
+
+
+class JournalError(Exception):
+    """ Raised when a journal can't be replayed """
+
+
+def process_alive(pid):
+    """ Whether the process that wrote a journal is still running """
+
+    # On Windows os.kill would terminate the process, assume it is gone
+    if os.name == 'nt':
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def stale_journals(directory=DIRECTORY):
+    """ Journals left behind by processes that are gone, newest first """
+
+    journals = []
+    for path in glob.glob(os.path.join(directory, '*.journal')):
+        pid = os.path.basename(path).split('-')[0]
+        if pid.isdecimal() and not process_alive(int(pid)):
+            journals.append(path)
+
+    return sorted(journals, key=os.path.getmtime, reverse=True)
+
+
+def load(path):
+    """ Header, base text and edit records of a journal
+
+    The base text is the snapshot of the journal, or the file it was
+    started from as long as that file didn't change since. A record cut
+    short by a crash ends the journal.
+    """
+
+    with open(path, encoding='utf-8') as file_open:
+        try:
+            header = json.loads(file_open.readline())
+            text = json.loads(file_open.readline()) if header['snapshot'] else None
+        except (ValueError, KeyError):
+            raise JournalError('The journal header is damaged')
+
+        records = []
+        for line in file_open:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+
+    if text is None:
+        if fileio.file_stamp(header['path']) != header['stamp']:
+            raise JournalError('{} changed since the journal started'.format(header['path']))
+        if header['path']:
+            with open(header['path'], encoding=header['encoding'], errors=fileio.DECODE_ERRORS) as file_open:
+                text = file_open.read()
+        else:
+            text = ''
+
+    return header, text, records
+
+
+def replay(document, records):
+    """ Apply the edit records of a journal to a document, as a single undo step """
+
+    cursor = QtGui.QTextCursor(document)
+    cursor.beginEditBlock()
+    for position, removed, text in records:
+        cursor.setPosition(position)
+        cursor.setPosition(position + removed, QtGui.QTextCursor.KeepAnchor)
+        cursor.insertText(text)
+    cursor.endEditBlock()
+
+
+class JournalWriter(QtCore.QThread):
+    """ Write the operations queued by the journals of the process off the GUI thread
+
+    Operations are ('begin', path, header), ('snapshot', path, header,
+    text), ('record', path, line), ('stop', path) and None to end the
+    thread. A journal file is only created with its first record or
+    snapshot. One writer serves every journal, see writer().
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.operations = queue.Queue()
+        # Open journal file and header, per journal path
+        self.files = {}
+        self.headers = {}
+
+    def run(self):
+
+        while True:
+            operations = [self.operations.get()]
+            while True:
+                try:
+                    operations.append(self.operations.get_nowait())
+                except queue.Empty:
+                    break
+
+            written = set()
+            for operation in operations:
+                if operation is None:
+                    for path in list(self.files):
+                        self.close(path)
+                    return
+
+                path = operation[1]
+                try:
+                    getattr(self, operation[0])(*operation[1:])
+                    if path in self.files:
+                        written.add(path)
+                except OSError:
+                    # A journal that can't be written only loses its recovery
+                    self.close(path)
+                    self.headers.pop(path, None)
+
+            for path in written:
+                try:
+                    if path in self.files:
+                        self.files[path].flush()
+                except OSError:
+                    self.close(path)
+                    self.headers.pop(path, None)
+
+    def begin(self, path, header):
+        self.stop(path)
+        self.headers[path] = header
+
+    def record(self, path, line):
+        header = self.headers.get(path)
+        if header is None:
+            return
+        if path not in self.files:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.files[path] = open(path, 'w', encoding='utf-8')
+            self.files[path].write(json.dumps(header) + '\n')
+        self.files[path].write(line)
+
+    def snapshot(self, path, header, text):
+        """ Replace a journal with a snapshot of its document """
+
+        self.close(path)
+        self.headers[path] = header
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file_open:
+            file_open.write(json.dumps(header) + '\n')
+            file_open.write(json.dumps(text) + '\n')
+            file_open.flush()
+            os.fsync(file_open.fileno())
+        os.replace(temp_path, path)
+
+        self.files[path] = open(path, 'a', encoding='utf-8')
+
+    def stop(self, path):
+        self.close(path)
+        self.headers.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def close(self, path):
+        file_open = self.files.pop(path, None)
+        if file_open is not None:
+            file_open.close()
+
+
+# The JournalWriter of the process, once a journal was created
+_writer = None
+
+
+def writer():
+    """ The JournalWriter shared by the journals of the process, started on first use """
+
+    global _writer
+    if _writer is None:
+        _writer = JournalWriter()
+        _writer.start()
+        QtCore.QCoreApplication.instance().aboutToQuit.connect(shutdown)
+    return _writer
+
+
+def shutdown():
+    """ Finish writing the journals, which stay for recovery unless stopped """
+
+    global _writer
+    if _writer is not None and _writer.isRunning():
+        _writer.operations.put(None)
+        _writer.wait()
+    _writer = None
+
+
+class Journal(QtCore.QObject):
+    """ Append-only log of the edits of a document, to recover them after a crash
+
+    The journal starts from the file the document was opened from or
+    saved to, or from a snapshot of the document. Every contentsChange
+    then appends a (position, removed, inserted text) record, so its cost
+    grows with the edits, not with the document. Once the records outweigh
+    the document, they are compacted into a new snapshot.
+    """
+
+    # Characters of records before a snapshot, at least
+    compact_size = 1024 * 1024
+
+    def __init__(self, document, directory=DIRECTORY):
+        super().__init__()
+
+        self.path = os.path.join(directory, '{}-{}.journal'.format(os.getpid(), next(_journal_ids)))
+        self.document = document
+        self.header = None
+        self.length = 0
+        self.logged = 0
+
+        self.writer = writer()
+
+        document.contentsChange.connect(self.contents_change)
+
+    def start(self, file_path=None, encoding=None, snapshot=False):
+        """ Journal the edits made from now on to the document opened from file_path """
+
+        self.header = {'path': file_path or None, 'encoding': encoding,
+                       'stamp': fileio.file_stamp(file_path), 'snapshot': False}
+        self.length = self.document.characterCount() - 1
+        self.logged = 0
+
+        if snapshot:
+            self.snapshot()
+        else:
+            self.writer.operations.put(('begin', self.path, self.header))
+
+    def stop(self):
+        """ Stop journaling and delete the journal, when the edits are saved or dropped """
+
+        self.header = None
+        self.writer.operations.put(('stop', self.path))
+
+    def snapshot(self):
+        self.header = dict(self.header, snapshot=True)
+        self.length = self.document.characterCount() - 1
+        self.logged = 0
+        self.writer.operations.put(('snapshot', self.path, self.header, self.document.toPlainText()))
+
+    def contents_change(self, position, removed, added):
+
+        if self.header is None:
+            return
+
+        # Whole document replacements report a wrong delta, take a snapshot then
+        length = self.document.characterCount() - 1
+        if self.length - removed + added != length or position + added > length:
+            self.snapshot()
+            return
+        self.length = length
+
+        cursor = QtGui.QTextCursor(self.document)
+        cursor.setPosition(position)
+        cursor.setPosition(position + added, QtGui.QTextCursor.KeepAnchor)
+        text = cursor.selectedText().replace('\u2029', '\n')
+
+        self.writer.operations.put(('record', self.path, json.dumps([position, removed, text]) + '\n'))
+
+        self.logged += len(text) + 1
+        if self.logged > max(self.compact_size, self.length):
+            self.snapshot()
@@ -0,0 +1,595 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import bisect
+import codecs
+import mmap
+import multiprocessing
+import sys
+from array import array
+
+import PyQt5.QtCore as QtCore
+import PyQt5.QtWidgets as QtWidgets
+import PyQt5.QtGui as QtGui
+import fileio
+import search
+
+
+# Array type codes of the code units of UTF-16 and UTF-32, by size
+UNIT_TYPES = {2: 'H', 4: 'I'}
+
+
+def window_codec(encoding, head=b''):
+    """ Codec decoding any window of a file starting with the bytes head
+
+    A byte order mark only starts the first window, so UTF-8 ones are
+    decoded as a character and UTF-16 and UTF-32 take the byte order of
+    theirs, little endian without one.
+    """
+
+    name = codecs.lookup(encoding).name
+    if name == 'utf-8-sig':
+        return 'utf-8'
+    if name in ('utf-16', 'utf-32'):
+        mark = codecs.BOM_UTF16_BE if name == 'utf-16' else codecs.BOM_UTF32_BE
+        return name + ('-be' if head.startswith(mark) else '-le')
+    return encoding
+
+
+def find_newline(data, newline, begin, end):
+    """ Offset of the first newline within data[begin:end], -1 if none
+
+    For UTF-16 and UTF-32 newline is a whole code unit, and matches that
+    straddle two units are skipped.
+    """
+
+    unit = len(newline)
+    begin += -begin % unit
+    while True:
+        index = data.find(newline, begin, end)
+        if index < 0 or not index % unit:
+            return index
+        begin = index - index % unit + unit
+
+
+def rfind_newline(data, newline, begin, end):
+    """ Offset of the last newline within data[begin:end], -1 if none """
+
+    unit = len(newline)
+    while True:
+        index = data.rfind(newline, begin, end)
+        if index < 0 or not index % unit:
+            return index
+        end = index + len(newline) - 1
+
+
+def count_newlines(data, newline, begin, end):
+    """ Newlines within data[begin:end], counted a code unit at a time for UTF-16 and UTF-32 """
+
+    unit = len(newline)
+    if unit == 1:
+        return data[begin:end].count(newline)
+
+    units = array(UNIT_TYPES[unit])
+    units.frombytes(data[begin:end - (end - begin) % unit])
+    return units.count(int.from_bytes(newline, sys.byteorder))
+
+
+class LineIndex:
+    """ Sparse index of line starts in a memory mapped file
+
+    One entry is kept per chunk of about chunk_size bytes, holding the
+    number and byte offset of the line starting there. A line is found
+    from the closest entry before it, so locating any line costs at most
+    one chunk worth of newline searches. newline is the encoded '\\n' of
+    the file, a code unit long.
+    """
+
+    chunk_size = 64 * 1024
+    # Bytes copied at a time when counting newlines past the indexed part
+    count_step = 1024 * 1024
+
+    def __init__(self, data, newline=b'\n'):
+        self.data = data
+        self.newline = newline
+        self.lines = array('q', [0])
+        self.offsets = array('q', [0])
+        self.newlines = 0
+        self.indexed = 0
+        self.complete = len(data) == 0
+
+    @property
+    def line_count(self):
+        """ Lines found so far, counted like QTextDocument blocks """
+        return self.newlines + 1
+
+    def index_chunk(self):
+        """ Index the next chunk, returns False once the whole file is indexed """
+
+        size = len(self.data)
+        if self.indexed >= size:
+            self.complete = True
+            return False
+
+        # chunks end right after a newline, so each entry starts a line
+        end = find_newline(self.data, self.newline, min(self.indexed + self.chunk_size, size), size)
+        end = size if end < 0 else end + len(self.newline)
+
+        self.newlines += count_newlines(self.data, self.newline, self.indexed, end)
+        self.indexed = end
+        if end < size:
+            self.lines.append(self.newlines)
+            self.offsets.append(end)
+        return True
+
+    def line_offset(self, line):
+        """ Byte offset of the start of line, or the file size past the last one """
+
+        nth = bisect.bisect_right(self.lines, line) - 1
+        offset = self.offsets[nth]
+        for _ in range(line - self.lines[nth]):
+            newline = find_newline(self.data, self.newline, offset, len(self.data))
+            if newline < 0:
+                return len(self.data)
+            offset = newline + len(self.newline)
+        return offset
+
+    def line_at(self, offset):
+        """ Number of the line containing the byte at offset """
+
+        nth = bisect.bisect_right(self.offsets, offset) - 1
+        line = self.lines[nth]
+        # Beyond the indexed part, the span can be most of the file
+        for position in range(self.offsets[nth], offset, self.count_step):
+            line += count_newlines(self.data, self.newline, position, min(position + self.count_step, offset))
+        return line
+
+
+class IndexWorker(QtCore.QThread):
+    """ Build a LineIndex off the GUI thread """
+
+    # Emitted every few chunks with the number of lines found so far
+    progress = QtCore.pyqtSignal(int)
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+
+    def run(self):
+        chunks = 0
+        while self.index.index_chunk():
+            if self.isInterruptionRequested():
+                return
+            chunks += 1
+            if not chunks % 256:
+                self.progress.emit(self.index.line_count)
+        self.progress.emit(self.index.line_count)
+
+
+def window_end(data, position, end, window_size, newline=b'\n'):
+    """ End of a window of data[position:end], right after the first newline past window_size bytes """
+
+    if end - position <= window_size:
+        return end
+    limit = min(end, position + 2 * window_size)
+    limit -= (limit - position) % len(newline)
+    index = find_newline(data, newline, position + window_size, limit)
+    return index + len(newline) if index >= 0 else limit
+
+
+def window_begin(data, begin, position, window_size, newline=b'\n'):
+    """ Start of a window of data[begin:position], right after the last newline window_size bytes back """
+
+    if position - begin <= window_size:
+        return begin
+    limit = max(begin, position - 2 * window_size)
+    limit += (position - limit) % len(newline)
+    index = rfind_newline(data, newline, limit, position - window_size)
+    return index + len(newline) if index >= 0 else limit
+
+
+def find_match(data, matcher, codec, begin, end, forward, window_size, interrupted):
+    """ First (or last, searching backwards) match within data[begin:end], as a byte offset and length
+
+    Windows of the file are decoded with codec, see window_codec, and
+    scanned by the search.Matcher, so characters, case and word
+    boundaries are seen as the editor does.
+    """
+
+    newline = '\n'.encode(codec)
+    position = begin if forward else end
+
+    while (position < end if forward else position > begin) and not interrupted():
+        if forward:
+            window = position, window_end(data, position, end, window_size, newline)
+        else:
+            window = window_begin(data, begin, position, window_size, newline), position
+
+        text = data[window[0]:window[1]].decode(codec, fileio.DECODE_ERRORS)
+        starts, lengths, _ = matcher.scan(text)
+        if starts:
+            nth = 0 if forward else -1
+            start, length = starts[nth], lengths[nth]
+            offset = window[0] + len(text[:start].encode(codec, fileio.DECODE_ERRORS))
+            return offset, len(text[start:start + length].encode(codec, fileio.DECODE_ERRORS))
+
+        position = window[1] if forward else window[0]
+    return None
+
+
+def find_wrapped(data, matcher, codec, offset, forward, window_size, interrupted=lambda: False):
+    """ Match from offset to one end of data, then from the other end back to offset """
+
+    if forward:
+        ranges = [(offset, len(data)), (0, offset)]
+    else:
+        ranges = [(0, offset), (offset, len(data))]
+
+    for begin, end in ranges:
+        match = find_match(data, matcher, codec, begin, end, forward, window_size, interrupted)
+        if match is not None:
+            return match
+    return None
+
+
+def find_process(path, key, codec, offset, forward, window_size, connection):
+    """ Child process side of an untrusted pattern search """
+
+    with open(path, 'rb') as file_open:
+        with mmap.mmap(file_open.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            connection.send(find_wrapped(data, search.Matcher(*key), codec, offset, forward, window_size))
+
+
+class FindWorker(QtCore.QThread):
+    """ Look for the next or previous match from a byte offset, wrapping around
+
+    User written patterns can backtrack for ever while holding the GIL, so
+    they run in a child process mapping the file itself, killed when the
+    search is interrupted.
+    """
+
+    # byte offset and length of the match, -1 when there is none
+    found = QtCore.pyqtSignal(int, int)
+
+    # Bytes decoded and searched between two checks for interruption
+    window_size = 4 * 1024 * 1024
+    # Seconds between two checks for interruption while a child process searches
+    poll_interval = 0.01
+
+    def __init__(self, data, path, matcher, codec, offset, forward):
+        super().__init__()
+        self.data = data
+        self.path = path
+        self.matcher = matcher
+        self.codec = codec
+        self.offset = offset
+        self.forward = forward
+
+    def run(self):
+
+        if self.matcher.untrusted:
+            match = self.find_in_process()
+        else:
+            match = find_wrapped(self.data, self.matcher, self.codec, self.offset, self.forward,
+                                 self.window_size, self.isInterruptionRequested)
+
+        if self.isInterruptionRequested():
+            return
+        if match is None:
+            self.found.emit(-1, 0)
+        else:
+            self.found.emit(*match)
+
+    def find_in_process(self):
+
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=find_process, daemon=True,
+                                  args=(self.path, self.matcher.key, self.codec, self.offset,
+                                        self.forward, self.window_size, sender))
+        process.start()
+        sender.close()
+
+        try:
+            while not self.isInterruptionRequested():
+                if receiver.poll(self.poll_interval):
+                    return receiver.recv()
+        except EOFError:
+            pass
+        finally:
+            if process.is_alive():
+                process.kill()
+            process.join()
+            receiver.close()
+        return None
+
+
+class LargeFileView(QtWidgets.QAbstractScrollArea):
+    """ Read-only view of a memory mapped file, rendering only the visible lines """
+
+    # Emitted when the line count or the current line changes
+    changed = QtCore.pyqtSignal()
+    # Emitted with whether a search found a match
+    searched = QtCore.pyqtSignal(bool)
+
+    # Bytes of a line decoded for display
+    max_line_bytes = 64 * 1024
+
+    def __init__(self):
+        super().__init__()
+
+        self.path = ''
+        # Codec of the lines and their encoded '\n', see window_codec
+        self.codec = 'utf-8'
+        self.newline = b'\n'
+        self.file_open = None
+        self.data = None
+        self.index = None
+        self.index_worker = None
+        self.find_worker = None
+
+        self.current_line = 0
+        # Start of the current line while the index hasn't reached it, its number unknown
+        self.pending_offset = None
+        self.matcher = None
+        self.match = (-1, 0)
+        self.max_width = 0
+
+        self.line_format = QtGui.QColor('#3E3D32')
+        self.match_format = QtGui.QColor('#FFE792')
+
+        self.setFocusPolicy(QtCore.Qt.StrongFocus)
+
+        QtCore.QCoreApplication.instance().aboutToQuit.connect(self.close_file)
+
+    # FILE
+
+    def open_file(self, path, encoding='utf-8'):
+        """ Map path and start indexing its lines """
+
+        self.close_file()
+
+        self.path = path
+        self.file_open = open(path, 'rb')
+        self.data = mmap.mmap(self.file_open.fileno(), 0, access=mmap.ACCESS_READ)
+        self.codec = window_codec(encoding, self.data[:4])
+        self.newline = '\n'.encode(self.codec)
+        self.index = LineIndex(self.data, self.newline)
+
+        self.current_line = 0
+        self.match = (-1, 0)
+        self.max_width = 0
+        self.verticalScrollBar().setValue(0)
+        self.horizontalScrollBar().setValue(0)
+
+        self.index_worker = IndexWorker(self.index)
+        self.index_worker.progress.connect(self.index_progress)
+        self.index_worker.start()
+
+        self.update_scrollbars()
+        self.viewport().update()
+
+    def close_file(self):
+
+        for worker in (self.index_worker, self.find_worker):
+            if worker is not None:
+                worker.requestInterruption()
+                worker.wait()
+        self.index_worker = None
+        self.find_worker = None
+
+        if self.data is not None:
+            self.data.close()
+            self.file_open.close()
+        self.data = None
+        self.file_open = None
+        self.index = None
+
+    def index_progress(self, line_count):
+
+        offset = self.pending_offset
+        if offset is not None and (self.index.complete or offset < self.index.indexed):
+            self.goto_line(self.index.line_at(offset))
+
+        self.update_scrollbars()
+        self.changed.emit()
+
+    @property
+    def line_count(self):
+        return self.index.line_count if self.index is not None else 1
+
+    # NAVIGATION
+
+    def visible_lines(self):
+        return max(1, self.viewport().height() // self.fontMetrics().lineSpacing())
+
+    def update_scrollbars(self):
+        self.verticalScrollBar().setRange(0, max(0, self.line_count - self.visible_lines()))
+        self.verticalScrollBar().setPageStep(self.visible_lines())
+        self.horizontalScrollBar().setRange(0, max(0, self.max_width - self.viewport().width()))
+        self.horizontalScrollBar().setPageStep(self.viewport().width())
+
+    def goto_line(self, line):
+        """ Make line (0 based) the current line and scroll it into view """
+
+        self.current_line = max(0, min(line, self.line_count - 1))
+        self.pending_offset = None
+        top = self.verticalScrollBar().value()
+        if not top <= self.current_line < top + self.visible_lines():
+            self.verticalScrollBar().setValue(self.current_line - self.visible_lines() // 2)
+        self.viewport().update()
+        self.changed.emit()
+
+    def goto_offset(self, offset):
+        """ Make the line holding the byte at offset current, without waiting for the index to reach it """
+
+        start = rfind_newline(self.data, self.newline, 0, offset) + len(self.newline)
+        if self.index.complete or start < self.index.indexed:
+            self.goto_line(self.index.line_at(start))
+            return
+
+        # Shown on top until index_progress finds its number
+        self.pending_offset = start
+        self.viewport().update()
+        self.changed.emit()
+
+    def goto_percent(self, percent):
+        """ Go to the first line starting at or after percent of the bytes of the file """
+
+        unit = len(self.newline)
+        offset = int(len(self.data) * percent / 100)
+        offset -= offset % unit
+        if offset:
+            newline = find_newline(self.data, self.newline, offset - unit, len(self.data))
+            if newline >= 0:
+                offset = newline + unit
+        self.goto_offset(min(offset, len(self.data)))
+
+    def keyPressEvent(self, event):
+        moves = {
+            QtCore.Qt.Key_Up: -1,
+            QtCore.Qt.Key_Down: 1,
+            QtCore.Qt.Key_PageUp: -self.visible_lines(),
+            QtCore.Qt.Key_PageDown: self.visible_lines(),
+        }
+
+        if event.key() in moves:
+            self.goto_line(self.current_line + moves[event.key()])
+        elif event.key() == QtCore.Qt.Key_Home and event.modifiers() & QtCore.Qt.ControlModifier:
+            self.goto_line(0)
+        elif event.key() == QtCore.Qt.Key_End and event.modifiers() & QtCore.Qt.ControlModifier:
+            self.goto_line(self.line_count - 1)
+        else:
+            super().keyPressEvent(event)
+
+    def mousePressEvent(self, event):
+        line_spacing = self.fontMetrics().lineSpacing()
+        self.goto_line(self.verticalScrollBar().value() + event.pos().y() // line_spacing)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_scrollbars()
+
+    def scrollContentsBy(self, dx, dy):
+        if dy:
+            self.pending_offset = None
+        self.viewport().update()
+
+    # SEARCH
+
+    def set_matcher(self, matcher):
+        """ Search for a search.Matcher, None to stop searching """
+
+        self.matcher = matcher
+        self.match = (-1, 0)
+        self.viewport().update()
+
+    def find(self, forward=True):
+        """ Look for the next or previous match of the matcher from the current line """
+
+        if self.data is None or self.matcher is None:
+            return
+
+        if self.find_worker is not None:
+            self.find_worker.requestInterruption()
+            self.find_worker.wait()
+
+        if forward:
+            offset = self.index.line_offset(self.current_line + 1)
+        else:
+            offset = self.index.line_offset(self.current_line)
+
+        self.find_worker = FindWorker(self.data, self.path, self.matcher, self.codec, offset, forward)
+        self.find_worker.found.connect(self.find_done)
+        self.find_worker.start()
+
+    def find_done(self, offset, length):
+        if offset >= 0:
+            self.match = (offset, length)
+            self.goto_offset(offset)
+        self.searched.emit(offset >= 0)
+
+    # PAINTING
+
+    def decode(self, raw):
+        return raw.decode(self.codec, 'replace').lstrip('\ufeff').rstrip('\r').expandtabs(4)
+
+    def line_text(self, offset):
+        """ Raw bytes of the line starting at offset, and the offset of the next one """
+
+        end = find_newline(self.data, self.newline, offset, len(self.data))
+        if end < 0:
+            end = len(self.data)
+        return self.data[offset:min(end, offset + self.max_line_bytes)], end + len(self.newline)
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self.viewport())
+        painter.fillRect(event.rect(), self.palette().color(QtGui.QPalette.Base))
+
+        if self.data is None:
+            return
+
+        metrics = self.fontMetrics()
+        line_spacing = metrics.lineSpacing()
+        left = -self.horizontalScrollBar().value() + 4
+        first = self.verticalScrollBar().value()
+        if self.pending_offset is not None:
+            offset = self.pending_offset
+            current_row = 0
+        else:
+            offset = self.index.line_offset(first)
+            current_row = self.current_line - first
+        width = self.viewport().width()
+
+        painter.setPen(self.palette().color(QtGui.QPalette.Text))
+
+        for row in range(self.visible_lines() + 1):
+            if offset > len(self.data):
+                break
+
+            raw, next_offset = self.line_text(offset)
+            text = self.decode(raw)
+            top = row * line_spacing
+
+            if row == current_row:
+                painter.fillRect(0, top, width, line_spacing, self.line_format)
+
+            # Every visible match of a trusted query, only the match found
+            # last for a user pattern, which could hang the GUI thread
+            if self.matcher is not None and not self.matcher.untrusted and text:
+                starts, lengths, _ = self.matcher.scan(text)
+                for start, length in zip(starts, lengths):
+                    x = left + metrics.horizontalAdvance(text[:start])
+                    painter.fillRect(x, top, metrics.horizontalAdvance(text[start:start + length]),
+                                     line_spacing, self.match_format)
+
+            match_offset, match_length = self.match
+            if offset <= match_offset < next_offset:
+                before = self.decode(raw[:match_offset - offset])
+                matched = self.decode(raw[match_offset - offset:match_offset - offset + match_length])
+                painter.fillRect(left + metrics.horizontalAdvance(before), top,
+                                 metrics.horizontalAdvance(matched), line_spacing, self.match_format)
+
+            painter.drawText(left, top + metrics.ascent(), text)
+            self.max_width = max(self.max_width, metrics.horizontalAdvance(text) + 8)
+            offset = next_offset
+
+        self.horizontalScrollBar().setRange(0, max(0, self.max_width - width))
@@ -19,14 +19,44 @@
 
 """
 
+import argparse
+import codecs
+import os
 import sys
+import queue
 import functools
 import datetime
+import time
+
+# Startup is timed from here to the first paint of the editor
+STARTED = time.perf_counter()
 
 import PyQt5.QtCore as QtCore
 import PyQt5.QtWidgets as QtWidgets
 import PyQt5.QtGui as QtGui
-import highlighter
+import dispatch
+import fileio
+import filewatch
+import findfiles
+import follow
+import journal
+import largefile
+import search
+import statusbar
+import tabs
+
+
+ICON_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'icons')
+
+
+@functools.lru_cache(maxsize=None)
+def icon(name):
+    """ Icon of assets/icons loaded once, an empty icon if there is no such file """
+
+    path = os.path.join(ICON_DIRECTORY, name + '.png')
+    if not os.path.isfile(path):
+        return QtGui.QIcon()
+    return QtGui.QIcon(path)
 
 
 class Filter(QtCore.QObject):
@@ -49,14 +79,52 @@ class Filter(QtCore.QObject):
             return False
 
 
+def parse_percent(target):
+    """ Percentage of a Go to target like '42.5%', None if it isn't one """
+
+    if not target.endswith('%'):
+        return None
+    try:
+        percent = float(target[:-1])
+    except ValueError:
+        return None
+    return percent if 0 <= percent <= 100 else None
+
+
+def tab_attribute(name):
+    """ Attribute of the tab shown, as if it was one of the Notepad """
+
+    return property(lambda self: getattr(self.tab, name),
+                    lambda self, value: setattr(self.tab, name, value))
+
+
 class Notepad(QtWidgets.QMainWindow):
+
+    # The editor, file and jobs of the document shown, see tabs.Tab
+    text_widget = tab_attribute('editor')
+    syntax = tab_attribute('syntax')
+    journal = tab_attribute('journal')
+    viewer = tab_attribute('viewer')
+    file_path = tab_attribute('file_path')
+    file_name = tab_attribute('file_name')
+    encoding = tab_attribute('encoding')
+    has_changed = tab_attribute('has_changed')
+    file_offset = tab_attribute('file_offset')
+    line_hashes = tab_attribute('line_hashes')
+    line_hashes_revision = tab_attribute('line_hashes_revision')
+    follower = tab_attribute('follower')
+    follow_diverged = tab_attribute('follow_diverged')
+    watched_path = tab_attribute('watched_path')
+
     # INIT
     def __init__(self, window_width=1000, window_height=950):
         super().__init__()
 
-        # Initialize Plain Text Widget
+        # Documents are opened in tabs, self.tab is the one shown
 
-        self.text_widget = QtWidgets.QPlainTextEdit()
+        self.open_tabs = []
+        self.tab = tabs.Tab()
+        self.tab.create_editor()
 
         # Default Mode to Insertion
 
@@ -73,21 +141,114 @@ class Notepad(QtWidgets.QMainWindow):
 
         # Default start up File
 
-        self.file_name = 'Untitled.txt'
-        self.file_path = ['/', '']
-        self.file_type = self.file_name.split('.')[-1]
-        self.syntax = highlighter.PythonHighlighter(self.text_widget.document())
+        self.file_type = 'txt'
+
+        # Status Bar, created once and updated in place
+
+        self.status_bar = statusbar.StatusBar(self.text_widget)
+        self.setStatusBar(self.status_bar)
+
+        # Handlers of frequent signals run once per burst of edits, and the
+        # finder searches once its text stopped changing
+        self.dispatcher = dispatch.Dispatcher()
+        self.statusbar_changed = self.dispatcher.subscribe(self.update_statusbar)
+        self.titles_changed = self.dispatcher.subscribe(self.update_titles)
+        self.stale_titles = set()
+        self.matches_changed = self.dispatcher.subscribe(self.highlight_matches)
+        self.finder_changed = self.dispatcher.subscribe(self.search_text, dispatch.DEBOUNCED, 100)
+
+        # Files are read by a FileReader and appended a chunk per timer tick
+
+        self.reader = None
+        self.load_timer = QtCore.QTimer(self)
+        self.load_timer.setInterval(5)
+        self.load_timer.timeout.connect(self.load_chunk)
+        self.status_bar.cancel_btn.clicked.connect(self.cancel_open)
+
+        # Follow mode appends what gets written to the opened file, up to a
+        # number of lines when follow_line_limit isn't 0
+        self.follow_line_limit = 0
+
+        # Changes made to the opened files by other programs are reloaded as a diff
+        self.change_watcher = filewatch.ChangeWatcher()
+        self.change_watcher.changed.connect(self.file_changed)
+        self.reloader = None
+        self.reload_revision = 0
+
+        # Saves stream the document a few chunks per tick to a FileWriter
+        self.writer = None
+        self.save_path = None
+        self.save_chunks = None
+        self.save_pending = None
+        self.save_written = 0
+        self.save_revision = 0
+        self.save_timer = QtCore.QTimer(self)
+        self.save_timer.setInterval(0)
+        self.save_timer.timeout.connect(self.save_chunk)
+        self.status_bar.cancel_btn.clicked.connect(self.cancel_save)
+
+        # Find engine, keeps the matches of the finder query up to date
+
+        self.search_engine = search.SearchEngine(self.text_widget.document())
+        self.search_engine.changed.connect(self.matches_changed.mark)
+        # (document, revision, position) after a replacement whose next match awaits the index
+        self.pending_match = None
+
+        # Matches are painted once the document layout caught up with the edit
+        self.paint_timer = QtCore.QTimer(self)
+        self.paint_timer.setSingleShot(True)
+        self.paint_timer.setInterval(0)
+        self.paint_timer.timeout.connect(self.paint_visible_matches)
+
+        # Files above large_file_size are shown read-only from a memory map
+        self.large_file_size = 128 * 1024 * 1024
+
+        # Font and palette of every editor, set by default_visual
+        self.editor_font = QtGui.QFont()
+        self.editor_palette = QtGui.QPalette()
+
+        # Clean tabs not shown lately are unloaded while the documents
+        # outweigh memory_budget bytes, and read again once shown
+        self.memory_budget = 256 * 1024 * 1024
+
+        # Limits of the undo history of each tab, its oldest steps dropped once over them
+        self.undo_max_steps = 10000
+        self.undo_budget = 64 * 1024 * 1024
+
+        self.central_widget = QtWidgets.QTabWidget()
+        self.central_widget.setDocumentMode(True)
+        self.central_widget.setMovable(True)
+        self.central_widget.setTabsClosable(True)
+        self.add_tab(self.tab)
+        self.central_widget.currentChanged.connect(self.tab_changed)
+        self.central_widget.tabCloseRequested.connect(self.close_tab)
+
+        # Syntax highlighting, viewport first and plain text for very large files
         self.assign_syntax_def()
 
-        # Initialize Menus
+        # Initialize Menus, filled once the editor got painted
 
         self.menu_bar = self.menuBar()
-        self.file_menu()
-        self.edit_menu()
-        self.format_menu()
-        self.preferences_menu()
+        self.menus_built = False
+
+        # Actions editing the document, disabled while it is read-only
+        self.editing_actions = []
         self.finder_toolbar()
 
+        # Find in Files panel, created when first asked for
+        self.find_in_files = None
+
+        # Follow the file as it grows
+        self.follow_action = QtWidgets.QAction('&Follow', self)
+        self.follow_action.setStatusTip('Append what gets written to the file')
+        self.follow_action.setShortcut('Ctrl+Shift+L')
+        self.follow_action.setCheckable(True)
+        self.follow_action.toggled.connect(self.follow_file)
+
+        # Seconds from STARTED to the first paint of the editor
+        self.first_paint_time = None
+        self.text_widget.viewport().installEventFilter(self)
+
         # Set Default Pallete
 
         self.default_visual()
@@ -96,14 +257,16 @@ class Notepad(QtWidgets.QMainWindow):
 
         self.notepad_ui()
 
-        self.setCentralWidget(self.text_widget)
-        self.setWindowIcon(QtGui.QIcon('assets/icons/notepad.png'))
+        self.setCentralWidget(self.central_widget)
+        self.setWindowIcon(icon('notepad'))
         self.resize(window_width, window_height)
 
         # Center the main window to the screen
         self.center()
         self.show()
 
+        self.offer_recovery()
+
     def notepad_ui(self):
 
         self.update_cursor()
@@ -114,11 +277,6 @@ class Notepad(QtWidgets.QMainWindow):
         self.finder_focus()
         self.setWindowTitle('{} - Notepad'.format(self.file_name))
 
-        self.text_widget.textChanged.connect(functools.partial(self.need_saving, True))
-        self.text_widget.textChanged.connect(self.update_statusbar)
-        self.text_widget.textChanged.connect(self.search_text, True)
-        self.text_widget.cursorPositionChanged.connect(self.update_statusbar)
-
     def new_file(self):
         '''Open a new file'''
 
@@ -128,11 +286,16 @@ class Notepad(QtWidgets.QMainWindow):
             has_saved = True
 
         if has_saved:
+            self.follow_action.setChecked(False)
+            self.wait_save()
+            self.close_viewer()
             self.text_widget.clear()
             self.file_path = './'
             self.file_name = 'Untitled'
-            self.setWindowTitle("{} - Notepad".format(self.file_name))
+            self.encoding = fileio.default_encoding()
             self.need_saving(False)
+            self.journal.start(encoding=self.encoding)
+            self.watch_file(None)
 
     def center(self):
         """Center the window"""
@@ -142,10 +305,255 @@ class Notepad(QtWidgets.QMainWindow):
         frame.moveCenter(center_point)
         self.move(frame.topLeft())
 
+    # TABS
+
+    def add_tab(self, tab):
+
+        self.open_tabs.append(tab)
+        if tab.editor is not None:
+            self.connect_editor(tab)
+
+        self.central_widget.addTab(tab.stack, tab.file_name)
+        self.update_title(tab)
+
+    def create_editor(self, tab):
+        """ Give a tab its editor the first time it is shown, tabs opened in bulk cost little until then """
+
+        if tab.editor is None:
+            tab.create_editor()
+            self.connect_editor(tab)
+
+    def connect_editor(self, tab):
+
+        tab.editor.textChanged.connect(functools.partial(self.need_saving, True, tab))
+        tab.editor.cursorPositionChanged.connect(self.statusbar_changed.mark)
+        tab.editor.verticalScrollBar().valueChanged.connect(self.paint_timer.start)
+        tab.undo.set_limits(self.undo_max_steps, self.undo_budget)
+        tab.undo.changed.connect(self.statusbar_changed.mark)
+        tab.undo.trimmed.connect(functools.partial(self.undo_trimmed, tab))
+        self.style_tab(tab)
+
+    def new_tab(self):
+        """ Open an Untitled document in a new tab """
+
+        tab = tabs.Tab()
+        tab.create_editor()
+        self.add_tab(tab)
+        tab.journal.start(encoding=tab.encoding)
+        self.show_tab(tab)
+
+    def tab_at(self, index):
+
+        widget = self.central_widget.widget(index)
+        for tab in self.open_tabs:
+            if tab.stack is widget:
+                return tab
+        return None
+
+    def find_tab(self, path):
+        """ Tab of the file at path, None if it isn't open """
+
+        path = os.path.abspath(path)
+        for tab in self.open_tabs:
+            if tab.file_path != './' and os.path.abspath(tab.file_path[0]) == path:
+                return tab
+        return None
+
+    def show_tab(self, tab):
+
+        if tab is self.tab:
+            if not tab.loaded:
+                self.load_tab(tab)
+        else:
+            self.central_widget.setCurrentWidget(tab.stack)
+
+    def tab_changed(self, index):
+        """ Show the document of the tab at index, reading its file if it isn't loaded """
+
+        tab = self.tab_at(index)
+        if tab is None or tab is self.tab:
+            return
+
+        # Loads and reloads apply to the document they started from
+        if self.reader is not None or self.reloader is not None:
+            self.central_widget.setCurrentWidget(self.tab.stack)
+            self.statusBar().showMessage('Wait for {} to be read'.format(self.file_name))
+            return
+        self.wait_save()
+
+        self.paint_timer.stop()
+        self.text_widget.setExtraSelections([])
+        self.tab.last_used = time.monotonic()
+        self.create_editor(tab)
+        self.tab = tab
+
+        document = self.text_widget.document()
+        self.search_engine.set_document(document)
+        self.status_bar.set_document(document)
+        self.text_widget.setOverwriteMode(not self.insert)
+
+        # The follow action shows whether this tab follows its file
+        self.follow_action.blockSignals(True)
+        self.follow_action.setChecked(self.follower is not None)
+        self.follow_action.blockSignals(False)
+
+        self.search_text()
+        self.update_title(tab)
+        self.update_statusbar()
+        self.update_editing()
+        tab.stack.currentWidget().setFocus()
+
+        if not tab.loaded:
+            self.load_tab(tab)
+        elif tab.changed_on_disk:
+            tab.changed_on_disk = False
+            self.file_changed(os.path.abspath(self.watched_path))
+
+        self.unload_tabs()
+
+    def load_tab(self, tab):
+        """ Read the file of the tab shown, for the first time or once unloaded """
+
+        self.open_file(tab.file_path[0])
+
+        if not tab.loaded:
+            # Unreadable, an empty document must not be saved over the file
+            tab.file_path = './'
+            tab.file_name = 'Untitled'
+            tab.loaded = True
+            tab.position = None
+            self.need_saving(False, tab)
+            self.update_statusbar()
+            tab.journal.start(encoding=tab.encoding)
+
+    def restore_position(self, tab):
+        """ Put the cursor and the view of a tab read again where they were """
+
+        if tab.position is None:
+            return
+
+        position, scroll = tab.position
+        tab.position = None
+
+        cursor = tab.editor.textCursor()
+        cursor.setPosition(min(position, tab.editor.document().characterCount() - 1))
+        tab.editor.setTextCursor(cursor)
+        tab.editor.verticalScrollBar().setValue(scroll)
+
+    def close_tab(self, index):
+
+        tab = self.tab_at(index)
+        if tab is None:
+            return
+
+        self.finish_jobs()
+        if tab.has_changed and not self.confirm_close(tab):
+            return
+
+        if tab.follower is not None:
+            tab.follower.stop()
+            tab.follower = None
+        if tab.watched_path is not None:
+            self.change_watcher.unwatch(tab.watched_path)
+
+        self.open_tabs.remove(tab)
+        self.central_widget.removeTab(self.central_widget.indexOf(tab.stack))
+        tab.close()
+
+        if not self.open_tabs:
+            self.new_tab()
+
+    def close_current_tab(self):
+        self.close_tab(self.central_widget.currentIndex())
+
+    def finish_jobs(self):
+        """ Stop loading, finish saving and drop reloads, before tabs go away """
+
+        self.cancel_open()
+        self.wait_save()
+
+        if self.reloader is not None:
+            self.reloader.wait()
+            self.reloader = None
+
+    def unload_tabs(self):
+        """ Unload the clean tabs shown least recently while the documents outweigh the memory budget """
+
+        used = sum(tab.memory() for tab in self.open_tabs)
+
+        for tab in sorted(self.open_tabs, key=lambda tab: tab.last_used):
+            if used <= self.memory_budget:
+                break
+
+            # Only documents that can be read again as they are
+            if (tab is self.tab or not tab.loaded or tab.has_changed or tab.follower is not None or
+                    not os.path.isfile(tab.file_path[0])):
+                continue
+
+            used -= tab.memory()
+            self.unload_tab(tab)
+
+    def unload_tab(self, tab):
+
+        if tab.watched_path is not None:
+            self.change_watcher.unwatch(tab.watched_path)
+            tab.watched_path = None
+        tab.changed_on_disk = False
+
+        tab.unload()
+        self.need_saving(False, tab)
+
+    def undo_limits_dialog(self):
+
+        steps, ok = QtWidgets.QInputDialog.getInt(self, 'Undo History', 'Undo steps kept per tab:',
+                                                  self.undo_max_steps, 1)
+        if not ok:
+            return
+        budget, ok = QtWidgets.QInputDialog.getInt(self, 'Undo History', 'Megabytes of undo history per tab:',
+                                                   self.undo_budget // (1024 * 1024), 1)
+        if not ok:
+            return
+
+        self.undo_max_steps = steps
+        self.undo_budget = budget * 1024 * 1024
+        for tab in self.open_tabs:
+            if tab.undo is not None:
+                tab.undo.set_limits(self.undo_max_steps, self.undo_budget)
+
+    def undo_trimmed(self, tab):
+        if tab is self.tab:
+            self.statusBar().showMessage('Undo history over its limits, oldest steps dropped', 3000)
+
+    def memory_budget_dialog(self):
+
+        budget, ok = QtWidgets.QInputDialog.getInt(self, 'Memory Budget', 'Megabytes of documents kept in memory:',
+                                                   self.memory_budget // (1024 * 1024), 1)
+        if ok:
+            self.memory_budget = budget * 1024 * 1024
+            self.unload_tabs()
+
     # EVENTS
 
+    def eventFilter(self, widget, event):
+
+        if event.type() == QtCore.QEvent.Paint and self.first_paint_time is None:
+            self.first_paint_time = time.perf_counter() - STARTED
+            widget.removeEventFilter(self)
+
+            # The window is up, the menus can be built now
+            QtCore.QTimer.singleShot(0, self.build_menus)
+            self.statusBar().showMessage('Ready in {:.0f} ms'.format(self.first_paint_time * 1000), 3000)
+
+        return False
+
     def keyPressEvent(self, event):
 
+        if event.key() == QtCore.Qt.Key_Escape and self.reader:
+            self.cancel_open()
+
+        if event.key() == QtCore.Qt.Key_Escape and self.writer:
+            self.cancel_save()
+
         if event.key() == QtCore.Qt.Key_Insert:
             if self.text_widget.overwriteMode():
                 self.text_widget.setOverwriteMode(False)
@@ -156,37 +564,63 @@ class Notepad(QtWidgets.QMainWindow):
                 self.insert = False
                 self.update_statusbar()
 
-        if event.key() == QtCore.Qt.Key_Return:
-            self.search_text(True)
+        # Return in the finder jumps to the next match, Shift+Return to the previous one
+        if event.key() == QtCore.Qt.Key_Return and self.replacer.hasFocus():
+            self.replace_action()
+        elif event.key() == QtCore.Qt.Key_Return and self.finder.hasFocus():
+            if event.modifiers() & QtCore.Qt.ShiftModifier:
+                self.find_previous_action()
+            else:
+                self.find_next_action()
+        else:
+            super().keyPressEvent(event)
 
     # DEFAULT VISUALS AND STATUS BAR
 
     def closeEvent(self, event):
-        if self.has_changed:
-            save_ = QtWidgets.QMessageBox()
-            save_.setIcon(QtWidgets.QMessageBox.Question)
-            save_.setWindowTitle('Save and Exit')
-            save_.setText('The document has been modified.')
-            save_.setInformativeText('Do you want to save your changes?')
-            save_.setStandardButtons(QtWidgets.QMessageBox.Save | QtWidgets.QMessageBox.Discard |
-                                     QtWidgets.QMessageBox.Cancel)
-            save_.setDefaultButton(QtWidgets.QMessageBox.Save)
-            save_.setEscapeButton(QtWidgets.QMessageBox.Cancel)
-            reply = save_.exec_()
-
-            # reply returns an int
-            # Save
-            if reply == 2048:
-                self.save_file()
-                event.accept()
-            # Discard
-            elif reply == 8388608:
-                event.accept()
-            # Cancel
-            else:
+        self.finish_jobs()
+
+        for tab in list(self.open_tabs):
+            if tab.has_changed and not self.confirm_close(tab):
                 event.ignore()
+                return
+
+        # Edits saved or discarded, nothing to recover
+        event.accept()
+        for tab in self.open_tabs:
+            if tab.journal is not None:
+                tab.journal.stop()
+
+        if self.find_in_files is not None:
+            self.find_in_files.stop()
+
+    def confirm_close(self, tab):
+        """ Ask whether to save the changes of a tab, False to keep it open """
+
+        self.show_tab(tab)
+
+        save_ = QtWidgets.QMessageBox()
+        save_.setIcon(QtWidgets.QMessageBox.Question)
+        save_.setWindowTitle('Save and Close')
+        save_.setText('The document has been modified.')
+        save_.setInformativeText('Do you want to save your changes?')
+        save_.setStandardButtons(QtWidgets.QMessageBox.Save | QtWidgets.QMessageBox.Discard |
+                                 QtWidgets.QMessageBox.Cancel)
+        save_.setDefaultButton(QtWidgets.QMessageBox.Save)
+        save_.setEscapeButton(QtWidgets.QMessageBox.Cancel)
+        reply = save_.exec_()
+
+        # reply returns an int
+        # Save
+        if reply == 2048:
+            self.save_file(wait=True)
+            return not self.has_changed
+        # Discard
+        elif reply == 8388608:
+            return True
+        # Cancel
         else:
-            event.accept()
+            return False
 
     # DEFAULT VISUALS, STATUSBAR AND SYNTAX
 
@@ -207,21 +641,45 @@ class Notepad(QtWidgets.QMainWindow):
 
         # Font Type
         default_font = QtGui.QFont('Consolas', 13)
-        self.text_widget.setFont(default_font)
 
-        self.text_widget.setPalette(default_palette)
+        self.editor_font = default_font
+        self.editor_palette = default_palette
+        for tab in self.open_tabs:
+            self.style_tab(tab)
+
+    def style_tab(self, tab):
+
+        if tab.editor is None:
+            return
+        tab.editor.setFont(self.editor_font)
+        tab.editor.setPalette(self.editor_palette)
+        if tab.viewer is not None:
+            tab.viewer.setFont(self.editor_font)
+            tab.viewer.setPalette(self.editor_palette)
 
     def default_format(self):
         self.default_visual()
 
     def assign_syntax_def(self):
-        self.syntax.setDocument(None)
+        if self.syntax is not None:
+            self.syntax.setDocument(None)
         self.update_statusbar()
 
     def assign_syntax_py(self):
-        self.syntax = PythonHighlighter(self.text_widget.document())
+
+        # Most documents are never highlighted, the highlighter is only imported for those that are
+        if self.syntax is None:
+            import highlighter
+            self.syntax = highlighter.LazyHighlighter(self.text_widget)
+            self.syntax.fell_back.connect(self.syntax_fell_back)
+
+        self.syntax.setDocument(self.text_widget.document())
         self.update_statusbar()
 
+    def syntax_fell_back(self):
+        self.update_statusbar()
+        self.statusBar().showMessage('File too large for syntax highlighting, showing plain text')
+
     def get_cursor_position(self):
         """ Get Row and Column of actual text cursor """
         self.update_cursor()
@@ -236,53 +694,44 @@ class Notepad(QtWidgets.QMainWindow):
 
     def update_statusbar(self):
         """ Update the status bar with information"""
-        cursor_row, cursor_column = self.get_cursor_position()
-        newline_count = self.text_widget.blockCount()
-        char_count = self.char_count()
-        lines_str = 'lines: ' + str(newline_count)
-        chars_str = '  |  chars: ' + str(char_count)
-        column_str = '  |  Col: ' + str(cursor_column)
-        row_str = '  |  Row: ' + str(cursor_row)
-        ins_str = '  |  INS'
-        ovr_string = '  |  OVR'
-
-        status_string = lines_str + chars_str + column_str + row_str
-        status_lbl = QtWidgets.QLabel(status_string)
-        status_lbl.setAlignment(QtCore.Qt.AlignLeft)
-
-        filepath_lbl = QtWidgets.QLabel(str(self.file_path[0]))
-        filepath_lbl.setToolTip(str(self.file_path[0]))
-        filepath_lbl.setAlignment(QtCore.Qt.AlignLeft)
-
-        syntax_lbl = QtWidgets.QLabel()
-        syntax_lbl.setAlignment(QtCore.Qt.AlignCenter)
-
-        if self.syntax:
-            syntax_lbl.setText('Python')
+        self.status_bar.set_file_path(self.file_path[0])
+        self.status_bar.set_encoding(self.encoding)
+
+        if self.viewer_active():
+            index = self.viewer.index
+            self.status_bar.set_syntax('Default')
+            self.status_bar.set_undo_memory(None)
+            row = self.viewer.current_line + 1 if self.viewer.pending_offset is None else None
+            self.status_bar.show_line_index(index.line_count, len(self.viewer.data), row, index.complete)
+            return
+
+        if self.syntax is not None and self.syntax.document():
+            self.status_bar.set_syntax('Python')
         else:
-            syntax_lbl.setText('Default')
-
-        custom_status = QtWidgets.QStatusBar()
-        custom_status.addWidget(filepath_lbl, stretch=2)
-        custom_status.addWidget(status_lbl, stretch=1)
-        custom_status.addWidget(syntax_lbl, stretch=0)
-        custom_status.adjustSize()
+            self.status_bar.set_syntax('Default')
 
-        self.setStatusBar(custom_status)
-
-        if self.insert:
-            status_lbl.setText(status_string + ins_str)
-        else:
-            status_lbl.setText(status_string + ovr_string)
+        self.status_bar.set_undo_memory(self.tab.undo.memory())
+        self.status_bar.set_insert(self.insert)
+        self.status_bar.update_cursor(self.text_widget.textCursor())
 
     # MENU
 
     def char_count(self):
 
-        content = self.text_widget.toPlainText()
-        content_chars = list(content)
-        char_count = len(content_chars)
-        return char_count
+        return self.status_bar.char_count
+
+    def build_menus(self):
+        """ Fill the menu bar, after the first paint so it doesn't delay it """
+
+        if self.menus_built:
+            return
+        self.menus_built = True
+
+        self.file_menu()
+        self.edit_menu()
+        self.format_menu()
+        self.preferences_menu()
+        self.update_editing()
 
     def file_menu(self):
         """ Create a file menu in the menubar """
@@ -290,31 +739,42 @@ class Notepad(QtWidgets.QMainWindow):
         file_menu = self.menu_bar.addMenu('&File')
 
         # New File Action
-        new_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/new.png'), '&New File', self)
+        new_action = QtWidgets.QAction(icon('new'), '&New File', self)
         new_action.setStatusTip('Start a new file')
         new_action.setShortcut('Ctrl+N')
         new_action.triggered.connect(self.new_file)
 
         # Open a File Action
-        open_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/open.png'), '&Open...', self)
+        open_action = QtWidgets.QAction(icon('open'), '&Open...', self)
         open_action.setStatusTip('Open a file')
         open_action.setShortcut('Ctrl+O')
         open_action.triggered.connect(self.open_dialog)
 
         # Save a File Action
-        save_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/save.png'), '&Save', self)
+        save_action = QtWidgets.QAction(icon('save'), '&Save', self)
         save_action.setStatusTip('Save a file')
         save_action.setShortcut('Ctrl+S')
         save_action.triggered.connect(self.save_file)
 
         # Save File as Action
-        save_as_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/save_as.png'), 'Save &As', self)
+        save_as_action = QtWidgets.QAction(icon('save_as'), 'Save &As', self)
         save_as_action.setStatusTip('Save as.. a file')
         save_as_action.setShortcut('Ctrl+Shift+S')
         save_as_action.triggered.connect(self.save_dialog)
 
+        # Tabs
+        new_tab_action = QtWidgets.QAction('New &Tab', self)
+        new_tab_action.setStatusTip('Start a new file in a new tab')
+        new_tab_action.setShortcut('Ctrl+T')
+        new_tab_action.triggered.connect(self.new_tab)
+
+        close_tab_action = QtWidgets.QAction('&Close Tab', self)
+        close_tab_action.setStatusTip('Close the file shown')
+        close_tab_action.setShortcut('Ctrl+W')
+        close_tab_action.triggered.connect(self.close_current_tab)
+
         # Exit
-        exit_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/exit.png'), '&Exit', self)
+        exit_action = QtWidgets.QAction(icon('exit'), '&Exit', self)
         exit_action.setStatusTip('Exit')
         exit_action.setShortcut('Alt+F4')
         exit_action.triggered.connect(QtWidgets.qApp.quit)
@@ -322,62 +782,88 @@ class Notepad(QtWidgets.QMainWindow):
         # Add actions to menu
 
         file_menu.addAction(new_action)
+        file_menu.addAction(new_tab_action)
         file_menu.addAction(open_action)
         file_menu.addAction(save_action)
         file_menu.addAction(save_as_action)
+        file_menu.addAction(self.follow_action)
         file_menu.addSeparator()
+        file_menu.addAction(close_tab_action)
         file_menu.addAction(exit_action)
 
     def edit_menu(self):
 
         edit_menu = self.menu_bar.addMenu('&Edit')
 
-        undo_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/undo.png'), '&Undo Typing', self)
+        undo_action = QtWidgets.QAction(icon('undo'), '&Undo Typing', self)
         undo_action.setStatusTip('Undo last action')
         undo_action.setShortcut('Ctrl+Z')
         undo_action.triggered.connect(self.undo_action)
 
-        cut_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/cut.png'), 'Cu&t', self)
+        redo_action = QtWidgets.QAction('&Redo', self)
+        redo_action.setStatusTip('Redo the last action undone')
+        redo_action.setShortcuts([QtGui.QKeySequence('Ctrl+Y'), QtGui.QKeySequence('Ctrl+Shift+Z')])
+        redo_action.triggered.connect(self.redo_action)
+
+        cut_action = QtWidgets.QAction(icon('cut'), 'Cu&t', self)
         cut_action.setStatusTip('Cut the selection to clipboard')
         cut_action.setShortcut('Ctrl+X')
         cut_action.triggered.connect(self.cut_action)
 
-        copy_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/copy.png'), '&Copy', self)
+        copy_action = QtWidgets.QAction(icon('copy'), '&Copy', self)
         copy_action.setStatusTip('Copy selection to clipboard')
         copy_action.setShortcut('Ctrl+C')
         copy_action.triggered.connect(self.copy_action)
 
-        paste_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/paste.png'), '&Paste', self)
+        paste_action = QtWidgets.QAction(icon('paste'), '&Paste', self)
         paste_action.setStatusTip('Paste from clipboard')
         paste_action.setShortcut('Ctrl+V')
         paste_action.triggered.connect(self.paste_action)
 
-        del_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/del.png'), '&Delete', self)
+        del_action = QtWidgets.QAction(icon('del'), '&Delete', self)
         del_action.setStatusTip('Delete selection')
         del_action.setShortcut('Del')
         del_action.triggered.connect(self.del_action)
 
-        find_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/find.png'), '&Find', self)
+        find_action = QtWidgets.QAction(icon('find'), '&Find', self)
         find_action.setStatusTip('Find a string')
         find_action.setShortcut('Ctrl+F')
         find_action.triggered.connect(self.find_action)
 
-        find_next_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/find_next.png'), 'Find &next', self)
+        find_next_action = QtWidgets.QAction(icon('find_next'), 'Find &next', self)
         find_next_action.setStatusTip('Find next string in file')
-        find_next_action.setShortcut('Ctrl+Shift+F')
+        find_next_action.setShortcuts([QtGui.QKeySequence('Ctrl+Shift+F'), QtGui.QKeySequence('F3')])
         find_next_action.triggered.connect(self.find_next_action)
 
-        goto_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/go_to.png'), '&Go to...', self)
+        find_previous_action = QtWidgets.QAction(icon('find'), 'Find p&revious', self)
+        find_previous_action.setStatusTip('Find previous string in file')
+        find_previous_action.setShortcut('Shift+F3')
+        find_previous_action.triggered.connect(self.find_previous_action)
+
+        replace_mode_action = QtWidgets.QAction(icon('find'), '&Replace...', self)
+        replace_mode_action.setStatusTip('Replace a string')
+        replace_mode_action.setShortcut('Ctrl+H')
+        replace_mode_action.triggered.connect(self.replace_mode_action)
+
+        find_in_files_action = QtWidgets.QAction(icon('find'), 'Find in F&iles...', self)
+        find_in_files_action.setStatusTip('Find a string in the files of a directory')
+        find_in_files_action.setShortcut('Ctrl+Shift+H')
+        find_in_files_action.triggered.connect(self.find_in_files_action)
+
+        goto_action = QtWidgets.QAction(icon('go_to'), '&Go to...', self)
         goto_action.setStatusTip('Go to line')
         goto_action.setShortcut('Ctrl+G')
         goto_action.triggered.connect(functools.partial(self.goto_action, default=''))
 
-        select_all_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/select_all.png'), '&Select All', self)
+        select_all_action = QtWidgets.QAction(icon('select_all'), '&Select All', self)
         select_all_action.setStatusTip('Select all lines')
         select_all_action.setShortcut('Ctrl+A')
         select_all_action.triggered.connect(self.select_all_action)
 
+        self.editing_actions.extend([undo_action, redo_action, cut_action, paste_action, del_action])
+
         edit_menu.addAction(undo_action)
+        edit_menu.addAction(redo_action)
         edit_menu.addSeparator()
         edit_menu.addAction(cut_action)
         edit_menu.addAction(copy_action)
@@ -386,28 +872,46 @@ class Notepad(QtWidgets.QMainWindow):
         edit_menu.addSeparator()
         edit_menu.addAction(find_action)
         edit_menu.addAction(find_next_action)
+        edit_menu.addAction(find_previous_action)
+        edit_menu.addAction(replace_mode_action)
+        edit_menu.addAction(find_in_files_action)
         edit_menu.addAction(goto_action)
         edit_menu.addSeparator()
         edit_menu.addAction(select_all_action)
 
     def preferences_menu(self):
         
-        settings_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/config.png'), '&Settings', self)
+        settings_action = QtWidgets.QAction(icon('config'), '&Settings', self)
         settings_action.setStatusTip('Open Settings')
         settings_action.setShortcut('Ctrl+Shift+P')
 
+        follow_limit_action = QtWidgets.QAction('Follow &Line Limit...', self)
+        follow_limit_action.setStatusTip('Lines kept while following a file')
+        follow_limit_action.triggered.connect(self.follow_limit_dialog)
+
+        memory_budget_action = QtWidgets.QAction('&Memory Budget...', self)
+        memory_budget_action.setStatusTip('Memory kept by the documents of the tabs not shown')
+        memory_budget_action.triggered.connect(self.memory_budget_dialog)
+
+        undo_limits_action = QtWidgets.QAction('&Undo History...', self)
+        undo_limits_action.setStatusTip('Steps and memory kept by the undo history of each tab')
+        undo_limits_action.triggered.connect(self.undo_limits_dialog)
+
         preferences_menu = self.menu_bar.addMenu('Prefere&nces')
         preferences_menu.addAction(settings_action)
+        preferences_menu.addAction(follow_limit_action)
+        preferences_menu.addAction(memory_budget_action)
+        preferences_menu.addAction(undo_limits_action)
 
 
     def format_menu(self):
         """ Add Format Menu """
 
-        font_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/font.png'), '&Font', self)
+        font_action = QtWidgets.QAction(icon('font'), '&Font', self)
         font_action.setStatusTip('Change the document font')
         font_action.triggered.connect(self.font_dialog)
 
-        date_action = QtWidgets.QAction(QtGui.QIcon('assets/icons/date.png'), '&Append Date', self)
+        date_action = QtWidgets.QAction(icon('date'), '&Append Date', self)
         date_action.setStatusTip('Insert date and time at cursor location')
         date_action.setShortcut('F5')
         date_action.triggered.connect(self.insert_date)
@@ -421,9 +925,15 @@ class Notepad(QtWidgets.QMainWindow):
         self.default_syntax.triggered.connect(self.assign_syntax_def)
         self.python_syntax.triggered.connect(self.assign_syntax_py)
 
+        encoding_action = QtWidgets.QAction('&Encoding...', self)
+        encoding_action.setStatusTip('Change the encoding the file is saved in')
+        encoding_action.triggered.connect(self.encoding_dialog)
+
+        self.editing_actions.append(date_action)
+
         format_menu = self.menu_bar.addMenu('Forma&t')
 
-        syntax_menu = format_menu.addMenu(QtGui.QIcon('assets/icons/synthax.png'), '&Syntax')
+        syntax_menu = format_menu.addMenu(icon('syntax'), '&Syntax')
 
         syntax_menu.addAction(self.default_syntax)
         syntax_menu.addAction(self.python_syntax)
@@ -431,6 +941,7 @@ class Notepad(QtWidgets.QMainWindow):
         format_menu.addSeparator()
         format_menu.addAction(font_action)
         format_menu.addAction(date_action)
+        format_menu.addAction(encoding_action)
 
     # Text Finder
 
@@ -442,55 +953,163 @@ class Notepad(QtWidgets.QMainWindow):
         self.finder_toolbar.setFloatable(True)
         self.finder_tool()
         self.finder_toolbar.addWidget(self.finder)
+        self.finder_toolbar.addAction(self.regex_option)
+        self.finder_toolbar.addAction(self.case_option)
+        self.finder_toolbar.addAction(self.word_option)
+
+        # Replace widgets, only shown in replace mode
+        self.replace_widgets = [
+            self.finder_toolbar.addWidget(self.replacer),
+            self.finder_toolbar.addAction('Replace', self.replace_action),
+            self.finder_toolbar.addAction('Replace All', self.replace_all_action),
+        ]
+        self.editing_actions.extend(self.replace_widgets[1:])
+        self.show_replace(False)
 
         btn_close = QtWidgets.QToolButton()
-        btn_close.setIcon(QtGui.QIcon('assets/icons/close.png'))
+        btn_close.setIcon(icon('close'))
         btn_close.setFixedSize(16, 16)
         btn_close.clicked.connect(self.finder_toolbar.hide)
 
         self.finder_toolbar.addWidget(btn_close)
+        self.finder_toolbar.visibilityChanged.connect(self.search_text)
+        self.finder_toolbar.visibilityChanged.connect(self.finder_visibility)
         self.addToolBar(self.finder_toolbar)
         self.finder_focus()
 
     def finder_tool(self):
 
+        # Format and upper bound of the painted matches
+        self.match_format = QtGui.QTextCharFormat()
+        self.match_format.setBackground(QtGui.QColor('#FFE792'))
+        self.match_format.setForeground(QtGui.QColor('#2B2B2B'))
+        self.max_match_selections = 2000
+
         self.finder = QtWidgets.QLineEdit()
         self.finder.setPlaceholderText('Find...')
-        self.finder.textChanged.connect(self.search_text)
+        self.finder.textChanged.connect(self.finder_changed.mark)
+
+        # Search Options
+
+        self.regex_option = QtWidgets.QAction('.*', self)
+        self.regex_option.setToolTip('Regular expression')
+        self.regex_option.setCheckable(True)
+        self.regex_option.toggled.connect(self.search_text)
+
+        self.case_option = QtWidgets.QAction('Aa', self)
+        self.case_option.setToolTip('Match case')
+        self.case_option.setCheckable(True)
+        self.case_option.setChecked(True)
+        self.case_option.toggled.connect(self.search_text)
+
+        self.word_option = QtWidgets.QAction('W', self)
+        self.word_option.setToolTip('Whole word')
+        self.word_option.setCheckable(True)
+        self.word_option.toggled.connect(self.search_text)
+
+        self.replacer = QtWidgets.QLineEdit()
+        self.replacer.setPlaceholderText('Replace...')
+
+        # Above this many matches Replace All swaps in a rebuilt text
+        self.replace_rebuild_threshold = 100000
 
         self.finder_focus()
 
+    def find_in_files_action(self):
+        """ Show the Find in Files panel, with the selection or the finder query """
+
+        if self.find_in_files is None:
+            self.find_in_files = findfiles.FindInFilesPanel((self.regex_option, self.case_option, self.word_option),
+                                                            self)
+            self.find_in_files.open_hit.connect(self.open_at)
+            if self.file_path != './':
+                self.find_in_files.root.setText(os.path.dirname(os.path.abspath(self.file_path[0])))
+            self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.find_in_files)
+
+        query = '' if self.viewer_active() else self.text_widget.textCursor().selectedText()
+        if '\u2029' in query:
+            query = ''
+        self.find_in_files.focus(query or self.finder.text())
+
     def finder_focus(self):
         self.finder.installEventFilter(self._filter)
 
-    def search_text(self, jump_to_next=False):
-        _input = self.finder.text()
-        text = self.text_widget.toPlainText()
-        input_length = len(_input)
-        results = []
+    def show_replace(self, visible):
+        for widget in self.replace_widgets:
+            widget.setVisible(visible)
+
+    def finder_visibility(self, visible):
+        # Closing the finder leaves replace mode, only replace_mode_action enters it
+        if not visible:
+            self.show_replace(False)
+
+    def search_text(self):
+        """ Update the query of the find engine from the finder """
 
         # if there's text in the search box and it's not hidden
-        if _input and not self.finder_toolbar.isHidden():
-            for nth in range(len(text)):
-                # if the nth letter in the text matches with the first letter in the input
-                if text[nth] == _input[0]:
-                    # if the nth word which has the length of the input length matches the input
-                    if str(text[nth:nth + input_length]) == _input:
-                        # append start position and last position to results
-                        results.append((nth, nth + input_length))
+        if not self.finder_toolbar.isHidden():
+            self.search_engine.set_query(self.finder.text(),
+                                         regex=self.regex_option.isChecked(),
+                                         case_sensitive=self.case_option.isChecked(),
+                                         whole_word=self.word_option.isChecked())
         else:
-            pass
-        if results:
-            self.highlight_matches(results)
+            self.search_engine.set_query('')
+
+        if self.viewer is not None:
+            self.viewer.set_matcher(self.search_engine.matcher)
+
+    def highlight_matches(self):
+        self.select_pending_match()
+
+        matches = len(self.search_engine.index)
+        if self.search_engine.error:
+            self.statusBar().showMessage('Invalid pattern: {}'.format(self.search_engine.error))
+        elif self.viewer_active():
+            # matches in the viewer are only looked for on find next/previous
+            self.statusBar().clearMessage()
+        elif self.search_engine.searching:
+            self.statusBar().showMessage('{} matches, searching...'.format(matches))
+        elif self.search_engine.timed_out:
+            self.statusBar().showMessage('{} matches, search stopped after its time budget'.format(matches))
+        elif self.search_engine.query:
+            self.statusBar().showMessage('{} matches'.format(matches))
+        else:
+            self.statusBar().clearMessage()
+
+        self.paint_timer.start()
+
+    def visible_range(self):
+        """ Document offsets of the text shown in the viewport """
+
+        viewport = self.text_widget.viewport()
+        top_left = self.text_widget.cursorForPosition(QtCore.QPoint(0, 0))
+        bottom_right = self.text_widget.cursorForPosition(QtCore.QPoint(viewport.width(), viewport.height()))
+        bottom_right.movePosition(QtGui.QTextCursor.EndOfBlock)
+        return top_left.block().position(), bottom_right.position()
 
+    def paint_visible_matches(self):
+        """ Build extra selections only for the matches in or near the viewport """
 
-    def highlight_matches(self, results):
-        print(results)
-        pass
-        #class Match()
-        #selected = QtGui.QTextCharFormat()
+        index = self.search_engine.index
+        selections = []
 
+        if len(index):
+            begin, end = self.visible_range()
 
+            # one page above and below, so small scrolls are already painted
+            margin = end - begin
+            first = index.bisect(begin - margin)
+            last = min(index.bisect(end + margin), first + self.max_match_selections)
+
+            for nth in range(first, last):
+                selection = QtWidgets.QTextEdit.ExtraSelection()
+                selection.format = self.match_format
+                selection.cursor = QtGui.QTextCursor(self.text_widget.document())
+                selection.cursor.setPosition(index.start(nth))
+                selection.cursor.setPosition(index.start(nth) + index.length(nth), QtGui.QTextCursor.KeepAnchor)
+                selections.append(selection)
+
+        self.text_widget.setExtraSelections(selections)
 
     # ACTIONS
 
@@ -505,9 +1124,129 @@ class Notepad(QtWidgets.QMainWindow):
         if not self.finder_toolbar.isHidden():
             self.finder.setFocus(QtCore.Qt.ShortcutFocusReason)
 
+    def replace_mode_action(self):
+
+        self.find_action()
+        self.show_replace(True)
+
+    def replace_action(self):
+        """ Replace the selected match and select the next one """
+
+        self.finder_changed.flush()
+
+        if self.viewer_active():
+            self.statusBar().showMessage('Large files are opened read-only')
+            return
+        if self.text_widget.isReadOnly():
+            return
+
+        index = self.search_engine.index
+        self.update_cursor()
+        start = self.text_cursor.selectionStart()
+        nth = index.bisect(start)
+
+        if (nth < len(index) and self.text_cursor.hasSelection() and index.start(nth) == start and
+                index.length(nth) == self.text_cursor.selectionEnd() - start):
+            first = self.text_cursor.document().findBlock(start)
+            last = self.text_cursor.document().findBlock(self.text_cursor.selectionEnd())
+            text = search.block_range_text(first, last)
+            replacement = self.search_engine.matcher.expand(text, start - first.position(), self.replacer.text())
+            self.text_cursor.insertText(replacement)
+            self.text_widget.setTextCursor(self.text_cursor)
+
+        # Regex indexes are rebuilt after an edit, select the next match by position once it is
+        if self.search_engine.busy():
+            document = self.text_widget.document()
+            self.pending_match = (document, document.revision(), self.text_widget.textCursor().position())
+            return
+
+        self.find_next_action()
+
+    def select_pending_match(self):
+        """ Select the first match after the last replacement, if the index is rebuilt and nothing moved since """
+
+        if self.pending_match is None or self.search_engine.busy():
+            return
+
+        document, revision, position = self.pending_match
+        self.pending_match = None
+
+        index = self.search_engine.index
+        if (document is not self.text_widget.document() or document.revision() != revision or
+                self.text_widget.textCursor().position() != position or not len(index)):
+            return
+
+        nth = index.bisect(position)
+        self.select_match(nth if nth < len(index) else 0)
+
+    def replace_all_action(self):
+        """ Replace every match as a single undo step """
+
+        self.finder_changed.flush()
+
+        if self.viewer_active():
+            self.statusBar().showMessage('Large files are opened read-only')
+            return
+        if self.text_widget.isReadOnly():
+            return
+
+        engine = self.search_engine
+        if engine.busy():
+            self.statusBar().showMessage('The search is still running')
+            return
+
+        index = engine.index
+        count = len(index)
+        if not count:
+            return
+
+        template = self.replacer.text()
+        matcher = engine.matcher
+        index.flush()
+
+        # Painted matches are text cursors Qt would move on every replacement
+        self.paint_timer.stop()
+        self.text_widget.setExtraSelections([])
+
+        text = ''
+        if matcher.untrusted or count > self.replace_rebuild_threshold:
+            text = self.text_widget.toPlainText()
+
+        # Qt emits a single contentsChange for the whole edit block, so the
+        # status bar and the find engine only update once
+        cursor = QtGui.QTextCursor(self.text_widget.document())
+        cursor.beginEditBlock()
+
+        if count > self.replace_rebuild_threshold:
+            parts = []
+            previous = 0
+            for start, length in zip(index.starts, index.lengths):
+                parts.append(text[previous:start])
+                parts.append(matcher.expand(text, start, template))
+                previous = start + length
+            parts.append(text[previous:])
+
+            position = self.text_widget.textCursor().position()
+            cursor.select(QtGui.QTextCursor.Document)
+            cursor.insertText(''.join(parts))
+            cursor.setPosition(min(position, cursor.position()))
+            self.text_widget.setTextCursor(cursor)
+        else:
+            for start, length in zip(reversed(index.starts), reversed(index.lengths)):
+                cursor.setPosition(start)
+                cursor.setPosition(start + length, QtGui.QTextCursor.KeepAnchor)
+                cursor.insertText(matcher.expand(text, start, template))
+
+        cursor.endEditBlock()
+        self.matches_changed.flush()
+        self.statusBar().showMessage('Replaced {} occurrences'.format(count))
+
     def undo_action(self):
         self.text_widget.undo()
 
+    def redo_action(self):
+        self.text_widget.redo()
+
     def cut_action(self):
         self.text_widget.cut()
 
@@ -522,36 +1261,127 @@ class Notepad(QtWidgets.QMainWindow):
         self.text_cursor.deleteChar()
 
     def find_next_action(self):
-        pass
+        """ Select the first match after the cursor, wrapping to the top """
+
+        self.finder_changed.flush()
+
+        if self.viewer_active():
+            self.viewer_find(forward=True)
+            return
+
+        index = self.search_engine.index
+        if not len(index):
+            self.find_action()
+            return
+
+        nth = index.bisect(self.text_widget.textCursor().selectionEnd())
+        if nth == len(index):
+            nth = 0
+        self.select_match(nth)
+
+    def find_previous_action(self):
+        """ Select the last match before the cursor, wrapping to the bottom """
+
+        self.finder_changed.flush()
+
+        if self.viewer_active():
+            self.viewer_find(forward=False)
+            return
+
+        index = self.search_engine.index
+        if not len(index):
+            self.find_action()
+            return
+
+        nth = index.bisect(self.text_widget.textCursor().selectionStart()) - 1
+        if nth < 0:
+            nth = len(index) - 1
+        self.select_match(nth)
+
+    def viewer_find(self, forward):
+
+        if self.viewer.matcher is None:
+            self.find_action()
+            return
+
+        self.viewer.find(forward)
+        self.statusBar().showMessage('Searching...')
+
+    def viewer_searched(self, found):
+        if found:
+            self.statusBar().clearMessage()
+        else:
+            self.statusBar().showMessage('No matches')
+
+    def select_match(self, nth):
+        index = self.search_engine.index
+        self.update_cursor()
+        self.text_cursor.setPosition(index.start(nth))
+        self.text_cursor.setPosition(index.start(nth) + index.length(nth), QtGui.QTextCursor.KeepAnchor)
+        self.text_widget.setTextCursor(self.text_cursor)
 
     def goto_action(self, default):
+        """ Jump to a line, a line:column or a percentage of the file """
 
-        try:
-            line, ok = QtWidgets.QInputDialog.getText(self, "Go to..", "Go to line:", text=str(default))
+        label = 'Go to line, line:column or percentage:'
+        target = str(default)
 
-            if ok:
-                self.update_cursor()
-                if line.isdecimal and (int(line) >= 1) and (int(line) <= self.text_widget.blockCount()):
+        while True:
+            target, ok = QtWidgets.QInputDialog.getText(self, "Go to..", label, text=target)
+            if not ok:
+                return
 
-                    current_line = self.text_cursor.blockNumber() + 1
-                    moves = int(line) - current_line
+            # the viewer goes to a byte offset, without waiting for its line index
+            percent = parse_percent(target.strip())
+            if percent is not None and self.viewer_active():
+                self.viewer.goto_percent(percent)
+                return
 
-                    if moves < 0:
-                        self.text_cursor.movePosition(QtGui.QTextCursor.Up, QtGui.QTextCursor.KeepAnchor, -moves);
-                        self.text_widget.setTextCursor(self.text_cursor)
-                    else:
-                        self.text_cursor.movePosition(QtGui.QTextCursor.Down, QtGui.QTextCursor.MoveAnchor, moves)
-                        self.text_widget.setTextCursor(self.text_cursor)
+            position = self.goto_position(target.strip())
+            if position is not None:
+                break
 
-                    self.text_cursor.movePosition(QtGui.QTextCursor.StartOfLine)
-                    self.text_widget.setTextCursor(self.text_cursor)
+            label = 'Go to line (1 to {}), line:column or percentage:'.format(self.line_count())
 
-                else:
-                    default = line
-                    raise ValueError
+        self.goto_line(*position)
+
+    def goto_line(self, line, column=0):
+        """ Put the cursor on a line (0 based) and column, in the editor or the viewer """
+
+        if self.viewer_active():
+            self.viewer.goto_line(line)
+            return
+
+        # findBlockByNumber looks blocks up in the document's block tree
+        block = self.text_widget.document().findBlockByNumber(line)
+        cursor = QtGui.QTextCursor(block)
+        cursor.setPosition(block.position() + min(column, block.length() - 1))
+        self.text_widget.setTextCursor(cursor)
+        self.text_widget.centerCursor()
+
+    def goto_position(self, target):
+        """ Line (0 based) and column of a Go to target, None if it is invalid """
 
-        except ValueError:
-            self.goto_action(default=line)
+        if target.endswith('%'):
+            percent = parse_percent(target)
+            if percent is None:
+                return None
+            return round((self.line_count() - 1) * percent / 100), 0
+
+        line, _, column = target.partition(':')
+        if not line.isdecimal() or not (column.isdecimal() or not _):
+            return None
+        if not 1 <= int(line) <= self.line_count():
+            return None
+
+        # columns count like the Col of the status bar
+        return int(line) - 1, int(column or 0)
+
+    def line_count(self):
+
+        if self.viewer_active():
+            return self.viewer.line_count
+        return self.text_widget.blockCount()
 
     def select_all_action(self):
 
@@ -576,45 +1406,261 @@ class Notepad(QtWidgets.QMainWindow):
         font, ok = QtWidgets.QFontDialog.getFont(self)
 
         if ok:
-            self.text_widget.setFont(font)
+            self.editor_font = font
+            for tab in self.open_tabs:
+                self.style_tab(tab)
 
-    def need_saving(self, check_):
+    def need_saving(self, check_, tab=None):
         """ Check if file needs to be saved"""
 
-        self.has_changed = check_
+        tab = tab or self.tab
+        tab.has_changed = check_
 
-        if self.has_changed:
-            self.setWindowTitle('{}* - Notepad'.format(self.file_name))
-        else:
-            self.setWindowTitle('{} - Notepad'.format(self.file_name))
+        # Typing marks the tab changed on every key, its title is shown once
+        self.stale_titles.add(tab)
+        self.titles_changed.mark()
+
+    def update_titles(self):
+
+        stale, self.stale_titles = self.stale_titles, set()
+        for tab in stale:
+            if tab in self.open_tabs:
+                self.update_title(tab)
+
+    def update_title(self, tab):
+        """ Show the file name of a tab, with a * once changed """
+
+        title = tab.file_name + ('*' if tab.has_changed else '')
+
+        index = self.central_widget.indexOf(tab.stack)
+        if index >= 0:
+            self.central_widget.setTabText(index, title)
+            self.central_widget.setTabToolTip(index, tab.file_path[0] if tab.file_path != './' else '')
+
+        if tab is self.tab:
+            if self.viewer_active():
+                title += ' (read only)'
+            self.setWindowTitle('{} - Notepad'.format(title))
 
     def open_dialog(self):
         """ Open 'Open Dialog Box' """
 
-        if self.has_changed:
-            self.save_box(open=True)
+        file_paths = QtWidgets.QFileDialog.getOpenFileNames(self, 'Open Files', './',
+                                                            filter="All Files(*.*);;Text Files(*.txt)")
+
+        if file_paths[0]:
+            self.open_files(file_paths[0])
+
+    def open_files(self, paths):
+        """ Open each file in a tab, showing the first one
+
+        Only the tab shown reads its file, the others wait until they are
+        shown. A file already open goes to its tab, and an untouched
+        Untitled tab is reused.
+        """
+
+        shown = None
+        for path in paths:
+            tab = self.find_tab(path)
+
+            if tab is None:
+                current = self.tab
+                if (shown is None and current.loaded and current.file_path == './' and
+                        not current.has_changed and current.editor.document().isEmpty()):
+                    # the untouched tab reads the file like a new one
+                    tab = current
+                    tab.file_path = (path, '')
+                    tab.file_name = os.path.basename(path)
+                    tab.loaded = False
+                    self.update_title(tab)
+                else:
+                    tab = tabs.Tab(path)
+                    self.add_tab(tab)
+
+            if shown is None:
+                shown = tab
+
+        if shown is not None:
+            self.show_tab(shown)
+
+    def open_file(self, path):
+        """ Load a file in the background, appending it to the editor as it is read """
+
+        self.follow_action.setChecked(False)
+        self.cancel_open()
+        self.wait_save()
 
         try:
-            self.file_path = QtWidgets.QFileDialog.getOpenFileName(self, 'Open File', './',
-                                                         filter="All Files(*.*);;Text Files(*.txt)")
+            if os.path.getsize(path) > self.large_file_size:
+                self.open_viewer(path)
+                return
+            reader = fileio.FileReader(path)
+        except OSError as why:
+            self.error_box(why)
+            return
+
+        self.close_viewer()
+        self.file_path = (path, '')
+        self.file_name = os.path.basename(path)
+        self.tab.loaded = True
+        self.update_title(self.tab)
+
+        # Loading isn't an edit: no undo history, no journal and no typing in between chunks
+        self.journal.stop()
+        self.text_widget.clear()
+        self.text_widget.document().setUndoRedoEnabled(False)
+        self.set_read_only(True)
+
+        self.reader = reader
+        self.reader.start()
+        self.load_timer.start()
+
+        self.status_bar.show_progress(0)
+        self.statusBar().showMessage('Open... {}'.format(path))
+
+    def open_viewer(self, path):
+        """ Show a file too large for the editor read-only, from a memory map """
+
+        # Each tab gets a viewer the first time it shows a large file
+        if self.viewer is None:
+            self.viewer = largefile.LargeFileView()
+            self.viewer.changed.connect(self.update_statusbar)
+            self.viewer.searched.connect(self.viewer_searched)
+            self.style_tab(self.tab)
+            self.tab.stack.addWidget(self.viewer)
+
+        encoding = fileio.detect_file_encoding(path)
+        self.viewer.open_file(path, encoding)
+        self.encoding = encoding
+
+        self.journal.stop()
+        self.watch_file(None)
+        self.text_widget.clear()
+        self.tab.stack.setCurrentWidget(self.viewer)
+        self.viewer.set_matcher(self.search_engine.matcher)
+        self.viewer.setFocus()
+
+        self.file_path = (path, '')
+        self.file_name = os.path.basename(path)
+        self.tab.loaded = True
+        self.need_saving(False)
+        self.update_statusbar()
+        self.update_editing()
 
-            if self.file_path[0]:
-                self.file_name = (self.file_path[0].split('/'))[-1]
+    def open_at(self, path, line, column=0):
+        """ Show a file with the cursor at a line and column, once it is read """
 
-                self.setWindowTitle("{} - Notepad".format(self.file_name))
+        self.open_files([path])
 
-                file_open = open(self.file_path[0], 'r+')
-                self.statusBar().showMessage('Open... {}'.format(self.file_path[0]))
+        # Tabs don't switch while another file is read
+        tab = self.find_tab(path)
+        if tab is not self.tab:
+            return
 
-                with file_open:
-                    content = file_open.read()
-                    self.text_widget.setPlainText(content)
-                    self.need_saving(False)
+        if self.reader is not None:
+            tab.pending_goto = (line, column)
+        else:
+            self.goto_line(line, column)
+        tab.stack.currentWidget().setFocus()
 
+    def close_viewer(self):
+        """ Go back to the editor, unmapping the file shown by the viewer """
 
-        except UnicodeDecodeError as why:
-            self.error_box(why)
-            pass
+        if self.viewer_active():
+            self.viewer.close_file()
+            self.tab.stack.setCurrentWidget(self.text_widget)
+            self.text_widget.setFocus()
+            self.update_editing()
+
+    def set_read_only(self, read_only):
+        """ Make the editor read-only, or editable again, along with the editing actions """
+
+        self.text_widget.setReadOnly(read_only)
+        self.update_editing()
+
+    def update_editing(self):
+        """ Enable the editing actions only while the document shown can be edited
+
+        Read-only only stops the keyboard, the actions edit through cursors.
+        """
+
+        editable = not self.text_widget.isReadOnly() and not self.viewer_active()
+        for action in self.editing_actions:
+            action.setEnabled(editable)
+
+    def viewer_active(self):
+        return self.viewer is not None and self.tab.stack.currentWidget() is self.viewer
+
+    def load_chunk(self):
+        """ Append the next chunk decoded by the reader """
+
+        try:
+            item = self.reader.chunks.get_nowait()
+        except queue.Empty:
+            return
+
+        if item is None:
+            self.finish_open()
+        elif isinstance(item, Exception):
+            self.cancel_open()
+            self.error_box(item)
+        else:
+            text, bytes_read = item
+            cursor = QtGui.QTextCursor(self.text_widget.document())
+            cursor.movePosition(QtGui.QTextCursor.End)
+            cursor.insertText(text)
+            self.file_offset = bytes_read
+            if self.reader.size:
+                self.status_bar.show_progress(100 * bytes_read // self.reader.size)
+
+    def finish_open(self):
+
+        self.load_timer.stop()
+        self.encoding = self.reader.encoding
+        self.watch_file(self.file_path[0], self.reader.digest)
+        self.set_line_hashes(self.reader.line_hashes)
+        self.reader = None
+
+        self.text_widget.document().setUndoRedoEnabled(True)
+        self.set_read_only(False)
+        self.text_widget.moveCursor(QtGui.QTextCursor.Start)
+        self.restore_position(self.tab)
+        if self.tab.pending_goto is not None:
+            self.goto_line(*self.tab.pending_goto)
+            self.tab.pending_goto = None
+
+        self.status_bar.hide_progress()
+        self.statusBar().showMessage('Opened {}'.format(self.file_path[0]), 3000)
+        self.need_saving(False)
+        self.update_statusbar()
+        self.journal.start(self.file_path[0], self.encoding)
+        self.unload_tabs()
+
+    def cancel_open(self):
+        """ Stop loading a file and go back to an empty document """
+
+        if self.reader is None:
+            return
+
+        self.reader.cancel()
+        self.reader.wait()
+        self.load_timer.stop()
+        self.reader = None
+        self.tab.pending_goto = None
+
+        self.text_widget.document().setUndoRedoEnabled(True)
+        self.set_read_only(False)
+        self.status_bar.hide_progress()
+
+        # A partly loaded file must not be saved over the original
+        self.text_widget.clear()
+        self.file_path = './'
+        self.file_name = 'Untitled'
+        self.encoding = fileio.default_encoding()
+        self.need_saving(False)
+        self.update_statusbar()
+        self.journal.start(encoding=self.encoding)
+        self.watch_file(None)
 
     def save_box(self, new=False, open=False):
         """Save Message Box"""
@@ -623,7 +1669,7 @@ class Notepad(QtWidgets.QMainWindow):
                                                  QtWidgets.QMessageBox.Save | QtWidgets.QMessageBox.No |
                                                  QtWidgets.QMessageBox.Cancel, QtWidgets.QMessageBox.Save)
         if reply == QtWidgets.QMessageBox.Save:
-            self.save_file()
+            self.save_file(wait=True)
             if new:
                 return True
 
@@ -637,46 +1683,408 @@ class Notepad(QtWidgets.QMainWindow):
             elif open:
                 pass
 
-    def save_dialog(self):
+    def save_dialog(self, wait=False):
+
+        if self.viewer_active():
+            self.statusBar().showMessage('Large files are opened read-only')
+            return
+
+        save_dialog = QtWidgets.QFileDialog()
+        save_dialog.setAcceptMode(QtWidgets.QFileDialog.AcceptSave)
+        file_path = save_dialog.getSaveFileName(self, 'Save as... File', './',
+                                                filter='All Files(*.*);; Text Files(*.txt)')
+
+        if file_path[0]:
+            self.start_save(file_path, wait)
+
+    def save_file(self, wait=False):
+
+        if self.viewer_active():
+            self.statusBar().showMessage('Large files are opened read-only')
+            return
+
+        if self.follower is not None:
+            self.statusBar().showMessage('Stop following the file to save it')
+            return
+
+        if self.writer is not None:
+            if wait:
+                self.wait_save()
+            return
 
+        if self.file_path:
+            if (self.file_path[0].split('/')[-1].lower()) == self.file_name.lower():
+                self.start_save(self.file_path, wait)
+            else:
+                self.save_dialog(wait)
+
+    def start_save(self, file_path, wait=False):
+        """ Stream the document to file_path through a FileWriter """
+
+        self.writer = fileio.FileWriter(file_path[0], self.encoding)
+        self.writer.finished.connect(functools.partial(self.finish_save, self.writer))
+        self.writer.start()
+        self.save_path = file_path
+
+        # The document must not change while its blocks are being written,
+        # its revision tells whether something edited it anyway
+        self.save_chunks = fileio.document_chunks(self.text_widget.document())
+        self.save_pending = None
+        self.save_written = 0
+        self.save_revision = self.text_widget.document().revision()
+        self.set_read_only(True)
+
+        self.status_bar.show_progress(0)
+        self.statusBar().showMessage('Saving... {}'.format(file_path[0]))
+
+        if wait:
+            self.wait_save()
+        else:
+            self.save_timer.start()
+
+    def save_chunk(self, block=False):
+        """ Hand the next chunks of the document over to the writer """
+
+        deadline = time.perf_counter() + 0.008
+        while self.save_chunks is not None and time.perf_counter() < deadline:
+
+            if self.save_pending is None:
+                # an empty string marks the end of the document
+                self.save_pending = next(self.save_chunks, '')
+
+            try:
+                self.writer.chunks.put(self.save_pending or None, block=block)
+            except queue.Full:
+                return
+
+            if not self.save_pending:
+                self.save_chunks = None
+                self.save_timer.stop()
+            self.save_written += len(self.save_pending)
+            self.save_pending = None
+
+        self.status_bar.show_progress(100 * self.save_written // max(1, self.char_count()))
+
+    def wait_save(self):
+        """ Write the rest of a running save before going on, when the document is about to go """
+
+        if self.writer is None:
+            return
+
+        self.save_timer.stop()
+        while self.save_chunks is not None:
+            self.save_chunk(block=True)
+        self.writer.wait()
+        self.finish_save(self.writer)
+
+    def finish_save(self, writer):
+
+        if writer is not self.writer:
+            return
+
+        self.writer = None
+        self.save_chunks = None
+        self.save_timer.stop()
+        self.set_read_only(self.follower is not None)
+        self.status_bar.hide_progress()
+
+        if writer.cancelled.is_set():
+            self.statusBar().showMessage('Save cancelled')
+        elif isinstance(writer.error, UnicodeEncodeError):
+            self.statusBar().clearMessage()
+            if self.confirm_utf8(writer.error):
+                self.set_encoding('utf-8')
+                self.start_save(self.save_path, wait=True)
+        elif writer.error is not None:
+            self.statusBar().clearMessage()
+            self.error_box(writer.error)
+        else:
+            # Only a renamed file is saved, a failed write keeps the document dirty
+            self.file_path = self.save_path
+            self.file_name = os.path.basename(self.save_path[0])
+            self.file_offset = os.path.getsize(self.save_path[0])
+            self.watch_file(self.file_path[0], writer.digest)
+            self.update_statusbar()
+
+            # Edited while saving, the file holds the text from before the edit
+            if self.text_widget.document().revision() != self.save_revision:
+                self.line_hashes = None
+                self.statusBar().showMessage('Saved at: {}, edited since'.format(self.save_path[0]))
+                self.need_saving(True)
+                self.journal.start(self.file_path[0], self.encoding, snapshot=True)
+                return
+
+            self.set_line_hashes(writer.line_hashes)
+            self.statusBar().showMessage('Saved at: {}'.format(self.save_path[0]))
+            self.need_saving(False)
+            self.journal.start(self.file_path[0], self.encoding)
+
+    def confirm_utf8(self, why):
+        """ Ask whether to save as UTF-8 text the encoding of the file can't hold """
+
+        character = why.object[why.start:why.end]
+        reply = QtWidgets.QMessageBox.question(
+            self, 'Notepad', '{!r} can\'t be saved in {}. Save {} as UTF-8 instead?'.format(
+                character, self.encoding.upper(), self.file_name),
+            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No, QtWidgets.QMessageBox.Yes)
+        return reply == QtWidgets.QMessageBox.Yes
+
+    def set_encoding(self, encoding):
+        """ Save the document in another encoding from now on """
+
+        if codecs.lookup(encoding).name == codecs.lookup(self.encoding).name:
+            return
+        self.encoding = encoding
+        self.update_statusbar()
+        # the file no longer holds what a save would write
+        if self.file_path != './':
+            self.need_saving(True)
+
+    def encoding_dialog(self):
+
+        if self.viewer_active():
+            self.statusBar().showMessage('Large files are opened read-only')
+            return
+
+        encodings = ['utf-8', 'utf-8-sig', 'utf-16', 'cp1252', 'latin-1']
+        if self.encoding not in encodings:
+            encodings.insert(0, self.encoding)
+
+        encoding, ok = QtWidgets.QInputDialog.getItem(self, 'Encoding', 'Encoding to save the file in:',
+                                                      encodings, encodings.index(self.encoding), True)
+        if not ok:
+            return
         try:
-            save_dialog = QtWidgets.QFileDialog()
-            save_dialog.setAcceptMode(QtWidgets.QFileDialog.AcceptSave)
-            file_path = save_dialog.getSaveFileName(self, 'Save as... File', './',
-                                                    filter='All Files(*.*);; Text Files(*.txt)')
-
-            if file_path[0]:
-                self.file_path = file_path
-                file_open = open(self.file_path[0], 'w')
-                self.file_name = (self.file_path[0].split('/'))[-1]
-                self.statusBar().showMessage('Saved at: {}'.format(self.file_path[0]))
-                self.setWindowTitle("{} - Notepad".format(self.file_name))
-                with file_open:
-                    file_open.write(self.text_widget.toPlainText())
-                    self.need_saving(False)
-
-        except FileNotFoundError as why:
+            self.set_encoding(encoding.strip())
+        except LookupError as why:
             self.error_box(why)
-            pass
 
-    def save_file(self):
+    def cancel_save(self):
+        """ Stop a running save, leaving the file on disk as it was """
 
-        try:
-            if self.file_path:
-                if (self.file_path[0].split('/')[-1].lower()) == self.file_name.lower():
-                    file_open = open(self.file_path[0], 'w')
-                    self.file_name = (self.file_path[0].split('/'))[-1]
-                    self.setStatusTip('Saved at: {}'.format(self.file_path[0]))
-                    self.setWindowTitle("{} - Notepad".format(self.file_name))
-                    with file_open:
-                        file_open.write(self.text_widget.toPlainText())
-                        self.need_saving(False)
-                    return
-                else:
-                    self.save_dialog()
+        if self.writer is None:
+            return
+
+        self.save_timer.stop()
+        self.save_chunks = None
+        self.writer.cancel()
+        self.writer.wait()
+        self.finish_save(self.writer)
+
+    def follow_file(self, enabled):
+        """ Append what gets written to the opened file, like tail -f """
+
+        if not enabled:
+            self.stop_following()
+            return
 
-        except FileNotFoundError as why:
+        if (self.viewer_active() or self.reader or self.writer or self.has_changed or
+                not os.path.isfile(self.file_path[0])):
+            self.statusBar().showMessage('Follow needs a saved file opened in the editor')
+            self.follow_action.setChecked(False)
+            return
+
+        try:
+            self.follower = follow.Follower(self.file_path[0], self.file_offset, self.encoding)
+        except OSError as why:
+            self.follow_action.setChecked(False)
             self.error_box(why)
+            return
+
+        self.follower.appended.connect(functools.partial(self.follow_append, self.tab))
+        self.follower.restarted.connect(functools.partial(self.follow_restarted, self.tab))
+        self.follow_diverged = False
+
+        # The file is the journal of a followed document, its appends aren't edits
+        self.journal.stop()
+        self.set_read_only(True)
+        self.text_widget.document().setUndoRedoEnabled(False)
+        self.statusBar().showMessage('Following {}'.format(self.file_path[0]))
+
+        # Catch up with what was written since the file was opened
+        self.follower.read()
+
+    def follow_append(self, tab, text):
+        """ Append a batch read by the follower of a tab, dropping the oldest lines over the limit """
+
+        scroll_bar = tab.editor.verticalScrollBar()
+        at_bottom = scroll_bar.value() == scroll_bar.maximum()
+
+        document = tab.editor.document()
+        cursor = QtGui.QTextCursor(document)
+        cursor.beginEditBlock()
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.insertText(text)
+
+        excess = document.blockCount() - self.follow_line_limit
+        if self.follow_line_limit and excess > 0:
+            cursor.movePosition(QtGui.QTextCursor.Start)
+            cursor.movePosition(QtGui.QTextCursor.NextBlock, QtGui.QTextCursor.KeepAnchor, excess)
+            cursor.removeSelectedText()
+            tab.follow_diverged = True
+        cursor.endEditBlock()
+
+        # Only scroll along when the end was already in view
+        if at_bottom:
+            scroll_bar.setValue(scroll_bar.maximum())
+
+        self.need_saving(False, tab)
+
+    def follow_restarted(self, tab, reason):
+        # The document keeps what was read before, so it no longer matches the file
+        tab.follow_diverged = True
+        self.statusBar().showMessage('{} was {}, following its new contents'.format(tab.file_name, reason))
+
+    def stop_following(self):
+
+        if self.follower is None:
+            return
+
+        self.follower.stop()
+        self.file_offset = self.follower.offset
+        self.follower = None
+        self.watch_file(self.file_path[0])
+        self.set_read_only(False)
+        self.text_widget.document().setUndoRedoEnabled(True)
+        self.statusBar().clearMessage()
+
+        if self.follow_diverged:
+            self.need_saving(True)
+        self.journal.start(self.file_path[0], self.encoding, snapshot=self.follow_diverged)
+
+    def follow_limit_dialog(self):
+
+        limit, ok = QtWidgets.QInputDialog.getInt(self, 'Follow', 'Lines kept while following, 0 for all:',
+                                                  self.follow_line_limit, 0)
+        if ok:
+            self.follow_line_limit = limit
+
+    def watch_file(self, path, digest=None):
+        """ Watch the opened file for changes made by other programs """
+
+        if self.watched_path is not None:
+            self.change_watcher.unwatch(self.watched_path)
+        self.watched_path = path
+        if path is not None:
+            self.change_watcher.watch(path, digest)
+
+    def file_changed(self, path):
+
+        # A tab in the background is reloaded once shown
+        tab = self.find_tab(path)
+        if tab is None or tab.watched_path is None:
+            return
+        if tab is not self.tab:
+            tab.changed_on_disk = True
+            return
+
+        # Followed files are expected to change, and saves write the file themselves
+        if self.follower or self.reader or self.writer or self.viewer_active():
+            return
+
+        if self.has_changed:
+            reply = QtWidgets.QMessageBox().question(self, 'Notepad',
+                                                     '{} changed on disk. Reload it? Undo brings your changes '
+                                                     'back.'.format(self.file_name),
+                                                     QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                                     QtWidgets.QMessageBox.Yes)
+            if reply != QtWidgets.QMessageBox.Yes:
+                return
+
+        self.reload_file()
+
+    def reload_file(self):
+        """ Diff the opened file against the document on a worker """
+
+        document = self.text_widget.document()
+        self.reload_revision = document.revision()
+
+        # Without edits since the last read or save, the lines hashed then stand for the document
+        if self.line_hashes is not None and self.line_hashes_revision == self.reload_revision:
+            self.reloader = filewatch.DiffWorker(self.file_path[0], self.encoding, line_hashes=self.line_hashes)
+        else:
+            self.reloader = filewatch.DiffWorker(self.file_path[0], self.encoding,
+                                                 text=self.text_widget.toPlainText())
+        self.reloader.finished.connect(functools.partial(self.finish_reload, self.reloader))
+        self.reloader.start()
+        self.statusBar().showMessage('Reloading {}...'.format(self.file_name))
+
+    def finish_reload(self, reloader):
+        """ Apply the changed hunks only, keeping the cursor, scroll and undo history """
+
+        if reloader is not self.reloader:
+            return
+        self.reloader = None
+
+        if reloader.error is not None:
+            self.statusBar().clearMessage()
+            self.error_box(reloader.error)
+            return
+
+        # Edited while diffing, the hunks don't apply anymore
+        if self.text_widget.document().revision() != self.reload_revision:
+            self.reload_file()
+            return
+
+        filewatch.apply_hunks(self.text_widget.document(), reloader.hunks)
+        self.set_line_hashes(reloader.line_hashes)
+
+        self.file_offset = reloader.size
+        self.change_watcher.watch(self.file_path[0], reloader.digest)
+        self.need_saving(False)
+        self.journal.start(self.file_path[0], self.encoding)
+        self.statusBar().showMessage('Reloaded {}, {} changes'.format(self.file_name, len(reloader.hunks)))
+
+    def set_line_hashes(self, line_hashes):
+
+        # Text with line separators has fewer blocks than lines, diff it as text then
+        if line_hashes is not None and len(line_hashes) == self.text_widget.blockCount():
+            self.line_hashes = line_hashes
+            self.line_hashes_revision = self.text_widget.document().revision()
+        else:
+            self.line_hashes = None
+
+    def offer_recovery(self):
+        """ Offer to replay the journals left behind by a crash, newest first """
+
+        for path in journal.stale_journals(os.path.dirname(self.journal.path)):
+            try:
+                header, text, records = journal.load(path)
+            except (OSError, UnicodeDecodeError, LookupError, journal.JournalError) as why:
+                self.statusBar().showMessage('Could not recover {}: {}'.format(path, why))
+                os.remove(path)
+                continue
+
+            name = os.path.basename(header['path'] or 'Untitled')
+            reply = QtWidgets.QMessageBox().question(self, 'Notepad',
+                                                     'Recover the unsaved changes of {}?'.format(name),
+                                                     QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                                     QtWidgets.QMessageBox.Yes)
+            if reply == QtWidgets.QMessageBox.Yes:
+                self.recover(header, text, records)
+
+            os.remove(path)
+
+    def recover(self, header, text, records):
+        """ Rebuild a document from a journal in a tab, unsaved like it was """
+
+        if self.has_changed or self.file_path != './' or not self.text_widget.document().isEmpty():
+            self.new_tab()
+
+        self.journal.stop()
+        self.text_widget.setPlainText(text)
+
+        self.file_path = (header['path'], '') if header['path'] else './'
+        self.file_name = os.path.basename(header['path'] or 'Untitled')
+        self.encoding = header['encoding'] or fileio.default_encoding()
+
+        # The new journal starts where the old one did, then logs the replay
+        self.journal.start(header['path'], self.encoding, snapshot=header['snapshot'])
+        journal.replay(self.text_widget.document(), records)
+
+        self.need_saving(True)
+        self.update_statusbar()
+        self.statusBar().showMessage('Recovered {} edits'.format(len(records)))
 
     @staticmethod
     def error_box(why):
@@ -691,6 +2099,25 @@ class Notepad(QtWidgets.QMainWindow):
 
 
 if __name__ == '__main__':
-    app = QtWidgets.QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description='Notepad in PyQt5')
+    parser.add_argument('files', nargs='*', help='files to open, each in a tab')
+    parser.add_argument('--profile', nargs='?', const='', metavar='TRACE',
+                        help='time the slots and events of the UI, writing a Chrome trace on exit')
+    # Qt takes options of its own, like -style
+    options = parser.parse_known_args()[0]
+
+    trace_path = options.profile
+    if trace_path is None:
+        trace_path = os.environ.get('NOTEPAD_PROFILE')
+
+    if trace_path is not None:
+        import profiler
+        profile = profiler.Profiler(trace_path or profiler.DEFAULT_TRACE)
+        profile.install(Notepad)
+        app = profiler.ProfiledApplication(sys.argv, profile)
+    else:
+        app = QtWidgets.QApplication(sys.argv)
+
     notes = Notepad()
+    notes.open_files(options.files)
     sys.exit(app.exec_())
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import collections
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+
+import PyQt5.QtCore as QtCore
+import PyQt5.QtWidgets as QtWidgets
+import highlighter
+import journal
+import search
+import statusbar
+import undo
+
+
+# Written when --profile or NOTEPAD_PROFILE don't name the trace
+DEFAULT_TRACE = 'notepad-trace.json'
+
+# Slots of the main window, by the order they run in after an edit
+WINDOW_SLOTS = [
+    'keyPressEvent', 'need_saving', 'update_titles', 'update_statusbar', 'search_text', 'highlight_matches',
+    'paint_visible_matches', 'tab_changed', 'load_chunk', 'save_chunk', 'follow_append',
+    'file_changed', 'finish_reload', 'unload_tabs',
+]
+
+# Slots of the components, per class
+COMPONENT_SLOTS = [
+    (statusbar.StatusBar, ['contents_change', 'update_cursor']),
+    (search.SearchEngine, ['contents_change', 'set_query', 'rescan']),
+    (journal.Journal, ['contents_change', 'snapshot']),
+    (undo.UndoHistory, ['contents_change', 'type_text']),
+    (highlighter.LazyHighlighter, ['contents_change', 'highlight_viewport', 'highlight_slice']),
+]
+
+# Called once per block, only counted in the histograms
+BLOCK_SLOTS = [
+    (highlighter.PythonHighlighter, ['highlightBlock']),
+    (highlighter.LazyHighlighter, ['highlight']),
+]
+
+# Event types by value, for the names of the events in the trace
+EVENT_NAMES = {value: name for name, value in vars(QtCore.QEvent).items()
+               if isinstance(value, QtCore.QEvent.Type)}
+
+
+class Profiler:
+    """ Latency histograms and a Chrome trace of the slots and events of the UI
+
+    Each call of an instrumented slot, and each event dispatched by
+    ProfiledApplication, is timed with perf_counter_ns. Durations go to a
+    histogram of power of two microseconds per name, and to a trace in
+    the Chrome trace event format, which chrome://tracing and Perfetto
+    open. Events dispatched for longer than frame_budget are long frames,
+    blamed on the slot that took the most time within them.
+    """
+
+    # Nanoseconds an event may take before the frame is late
+    frame_budget = 16 * 1000 * 1000
+    # Trace events kept, the oldest go first
+    trace_size = 1000000
+
+    def __init__(self, trace_path):
+
+        self.trace_path = trace_path
+        self.started = time.perf_counter_ns()
+        self.thread = threading.get_ident()
+
+        self.histograms = collections.defaultdict(lambda: [0] * 40)
+        self.trace = collections.deque(maxlen=self.trace_size)
+        self.long_frames = collections.Counter()
+
+        # Slot time spent within the event being dispatched
+        self.frame_slots = collections.Counter()
+
+    def record(self, name, begin, end, trace=True):
+
+        duration = end - begin
+        self.histograms[name][min(39, (duration // 1000).bit_length())] += 1
+        self.frame_slots[name] += duration
+        if trace:
+            self.trace.append((name, begin, duration))
+
+    def timed(self, name, function, trace=True):
+        """ function, recording the time of each call under name """
+
+        # Signals drop the arguments a slot doesn't take, so must the wrapper
+        code = function.__code__
+        limit = None if code.co_flags & inspect.CO_VARARGS else code.co_argcount
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if limit is not None:
+                args = args[:limit]
+
+            # Slots running on worker threads would mix with the frames
+            if threading.get_ident() != self.thread:
+                return function(*args, **kwargs)
+
+            begin = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, begin, time.perf_counter_ns(), trace)
+
+        return wrapper
+
+    def instrument(self, cls, names, trace=True):
+        """ Replace methods of cls by timed ones, before any instance connects them """
+
+        for name in names:
+            setattr(cls, name, self.timed('{}.{}'.format(cls.__name__, name), getattr(cls, name), trace))
+
+    def install(self, window_class):
+        """ Instrument the slots of window_class and of the components """
+
+        self.instrument(window_class, WINDOW_SLOTS)
+        for cls, names in COMPONENT_SLOTS:
+            self.instrument(cls, names)
+        for cls, names in BLOCK_SLOTS:
+            self.instrument(cls, names, trace=False)
+
+    def event_done(self, event_type, begin, end):
+        """ Record an event dispatched from the event loop, with the slots it ran """
+
+        name = 'event:{}'.format(EVENT_NAMES.get(event_type, int(event_type)))
+        duration = end - begin
+
+        if duration > self.frame_budget:
+            slowest = max(self.frame_slots, key=self.frame_slots.get) if self.frame_slots else name
+            self.long_frames[slowest] += 1
+            self.trace.append((name, begin, duration, slowest))
+            self.histograms[name][min(39, (duration // 1000).bit_length())] += 1
+        elif duration > 1000 * 1000:
+            self.record(name, begin, end)
+        else:
+            # Most events are short, they only count in the histogram
+            self.histograms[name][min(39, (duration // 1000).bit_length())] += 1
+
+        self.frame_slots.clear()
+
+    # REPORT
+
+    def summary(self):
+        """ Count and percentiles of each histogram, slowest first """
+
+        rows = []
+        for name, buckets in self.histograms.items():
+            count = sum(buckets)
+            if not count:
+                continue
+
+            def percentile(fraction):
+                seen = 0
+                for bucket, bucket_count in enumerate(buckets):
+                    seen += bucket_count
+                    if seen >= fraction * count:
+                        # upper bound of the bucket
+                        return (1 << bucket) / 1000
+                return 0
+
+            rows.append({'name': name, 'count': count, 'p50_ms': percentile(0.5),
+                         'p99_ms': percentile(0.99), 'max_ms': percentile(1)})
+
+        return sorted(rows, key=lambda row: row['p99_ms'], reverse=True)
+
+    def trace_events(self):
+
+        pid = os.getpid()
+        for item in self.trace:
+            name, begin, duration = item[:3]
+            event = {'name': name, 'cat': 'event' if name.startswith('event:') else 'slot', 'ph': 'X',
+                     'ts': (begin - self.started) / 1000, 'dur': duration / 1000, 'pid': pid, 'tid': 0}
+            if len(item) > 3:
+                event['args'] = {'long_frame': True, 'slowest': item[3]}
+            yield event
+
+    def export(self):
+        """ Write the trace, with the histograms, and print the summary """
+
+        summary = self.summary()
+
+        with open(self.trace_path, 'w', encoding='utf-8') as file_open:
+            json.dump({'traceEvents': list(self.trace_events()), 'displayTimeUnit': 'ms',
+                       'histograms': {name: list(buckets) for name, buckets in self.histograms.items()},
+                       'summary': summary, 'longFrames': dict(self.long_frames)}, file_open)
+
+        print('{:<46} {:>8} {:>9} {:>9} {:>9}'.format('Slot or event', 'Count', 'p50 ms', 'p99 ms', 'Max ms'),
+              file=sys.stderr)
+        for row in summary[:30]:
+            print('{name:<46} {count:>8} {p50_ms:>9.3f} {p99_ms:>9.3f} {max_ms:>9.3f}'.format(**row),
+                  file=sys.stderr)
+
+        print('{} frames over {} ms'.format(sum(self.long_frames.values()), self.frame_budget // 1000000),
+              file=sys.stderr)
+        for name, count in self.long_frames.most_common(10):
+            print('  {:<44} {:>8}'.format(name, count), file=sys.stderr)
+        print('Trace written to {}'.format(self.trace_path), file=sys.stderr)
+
+
+class ProfiledApplication(QtWidgets.QApplication):
+    """ Application timing the events it dispatches from its event loop """
+
+    def __init__(self, argv, profiler):
+        super().__init__(argv)
+
+        self.profiler = profiler
+        self.depth = 0
+        self.aboutToQuit.connect(profiler.export)
+
+    def notify(self, receiver, event):
+
+        # Events sent from within another one are part of its time
+        if self.depth or threading.get_ident() != self.profiler.thread:
+            return super().notify(receiver, event)
+
+        event_type = event.type()
+        self.depth += 1
+        begin = time.perf_counter_ns()
+        try:
+            return super().notify(receiver, event)
+        finally:
+            self.depth -= 1
+            self.profiler.event_done(event_type, begin, time.perf_counter_ns())
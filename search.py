@@ -0,0 +1,643 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import bisect
+import collections
+import functools
+import multiprocessing
+import re
+import threading
+import time
+from array import array
+
+import PyQt5.QtCore as QtCore
+
+
+class SearchTimeout(Exception):
+    """ Raised when a scan runs over its time budget """
+
+
+@functools.lru_cache(maxsize=32)
+def compile_pattern(query, regex=False, case_sensitive=True, whole_word=False):
+    """ Compiled pattern of a query, None when str.find is enough """
+
+    if not regex and not whole_word and case_sensitive:
+        return None
+
+    pattern = query if regex else re.escape(query)
+    if whole_word:
+        pattern = r'\b(?:{})\b'.format(pattern)
+
+    flags = re.MULTILINE
+    if not case_sensitive:
+        flags |= re.IGNORECASE
+
+    return re.compile(pattern, flags)
+
+
+class Matcher:
+    """ Finds the matches of a query starting in a range of text
+
+    Literal queries go through str.find. Regex, case insensitive and whole
+    word queries use a compiled pattern and are matched within the range
+    given to scan, so callers pass ranges ending on a line boundary.
+    """
+
+    # Matches found between two checks of the deadline
+    check_every = 1024
+
+    def __init__(self, query, regex=False, case_sensitive=True, whole_word=False):
+        self.query = query
+        self.key = (query, regex, case_sensitive, whole_word)
+        self.pattern = compile_pattern(query, regex, case_sensitive, whole_word)
+
+        # A user written pattern can backtrack for ever while holding the GIL
+        self.untrusted = regex
+
+    def spans_lines(self):
+        """ Whether a match can cross a block boundary: any regex, or a literal with a newline """
+        return self.untrusted or (self.pattern is None and '\n' in self.query)
+
+    def scan(self, text, begin=0, end=None, offset=0, deadline=None):
+        """ Matches starting in text[begin:end]
+
+        Returns the start offsets (shifted by offset), the lengths and the
+        position to resume scanning from.
+        """
+
+        if end is None:
+            end = len(text)
+
+        starts = array('q')
+        lengths = array('l')
+
+        if self.pattern is None:
+            find = text.find
+            length = len(self.query)
+            position = begin
+            index = find(self.query, position, end + length - 1)
+            while index >= 0:
+                starts.append(index + offset)
+                position = index + length
+                if deadline is not None and not len(starts) % self.check_every:
+                    self.check_deadline(deadline)
+                index = find(self.query, position, end + length - 1)
+            lengths = array('l', [length]) * len(starts)
+            return starts, lengths, max(position, end)
+
+        for match in self.pattern.finditer(text, begin, end):
+            length = match.end() - match.start()
+            # zero width matches can't be painted or replaced
+            if length:
+                starts.append(match.start() + offset)
+                lengths.append(length)
+                if deadline is not None and not len(starts) % self.check_every:
+                    self.check_deadline(deadline)
+
+        return starts, lengths, end
+
+    def expand(self, text, start, template):
+        """ Replacement for the match at start, with group references expanded for regexes """
+
+        if not self.untrusted:
+            return template
+
+        match = self.pattern.match(text, start)
+        if match is None:
+            return template
+        return match.expand(template)
+
+    @staticmethod
+    def check_deadline(deadline):
+        if time.perf_counter() > deadline:
+            raise SearchTimeout()
+
+
+def scan_windows(matcher, text, chunk_size):
+    """ Yield the starts and lengths of the matches, one window of text at a time """
+
+    size = len(text)
+    position = 0
+
+    while position < size:
+        # windows end on a line boundary so patterns see whole lines
+        window_end = text.find('\n', min(position + chunk_size, size))
+        if window_end < 0:
+            window_end = size
+
+        starts, lengths, position = matcher.scan(text, position, window_end)
+        yield starts, lengths
+
+
+def scan_server(connection):
+    """ Child process side of untrusted pattern scans, one request after the other """
+
+    while True:
+        try:
+            text, key, chunk_size = connection.recv()
+        except EOFError:
+            return
+
+        for starts, lengths in scan_windows(Matcher(*key), text, chunk_size):
+            connection.send((starts, lengths))
+        connection.send(None)
+
+
+class ScanProcess:
+    """ A child process scanning for untrusted patterns, kept between scans
+
+    Starting an interpreter takes hundreds of milliseconds, so the process
+    is only replaced after being killed in the middle of a scan that was
+    cancelled or ran over its time budget. One scan runs at a time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.process = None
+        self.connection = None
+
+    def scan(self, text, key, chunk_size, poll_interval):
+        """ Yield the batches of matches of text, or empty ones while waiting """
+
+        with self.lock:
+            if self.process is None or not self.process.is_alive():
+                self.start()
+
+            finished = False
+            try:
+                self.connection.send((text, key, chunk_size))
+                while True:
+                    if not self.connection.poll(poll_interval):
+                        yield array('q'), array('l')
+                        continue
+                    batch = self.connection.recv()
+                    if batch is None:
+                        finished = True
+                        break
+                    yield batch
+            except (EOFError, OSError):
+                pass
+            finally:
+                # Closed early, the process may be stuck backtracking
+                if not finished:
+                    self.kill()
+
+    def scan_now(self, text, key, timeout):
+        """ Starts and lengths of the matches in text, None if the process isn't idle or takes over timeout seconds
+
+        A scan over its timeout is killed along with the process, which the
+        next scan started from a SearchWorker replaces. The process isn't
+        started here, as that alone would take longer than the timeout.
+        """
+
+        deadline = time.perf_counter() + timeout
+        if self.process is None or not self.lock.acquire(blocking=False):
+            return None
+
+        try:
+            if not self.process.is_alive():
+                self.kill()
+                return None
+
+            self.connection.send((text, key, len(text) + 1))
+            starts = array('q')
+            lengths = array('l')
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or not self.connection.poll(remaining):
+                    self.kill()
+                    return None
+                batch = self.connection.recv()
+                if batch is None:
+                    return starts, lengths
+                starts.extend(batch[0])
+                lengths.extend(batch[1])
+        except (EOFError, OSError):
+            self.kill()
+            return None
+        finally:
+            self.lock.release()
+
+    def start(self):
+        self.kill()
+        context = multiprocessing.get_context('spawn')
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=scan_server, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def kill(self):
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.connection.close()
+        self.process = None
+        self.connection = None
+
+
+def block_range_text(first, last):
+    """ Plain text from the start of block first to the end of block last """
+
+    parts = []
+    block = first
+    while True:
+        parts.append(block.text())
+        if block == last or not block.isValid():
+            break
+        block = block.next()
+
+    return '\n'.join(parts)
+
+
+class MatchIndex:
+    """ Sorted start offsets and lengths of the matches of one query
+
+    Edits shift every match after them. Instead of rewriting the tail of
+    the array on each keystroke, the shift is kept pending from index
+    shift_from onwards and only applied to the entries between two edits
+    that happen in different places.
+    """
+
+    def __init__(self, starts=None, lengths=None):
+        self.starts = starts if starts is not None else array('q')
+        self.lengths = lengths if lengths is not None else array('l')
+        self.shift_from = 0
+        self.shift = 0
+
+    def __len__(self):
+        return len(self.starts)
+
+    def start(self, nth):
+        """ Document offset of the nth match """
+
+        if self.shift and nth >= self.shift_from:
+            return self.starts[nth] + self.shift
+        return self.starts[nth]
+
+    def length(self, nth):
+        return self.lengths[nth]
+
+    def bisect(self, position):
+        """ Index of the first match starting at or after position """
+
+        if not self.shift:
+            return bisect.bisect_left(self.starts, position)
+
+        nth = bisect.bisect_left(self.starts, position, 0, self.shift_from)
+        if nth < self.shift_from:
+            return nth
+        return bisect.bisect_left(self.starts, position - self.shift, self.shift_from)
+
+    def extend(self, starts, lengths):
+        """ Append matches found after every match already in the index """
+
+        self.flush()
+        self.starts.extend(starts)
+        self.lengths.extend(lengths)
+
+    def flush(self):
+        """ Apply the pending shift to the whole array """
+
+        self._apply(self.shift_from, len(self.starts), self.shift)
+        self.shift_from = 0
+        self.shift = 0
+
+    def replace_range(self, begin, end, delta, starts, lengths):
+        """ Replace the matches starting in [begin, end) and shift the rest
+
+        begin and end are offsets before the edit, delta is the change in
+        document length, starts and lengths are the matches found in the
+        rescanned range, already in offsets after the edit.
+        """
+
+        first = self.bisect(begin)
+        last = self.bisect(end)
+
+        if not self.shift:
+            shift_from = first
+        else:
+            shift_from = self.shift_from
+
+        if shift_from < first:
+            # pending shift starts before the edit: settle the entries in between
+            self._apply(shift_from, first, self.shift)
+            shift_from = last
+        elif shift_from > last:
+            # pending shift starts after the edit: the entries in between only move by delta
+            self._apply(last, shift_from, delta)
+        else:
+            shift_from = last
+
+        self.starts[first:last] = starts
+        self.lengths[first:last] = lengths
+
+        self.shift_from = shift_from + len(starts) - (last - first)
+        self.shift += delta
+
+        if self.shift_from >= len(self.starts):
+            self.shift_from = 0
+            self.shift = 0
+
+    def _apply(self, begin, end, delta):
+        if delta and begin < end:
+            self.starts[begin:end] = array('q', [start + delta for start in self.starts[begin:end]])
+
+
+class SearchWorker(QtCore.QThread):
+    """ Scan an immutable snapshot of the text off the GUI thread
+
+    Given a ScanProcess, the text is matched there instead, which is killed
+    when the search is cancelled or runs over its time budget.
+    """
+
+    # generation, starts, lengths of a batch of matches
+    found = QtCore.pyqtSignal(int, object, object)
+    # generation and whether the time budget ran out, emitted once the scan ends
+    done = QtCore.pyqtSignal(int, bool)
+
+    # Characters searched between two checks for cancellation
+    chunk_size = 1 << 20
+    # Seconds before the first batch and between the following ones
+    first_interval = 0.02
+    interval = 0.1
+    # Seconds between two checks for cancellation while a child process scans
+    poll_interval = 0.01
+
+    def __init__(self, text, matcher, generation, time_budget, scan_process=None):
+        super().__init__()
+        self.text = text
+        self.matcher = matcher
+        self.generation = generation
+        self.time_budget = time_budget
+        self.scan_process = scan_process
+
+    def run(self):
+        starts = array('q')
+        lengths = array('l')
+        interval = self.first_interval
+        last_emit = time.perf_counter()
+        deadline = last_emit + self.time_budget
+        timed_out = False
+
+        if self.scan_process is not None:
+            batches = self.scan_process.scan(self.text, self.matcher.key, self.chunk_size, self.poll_interval)
+        else:
+            batches = scan_windows(self.matcher, self.text, self.chunk_size)
+
+        for found_starts, found_lengths in batches:
+            if self.isInterruptionRequested():
+                batches.close()
+                return
+
+            starts.extend(found_starts)
+            lengths.extend(found_lengths)
+
+            now = time.perf_counter()
+            if now > deadline:
+                batches.close()
+                timed_out = True
+                break
+
+            if starts and now - last_emit >= interval:
+                self.found.emit(self.generation, starts, lengths)
+                starts = array('q')
+                lengths = array('l')
+                interval = self.interval
+                last_emit = now
+
+        self.found.emit(self.generation, starts, lengths)
+        self.done.emit(self.generation, timed_out)
+
+
+class SearchEngine(QtCore.QObject):
+    """ Find engine keeping a match index of the current query up to date """
+
+    # Emitted whenever the match index of the current query changes
+    changed = QtCore.pyqtSignal()
+
+    # Number of recent query indexes kept while the document is unchanged
+    cache_size = 8
+    # Documents with more characters are searched by a SearchWorker, and
+    # not rescanned as a whole on each edit of a regex query
+    background_threshold = 1 << 20
+    # Milliseconds without edits before an interrupted background search restarts
+    restart_delay = 250
+    # Seconds a whole document scan may take, and the rescan of an edit
+    time_budget = 5.0
+    edit_time_budget = 0.05
+
+    def __init__(self, document):
+        super().__init__()
+
+        self.document = None
+        self.query = ''
+        self.matcher = None
+        self.error = ''
+        self.timed_out = False
+        self.index = MatchIndex()
+        self.cache = collections.OrderedDict()
+
+        # Background search state
+
+        self.searching = False
+        self.generation = 0
+        self.workers = set()
+        self.snapshot = None
+        self.snapshot_revision = -1
+        self.scan_process = ScanProcess()
+
+        self.restart_timer = QtCore.QTimer(self)
+        self.restart_timer.setSingleShot(True)
+        self.restart_timer.setInterval(self.restart_delay)
+        self.restart_timer.timeout.connect(self.rescan)
+
+        QtCore.QCoreApplication.instance().aboutToQuit.connect(self.shutdown)
+
+        self.set_document(document)
+
+    def set_document(self, document):
+
+        if self.document is not None:
+            self.document.contentsChange.disconnect(self.contents_change)
+
+        self.document = document
+        self.document.contentsChange.connect(self.contents_change)
+        self.cache.clear()
+        self.snapshot = None
+        self.rescan()
+
+    # QUERY
+
+    def set_query(self, query, regex=False, case_sensitive=True, whole_word=False):
+        """ Search the document for query, reusing a cached index if any """
+
+        key = (query, regex, case_sensitive, whole_word)
+        if self.matcher is not None and key == self.matcher.key:
+            return
+
+        if self.matcher is not None and not self.busy() and not self.timed_out:
+            self.cache[self.matcher.key] = self.index
+            self.cache.move_to_end(self.matcher.key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        self.query = query
+        self.error = ''
+
+        try:
+            self.matcher = Matcher(*key) if query else None
+        except re.error as why:
+            self.matcher = None
+            self.error = str(why)
+
+        if key in self.cache:
+            self.cancel()
+            self.timed_out = False
+            self.index = self.cache.pop(key)
+            self.changed.emit()
+        else:
+            self.rescan()
+
+    def rescan(self):
+        """ Rebuild the match index from the whole document """
+
+        self.cancel()
+        self.timed_out = False
+        self.index = MatchIndex()
+
+        if self.matcher is None:
+            self.snapshot = None
+        elif self.matcher.pattern is None and self.document.characterCount() < self.background_threshold:
+            starts, lengths, _ = self.matcher.scan(self.document.toPlainText())
+            self.index = MatchIndex(starts, lengths)
+        else:
+            # patterns always run in a worker, so a pathological one can't hang the UI
+            self.search_in_background()
+
+        self.changed.emit()
+
+    # BACKGROUND SEARCH
+
+    def search_in_background(self):
+        """ Start a SearchWorker over a snapshot of the document """
+
+        # Queries typed one after the other share the snapshot
+        if self.snapshot is None or self.snapshot_revision != self.document.revision():
+            self.snapshot = self.document.toPlainText()
+            self.snapshot_revision = self.document.revision()
+
+        self.generation += 1
+        self.searching = True
+
+        worker = SearchWorker(self.snapshot, self.matcher, self.generation, self.time_budget,
+                              self.scan_process if self.matcher.untrusted else None)
+        worker.found.connect(self.worker_found)
+        worker.done.connect(self.worker_done)
+        worker.finished.connect(functools.partial(self.workers.discard, worker))
+        self.workers.add(worker)
+        worker.start()
+
+    def worker_found(self, generation, starts, lengths):
+        if generation == self.generation:
+            self.index.extend(starts, lengths)
+            self.changed.emit()
+
+    def worker_done(self, generation, timed_out):
+        if generation == self.generation:
+            self.searching = False
+            self.timed_out = timed_out
+            self.changed.emit()
+
+    def busy(self):
+        """ Whether the match index is still being rebuilt """
+        return self.searching or self.restart_timer.isActive()
+
+    def cancel(self):
+        """ Drop the results of the running background search """
+
+        self.restart_timer.stop()
+        self.generation += 1
+        self.searching = False
+        for worker in self.workers:
+            worker.requestInterruption()
+
+    def shutdown(self):
+        self.cancel()
+        for worker in list(self.workers):
+            worker.wait()
+        self.scan_process.kill()
+
+    # EDITS
+
+    def contents_change(self, position, removed, added):
+        """ Rescan only the blocks touched by an edit """
+
+        # Other queries and the snapshot are no longer valid for the edited document
+        self.cache.clear()
+        self.snapshot = None
+
+        if self.matcher is None:
+            return
+
+        # Regexes can backtrack for ever holding the GIL, and match across blocks.
+        # Small documents are rescanned whole in the ScanProcess within the edit budget.
+        if not self.busy() and self.matcher.untrusted and self.document.characterCount() < self.background_threshold:
+            found = self.scan_process.scan_now(self.document.toPlainText(), self.matcher.key,
+                                               self.edit_time_budget)
+            if found is not None:
+                self.index = MatchIndex(*found)
+                self.changed.emit()
+                return
+
+        # The snapshot being searched is outdated, search again once the edits settle
+        if self.busy() or self.matcher.untrusted:
+            self.cancel()
+            self.index = MatchIndex()
+            self.restart_timer.start()
+            self.changed.emit()
+            return
+
+        # Whole document replacement, or a needle that can span blocks
+        if (position == 0 and added >= self.document.characterCount() - 1) or self.matcher.spans_lines():
+            self.rescan()
+            return
+
+        first = self.document.findBlock(position)
+        last = self.document.findBlock(position + added)
+        if not last.isValid():
+            last = self.document.lastBlock()
+
+        begin = first.position()
+        end = last.position() + last.length() - 1
+        delta = added - removed
+
+        try:
+            deadline = time.perf_counter() + self.edit_time_budget
+            starts, lengths, _ = self.matcher.scan(block_range_text(first, last), offset=begin,
+                                                   deadline=deadline)
+        except SearchTimeout:
+            self.rescan()
+            return
+
+        self.index.replace_range(begin, end - delta, delta, starts, lengths)
+        self.changed.emit()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import PyQt5.QtCore as QtCore
+import PyQt5.QtWidgets as QtWidgets
+
+
+class StatusBar(QtWidgets.QStatusBar):
+    """ Status bar whose labels are created once and updated in place """
+
+    def __init__(self, text_widget):
+        super().__init__()
+
+        self.text_widget = text_widget
+        self.document = None
+
+        # Counters kept up to date from the document deltas
+
+        self.line_count = 1
+        self.char_count = 0
+        self.cursor_row = 1
+        self.cursor_column = 0
+        self.insert = True
+
+        # Labels
+
+        self.filepath_lbl = QtWidgets.QLabel()
+        self.filepath_lbl.setAlignment(QtCore.Qt.AlignLeft)
+
+        self.status_lbl = QtWidgets.QLabel()
+        self.status_lbl.setAlignment(QtCore.Qt.AlignLeft)
+
+        self.encoding_lbl = QtWidgets.QLabel()
+        self.encoding_lbl.setAlignment(QtCore.Qt.AlignCenter)
+
+        self.syntax_lbl = QtWidgets.QLabel('Default')
+        self.syntax_lbl.setAlignment(QtCore.Qt.AlignCenter)
+
+        self.undo_lbl = QtWidgets.QLabel()
+        self.undo_lbl.setAlignment(QtCore.Qt.AlignCenter)
+        self.undo_lbl.setToolTip('Memory held by the undo history')
+
+        self.addWidget(self.filepath_lbl, stretch=2)
+        self.addWidget(self.status_lbl, stretch=1)
+        self.addWidget(self.encoding_lbl, stretch=0)
+        self.addWidget(self.syntax_lbl, stretch=0)
+        self.addWidget(self.undo_lbl, stretch=0)
+
+        # Progress of long operations, hidden when idle
+
+        self.progress = QtWidgets.QProgressBar()
+        self.progress.setRange(0, 100)
+        self.progress.setMaximumWidth(150)
+        self.progress.hide()
+
+        self.cancel_btn = QtWidgets.QToolButton()
+        self.cancel_btn.setText('Cancel')
+        self.cancel_btn.hide()
+
+        self.addPermanentWidget(self.progress)
+        self.addPermanentWidget(self.cancel_btn)
+
+        self.set_document(text_widget.document())
+
+    def set_document(self, document):
+        """ Follow the contents changes of another document """
+
+        if self.document is not None:
+            self.document.contentsChange.disconnect(self.contents_change)
+
+        self.document = document
+        self.document.contentsChange.connect(self.contents_change)
+        self.count_contents()
+        self.refresh()
+
+    def count_contents(self):
+        """ Read the line and char counters from the document """
+
+        # QTextDocument keeps both counters itself, so this is O(1).
+        # characterCount() includes the final paragraph separator.
+        self.line_count = self.document.blockCount()
+        self.char_count = self.document.characterCount() - 1
+
+    def contents_change(self, position, removed, added):
+        """ Apply a contentsChange delta to the counters """
+
+        # Whole document replacements (setPlainText, clear) report the
+        # trailing paragraph separator as part of the delta, so the
+        # counters are read back instead of being summed.
+        self.count_contents()
+        self.refresh()
+
+    def update_cursor(self, cursor):
+        """ Update row and column from a text cursor """
+
+        self.cursor_row = cursor.blockNumber() + 1
+        self.cursor_column = cursor.positionInBlock()
+        self.refresh()
+
+    def set_insert(self, insert):
+        self.insert = insert
+        self.refresh()
+
+    def set_file_path(self, file_path):
+        self.filepath_lbl.setText(str(file_path))
+        self.filepath_lbl.setToolTip(str(file_path))
+
+    def set_encoding(self, encoding):
+        self.encoding_lbl.setText(encoding.upper())
+
+    def set_syntax(self, syntax):
+        self.syntax_lbl.setText(syntax)
+
+    def set_undo_memory(self, size):
+        """ Show the bytes held by the undo history, nothing for None """
+
+        if size is None:
+            self.undo_lbl.setText('')
+        elif size < 1024 * 1024:
+            self.undo_lbl.setText('Undo: {} KB'.format((size + 1023) // 1024))
+        else:
+            self.undo_lbl.setText('Undo: {:.1f} MB'.format(size / (1024 * 1024)))
+
+    def show_progress(self, percent):
+        self.progress.setValue(percent)
+        self.progress.show()
+        self.cancel_btn.show()
+
+    def hide_progress(self):
+        self.progress.hide()
+        self.cancel_btn.hide()
+
+    def show_line_index(self, line_count, size, row, complete):
+        """ Show the counters of a file read through a line index instead of a document, row None if unknown """
+
+        status_string = 'lines: {}{}  |  bytes: {}  |  Row: {}  |  READ ONLY'.format(
+            line_count, '' if complete else '+', size, '?' if row is None else row)
+
+        self.status_lbl.setText(status_string)
+
+    def refresh(self):
+        """ Rewrite the status label from the counters """
+
+        status_string = 'lines: {}  |  chars: {}  |  Col: {}  |  Row: {}'.format(
+            self.line_count, self.char_count, self.cursor_column, self.cursor_row)
+
+        if self.insert:
+            status_string += '  |  INS'
+        else:
+            status_string += '  |  OVR'
+
+        self.status_lbl.setText(status_string)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import os
+
+import PyQt5.QtWidgets as QtWidgets
+import fileio
+import journal
+import undo
+
+
+class Tab:
+    """ One open document: its editor, its file and the jobs following it
+
+    A tab opened from a path starts unloaded, its file is only read once
+    the tab is shown. Until then it has no editor, undo history or journal
+    either, see create_editor. Clean tabs can be unloaded again to free
+    memory, remembering where the cursor and the view were.
+    """
+
+    def __init__(self, path=None):
+
+        self.editor = None
+        # highlighter.LazyHighlighter, created once highlighting is turned on
+        self.syntax = None
+        self.journal = None
+        self.undo = None
+
+        # The editor, or the large file viewer once there is one
+        self.stack = QtWidgets.QStackedWidget()
+        self.viewer = None
+
+        self.file_path = (path, '') if path else './'
+        self.file_name = os.path.basename(path) if path else 'Untitled'
+        self.encoding = fileio.default_encoding()
+        self.has_changed = False
+
+        self.loaded = path is None
+        self.last_used = 0
+        # cursor position and scroll value to restore once loaded again
+        self.position = None
+        # line and column to go to once the file is read, for Find in Files
+        self.pending_goto = None
+
+        # Bytes of the file read so far, and the hashes of the lines read or saved
+        self.file_offset = 0
+        self.line_hashes = None
+        self.line_hashes_revision = -1
+
+        self.follower = None
+        self.follow_diverged = False
+        self.watched_path = None
+        self.changed_on_disk = False
+
+    def create_editor(self):
+        """ Create the editor, its undo history and its journal, the first time the tab is shown """
+
+        self.editor = QtWidgets.QPlainTextEdit()
+        self.journal = journal.Journal(self.editor.document())
+        self.undo = undo.UndoHistory(self.editor)
+        self.stack.insertWidget(0, self.editor)
+        self.stack.setCurrentWidget(self.editor)
+
+    def memory(self):
+        """ Rough size of the document in memory, in bytes """
+
+        if not self.loaded or self.editor is None:
+            return 0
+
+        # UTF-16 characters, plus the block structures and layouts
+        document = self.editor.document()
+        return document.characterCount() * 2 + document.blockCount() * 120
+
+    def unload(self):
+        """ Drop the document of a clean tab, it is read again when shown """
+
+        scroll_bar = self.editor.verticalScrollBar()
+        self.position = (self.editor.textCursor().position(), scroll_bar.value())
+
+        self.journal.stop()
+
+        # Without undo, clearing doesn't keep the text in the undo stack
+        document = self.editor.document()
+        document.setUndoRedoEnabled(False)
+        self.editor.clear()
+        document.setUndoRedoEnabled(True)
+
+        self.loaded = False
+        self.line_hashes = None
+
+    def close(self):
+        """ Stop the jobs of the tab before its widgets go """
+
+        if self.journal is not None:
+            self.journal.stop()
+        if self.syntax is not None:
+            self.syntax.setDocument(None)
+        if self.viewer is not None:
+            self.viewer.close_file()
+        self.stack.deleteLater()
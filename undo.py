@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    This file is part of Notepad.
+
+    Notepad is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import PyQt5.QtCore as QtCore
+import PyQt5.QtGui as QtGui
+
+
+def is_word(character):
+    return character.isalnum() or character == '_'
+
+
+class Step:
+    """ An undo step as seen from the contents changes it made
+
+    Its changes add up to replacing removed characters at start with
+    the added ones, suffix characters after them left as they were.
+    """
+
+    def __init__(self, count, size):
+        # Undo steps available once the step was made
+        self.count = count
+        self.size = size
+        self.start = None
+        self.removed = 0
+        self.added = 0
+        self.suffix = 0
+
+    def change(self, position, removed, added, length):
+        """ Widen the span of the step to a contents change, length the document length after it """
+
+        if self.start is None:
+            self.start, self.removed, self.added = position, removed, added
+        else:
+            begin = min(self.start, position)
+            end = max(self.start + self.added, position + removed)
+            self.removed += end - begin - self.added
+            self.added = end - begin - removed + added
+            self.start = begin
+        self.suffix = length - self.start - self.added
+
+
+class UndoHistory(QtCore.QObject):
+    """ Bound the undo stack of an editor and make typing undo a word at a time
+
+    QTextDocument keeps its undo stack to itself, with neither a limit
+    nor a size. The size is estimated from the contents changes: each
+    step holds the text it inserted and the text it removed. Once the
+    steps outnumber max_steps or outweigh budget bytes, the oldest are
+    dropped: the document can only clear its stack as a whole, so the
+    newest steps are undone, the stack cleared and the steps made again.
+    The newest step is always kept, however large.
+
+    Typed characters are inserted here, joined to the edit block of the
+    previous keystroke, so a step spans a word and the spaces after it
+    rather than everything typed without moving the cursor.
+    """
+
+    # Emitted when the estimated size of the history changes
+    changed = QtCore.pyqtSignal()
+    # Emitted once the oldest steps got dropped for being over the limits
+    trimmed = QtCore.pyqtSignal()
+
+    # Bytes counted per step besides its text
+    step_overhead = 64
+    # Share of the limits a trim goes down to, so the next one is a while away
+    trim_ratio = 0.75
+
+    def __init__(self, editor, max_steps=10000, budget=64 * 1024 * 1024):
+        super().__init__(editor)
+
+        self.editor = editor
+        self.document = editor.document()
+        self.max_steps = max_steps
+        self.budget = budget
+
+        self.steps = []
+        self.size = 0
+        # Undo steps available after the last change, and at the newest step
+        self.state = 0
+        self.top = 0
+        # Document length after the last change
+        self.length = self.document.characterCount() - 1
+        self.rebuilding = False
+
+        # Cursor position and undo steps after the last keystroke inserted here
+        self.typed = None
+        self.typed_word = False
+
+        self.trim_timer = QtCore.QTimer(self)
+        self.trim_timer.setSingleShot(True)
+        self.trim_timer.setInterval(0)
+        self.trim_timer.timeout.connect(self.trim)
+
+        self.document.undoCommandAdded.connect(self.step_added)
+        self.document.contentsChange.connect(self.contents_change)
+        editor.installEventFilter(self)
+
+    def set_limits(self, max_steps, budget):
+        self.max_steps = max_steps
+        self.budget = budget
+        self.check_limits()
+
+    def memory(self):
+        """ Estimated bytes held by the undo and redo steps """
+        return self.size
+
+    # ACCOUNTING
+
+    def step_added(self):
+
+        count = self.document.availableUndoSteps()
+
+        # Edit blocks joined to the newest step signal without adding one
+        if self.steps and self.state == self.top == count:
+            return
+
+        # A new step drops the steps that were undone
+        while self.steps and self.steps[-1].count > self.state:
+            self.size -= self.steps.pop().size
+
+        self.steps.append(Step(count, self.step_overhead))
+        self.size += self.step_overhead
+        self.state = self.top = count
+
+    def contents_change(self, position, removed, added):
+
+        if self.rebuilding:
+            return
+
+        count = self.document.availableUndoSteps()
+        length = self.document.characterCount() - 1
+
+        # Whole document replacements report a wrong delta, as the journal found
+        if removed - added != self.length - length:
+            added = min(added, length - position)
+            removed = added + self.length - length
+        self.length = length
+
+        if not self.document.isUndoRedoEnabled():
+            # Disabling undo clears the stacks, as loads and unloads do
+            self.clear()
+        elif self.steps and self.state == self.top and count >= self.top:
+            # An edit at the newest step, undo and redo move below it
+            step = self.steps[-1]
+            step.count = count
+            step.size += (removed + added) * 2
+            step.change(position, removed, added, length)
+            self.size += (removed + added) * 2
+            self.top = count
+
+        self.state = count
+        self.check_limits()
+        self.changed.emit()
+
+    def check_limits(self):
+        if len(self.steps) > self.max_steps or self.size > self.budget:
+            # Not within the change, the document is still applying it
+            self.trim_timer.start()
+
+    def kept_steps(self):
+        """ Number of newest steps within trim_ratio of the limits, at least one """
+
+        max_steps = max(1, int(self.max_steps * self.trim_ratio))
+        budget = self.budget * self.trim_ratio
+        kept = size = 0
+        for step in reversed(self.steps):
+            size += step.size
+            if kept and (kept >= max_steps or size > budget):
+                break
+            kept += 1
+        return kept
+
+    def trim(self):
+        """ Drop the oldest steps if the history is still over its limits """
+
+        if len(self.steps) <= self.max_steps and self.size <= self.budget:
+            return
+        # Steps undone are dropped by the next edit anyway, trim then
+        if self.document.availableRedoSteps():
+            return
+
+        kept = self.kept_steps()
+        if kept >= len(self.steps):
+            return
+
+        self.rebuild(self.steps[-kept:], self.steps[-kept - 1].count)
+        self.changed.emit()
+        self.trimmed.emit()
+
+    def rebuild(self, steps, count):
+        """ Make the undo stack hold only steps, count the undo steps available before them """
+
+        editor = self.editor
+        document = self.document
+        cursor = editor.textCursor()
+        anchor, position = cursor.anchor(), cursor.position()
+        scroll = editor.horizontalScrollBar().value(), editor.verticalScrollBar().value()
+        typing = self.typed == (position, self.top)
+
+        # The round trip ends on the same text, listeners hear of it once at the end
+        blocked = document.blockSignals(True)
+        try:
+            for step in steps:
+                document.undo()
+
+            if document.availableUndoSteps() != count:
+                # Out of step with the document, clear it all as a last resort
+                for step in steps:
+                    document.redo()
+                steps = texts = []
+            else:
+                # Redo a step at a time to read the text each one added
+                texts = []
+                for step in steps:
+                    document.redo()
+                    texts.append(self.text(step.start, step.added))
+                for step in steps:
+                    document.undo()
+
+            document.clearUndoRedoStacks()
+            self.clear()
+
+            for step, text in zip(steps, texts):
+                if step.start is not None:
+                    cursor = QtGui.QTextCursor(document)
+                    cursor.beginEditBlock()
+                    cursor.setPosition(step.start)
+                    cursor.setPosition(step.start + step.removed, QtGui.QTextCursor.KeepAnchor)
+                    cursor.insertText(text)
+                    cursor.endEditBlock()
+                step.count = document.availableUndoSteps()
+                self.steps.append(step)
+                self.size += step.size
+        finally:
+            document.blockSignals(blocked)
+
+        self.state = self.top = document.availableUndoSteps()
+        self.length = document.characterCount() - 1
+        if typing:
+            self.typed = (position, self.top)
+
+        cursor = editor.textCursor()
+        cursor.setPosition(anchor)
+        cursor.setPosition(position, QtGui.QTextCursor.KeepAnchor)
+        editor.setTextCursor(cursor)
+        editor.horizontalScrollBar().setValue(scroll[0])
+        editor.verticalScrollBar().setValue(scroll[1])
+
+        # Highlighting and matches of the span the steps touched are redone
+        touched = [step for step in steps if step.start is not None]
+        if touched:
+            start = min(step.start for step in touched)
+            length = self.length - min(step.suffix for step in touched) - start
+            self.rebuilding = True
+            try:
+                document.contentsChange.emit(start, length, length)
+            finally:
+                self.rebuilding = False
+
+    def text(self, start, length):
+        cursor = QtGui.QTextCursor(self.document)
+        cursor.setPosition(start)
+        cursor.setPosition(start + length, QtGui.QTextCursor.KeepAnchor)
+        return cursor.selectedText().replace('\u2029', '\n')
+
+    def clear(self):
+        self.steps = []
+        self.size = 0
+        self.state = self.top = 0
+        self.typed = None
+
+    # TYPING
+
+    def eventFilter(self, editor, event):
+
+        if event.type() == QtCore.QEvent.KeyPress:
+            return self.type_text(event)
+        return False
+
+    def type_text(self, event):
+        """ Insert a typed character as part of the current word step, False to let the editor do it """
+
+        text = event.text()
+        modifiers = QtCore.Qt.ControlModifier | QtCore.Qt.AltModifier | QtCore.Qt.MetaModifier
+        if (not text or not text.isprintable() or event.modifiers() & modifiers or
+                self.editor.isReadOnly() or self.editor.overwriteMode()):
+            return False
+
+        cursor = self.editor.textCursor()
+        if cursor.hasSelection() or not self.document.isUndoRedoEnabled():
+            return False
+
+        # A word starts a step, what follows it up to the next word joins it
+        word = is_word(text[0])
+        if self.typed == (cursor.position(), self.document.availableUndoSteps()) and not (word and not self.typed_word):
+            cursor.joinPreviousEditBlock()
+        else:
+            cursor.beginEditBlock()
+        cursor.insertText(text)
+        cursor.endEditBlock()
+
+        self.editor.setTextCursor(cursor)
+        self.editor.ensureCursorVisible()
+
+        self.typed = (cursor.position(), self.document.availableUndoSteps())
+        self.typed_word = is_word(text[-1])
+        return True